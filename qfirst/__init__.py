@@ -1,5 +0,0 @@
-import qfirst.data.dataset_readers
-import qfirst.modules
-import qfirst.models
-import qfirst.nn
-import qfirst.predictors
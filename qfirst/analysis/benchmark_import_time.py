@@ -0,0 +1,57 @@
+import argparse, os, statistics, subprocess, sys
+
+# Measures the time until a model's components are registered, in fresh interpreters:
+# eagerly importing all of qfirst (import_submodules("qfirst"), as the scripts used to)
+# versus importing only the modules the model's config references (qfirst.registry.import_for_config).
+# Both include the time to import allennlp itself, which is also reported on its own as the baseline.
+
+_timed_template = """
+import sys, time
+sys.path.append(".")
+start_time = time.time()
+%s
+print(time.time() - start_time)
+"""
+
+_baseline_code = """
+from allennlp.common.params import Params
+from allennlp.models.archival import Archive
+"""
+
+_eager_code = _baseline_code + """
+from allennlp.common.util import import_submodules
+import_submodules("qfirst")
+"""
+
+_lazy_code = _baseline_code + """
+from qfirst.registry import import_for_config
+import_for_config(Params.from_file(%s))
+"""
+
+def time_in_subprocess(code: str) -> float:
+    output = subprocess.check_output([sys.executable, "-c", _timed_template % code])
+    return float(output.decode("utf8").strip().split("\n")[-1])
+
+def main(model_path: str, num_runs: int) -> None:
+    settings = [
+        ("allennlp only", _baseline_code),
+        ("eager (all of qfirst)", _eager_code),
+        ("lazy (from config)", _lazy_code % repr(os.path.join(model_path, "config.json")))
+    ]
+    eager_time = None
+    for name, code in settings:
+        times = [time_in_subprocess(code) for _ in range(num_runs)]
+        median_time = statistics.median(times)
+        if name.startswith("eager"):
+            eager_time = median_time
+        print("%-24s %8.3fs median %8.3fs min" % (name, median_time, min(times)))
+    print("Lazy speedup over eager: %.2fx" % (eager_time / median_time))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark eager versus config-driven import of qfirst")
+    parser.add_argument('--model', type=str, help = "Path to model serialization dir, whose config.json to import for.")
+    parser.add_argument('--num_runs', type=int, default = 5)
+
+    args = parser.parse_args()
+    main(model_path = args.model,
+         num_runs = args.num_runs)
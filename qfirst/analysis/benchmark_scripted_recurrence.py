@@ -0,0 +1,91 @@
+ # completely ridiculous hack to import stuff properly. somebody save me from myself
+import importlib
+importlib.invalidate_caches()
+import sys
+sys.path.append(".")
+
+import torch, os, json, argparse, time
+
+from allennlp.common.checks import check_for_gpu
+from allennlp.common.file_utils import cached_path
+from allennlp.data import DatasetReader
+from allennlp.data.dataset import Batch
+from allennlp.nn.util import move_to_device
+
+from qfirst.data.util import read_lines
+from qfirst.util.archival_utils import load_archive_from_folder
+
+# Compares per-question beam decoding latency of a question model's slot sequence generator
+# with the eager recurrence against the TorchScript-compiled one, and checks that they give the same beams.
+
+def decode_all(model, input_tensor_dicts, max_beam_size, min_beam_probability):
+    beams = []
+    start_time = time.time()
+    with torch.no_grad():
+        for input_tensors in input_tensor_dicts:
+            _, slots, probs = model.beam_decode(
+                text = input_tensors["text"],
+                predicate_indicator = input_tensors["predicate_indicator"],
+                predicate_index = input_tensors["predicate_index"],
+                max_beam_size = max_beam_size,
+                min_beam_probability = min_beam_probability)
+            beams.append((slots, probs))
+    return beams, time.time() - start_time
+
+def main(model_path: str,
+         cuda_device: int,
+         input_file: str,
+         max_sentences: int,
+         max_beam_size: int,
+         min_beam_probability: float) -> None:
+    check_for_gpu(cuda_device)
+    archive = load_archive_from_folder(model_path, cuda_device = cuda_device, weights_file = os.path.join(model_path, "best.th"))
+    model = archive.model
+    model.eval()
+    dataset_reader = DatasetReader.from_params(archive.config["dataset_reader"].duplicate())
+    input_tensor_dicts = []
+    for i, line in enumerate(read_lines(cached_path(input_file))):
+        if max_sentences is not None and i >= max_sentences:
+            break
+        for instance in dataset_reader.sentence_json_to_instances(json.loads(line), verbs_only = True):
+            instance.index_fields(model.vocab)
+            input_tensor_dicts.append(move_to_device(Batch([instance]).as_tensor_dict(), cuda_device))
+
+    generator = model._question_generator
+    generator._script_inference = False
+    eager_beams, eager_time = decode_all(model, input_tensor_dicts, max_beam_size, min_beam_probability)
+    generator._script_inference = True
+    generator.get_scripted() # compile before timing
+    scripted_beams, scripted_time = decode_all(model, input_tensor_dicts, max_beam_size, min_beam_probability)
+
+    num_questions = sum([len(probs) for _, probs in eager_beams])
+    num_mismatches = 0
+    max_prob_diff = 0.0
+    for (eager_slots, eager_probs), (scripted_slots, scripted_probs) in zip(eager_beams, scripted_beams):
+        if eager_slots != scripted_slots:
+            num_mismatches += 1
+        else:
+            for p, q in zip(eager_probs, scripted_probs):
+                max_prob_diff = max(max_prob_diff, abs(p - q))
+    print("Verbs: %d; questions: %d" % (len(input_tensor_dicts), num_questions))
+    print("Eager:    %8.3f ms/question" % (1000 * eager_time / max(num_questions, 1)))
+    print("Scripted: %8.3f ms/question" % (1000 * scripted_time / max(num_questions, 1)))
+    print("Speedup:  %8.3fx" % (eager_time / scripted_time))
+    print("Verbs with different beams: %d; max question prob difference: %g" % (num_mismatches, max_prob_diff))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the TorchScript slot recurrence against the eager one")
+    parser.add_argument('--question', type=str, help = "Path to question generator model serialization dir.")
+    parser.add_argument('--cuda_device', type=int, default=-1)
+    parser.add_argument('--input_file', type=str)
+    parser.add_argument('--max_sentences', type=int, default = None)
+    parser.add_argument('--question_beam_size', type=int, default = 20)
+    parser.add_argument('--question_min_prob', type=float, default = 0.01)
+
+    args = parser.parse_args()
+    main(model_path = args.question,
+         cuda_device = args.cuda_device,
+         input_file = args.input_file,
+         max_sentences = args.max_sentences,
+         max_beam_size = args.question_beam_size,
+         min_beam_probability = args.question_min_prob)
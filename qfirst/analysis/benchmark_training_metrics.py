@@ -0,0 +1,104 @@
+ # completely ridiculous hack to import stuff properly. somebody save me from myself
+import importlib
+importlib.invalidate_caches()
+import sys
+sys.path.append(".")
+
+import torch, os, argparse, time
+
+from allennlp.common.checks import check_for_gpu
+from allennlp.data import DatasetReader
+from allennlp.data.iterators import BasicIterator
+from allennlp.nn.util import move_to_device
+from allennlp.training import util as training_util
+
+from qfirst.metrics.metric_schedule import MetricSchedule
+from qfirst.util.archival_utils import load_archive_from_folder
+
+# Measures training throughput (batches/sec) of a model under different metric settings:
+# eager metrics on every batch, deferred (on-device) metric accumulation, and metrics on every N-th batch.
+# Batches are run as in the allennlp trainer (see train_batches), so deferred metrics are only
+# transferred from the device at the end of each run.
+
+def configure_metrics(model, compute_every: int, deferred: bool):
+    for module in model.modules():
+        if hasattr(module, "_metric_schedule"):
+            module._metric_schedule = MetricSchedule(compute_every)
+        for value in list(vars(module).values()):
+            if hasattr(value, "_deferred") and hasattr(value, "get_metric"):
+                # flush whatever was accumulated under the previous setting
+                value.get_metric(reset = True)
+                value._deferred = deferred
+
+def train_batches(model, optimizer, batches, cuda_device):
+    # as in the allennlp trainer's epoch loop: the loss is accumulated on the host and metrics are fetched
+    # for the progress bar after every batch, then fetched with reset at the end of the epoch
+    model.train()
+    start_time = time.time()
+    train_loss = 0.0
+    for batches_this_epoch, batch in enumerate(batches, 1):
+        optimizer.zero_grad()
+        loss = model(**move_to_device(batch, cuda_device))["loss"]
+        loss.backward()
+        train_loss += loss.item()
+        optimizer.step()
+        training_util.get_metrics(model, train_loss, batches_this_epoch)
+    training_util.get_metrics(model, train_loss, len(batches), reset = True)
+    if cuda_device >= 0:
+        torch.cuda.synchronize()
+    return time.time() - start_time
+
+def main(model_path: str,
+         cuda_device: int,
+         input_file: str,
+         batch_size: int,
+         num_batches: int,
+         compute_every: int) -> None:
+    check_for_gpu(cuda_device)
+    archive = load_archive_from_folder(model_path, cuda_device = cuda_device, weights_file = os.path.join(model_path, "best.th"))
+    model = archive.model
+    dataset_reader = DatasetReader.from_params(archive.config["dataset_reader"].duplicate())
+    instances = []
+    for instance in dataset_reader.read(input_file):
+        instances.append(instance)
+        if len(instances) >= batch_size * num_batches:
+            break
+    iterator = BasicIterator(batch_size = batch_size)
+    iterator.index_with(model.vocab)
+    batches = list(iterator(instances, num_epochs = 1, shuffle = False))
+    optimizer = torch.optim.SGD([p for p in model.parameters() if p.requires_grad], lr = 0.0)
+
+    settings = [
+        ("eager", 1, False),
+        ("deferred", 1, True),
+        ("every %d" % compute_every, compute_every, False),
+        ("deferred, every %d" % compute_every, compute_every, True)
+    ]
+    # warm up (allocator, cudnn) before timing
+    configure_metrics(model, 1, False)
+    train_batches(model, optimizer, batches[:2], cuda_device)
+    print("Batches: %d of size %d" % (len(batches), batch_size))
+    eager_time = None
+    for name, every, deferred in settings:
+        configure_metrics(model, every, deferred)
+        elapsed = train_batches(model, optimizer, batches, cuda_device)
+        if eager_time is None:
+            eager_time = elapsed
+        print("%-24s %10.3f batches/sec %8.3fx" % (name, len(batches) / elapsed, eager_time / elapsed))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark training throughput under different metric computation settings")
+    parser.add_argument('--model', type=str, help = "Path to model serialization dir.")
+    parser.add_argument('--cuda_device', type=int, default=-1)
+    parser.add_argument('--input_file', type=str, help = "Training data to run batches from.")
+    parser.add_argument('--batch_size', type=int, default = 32)
+    parser.add_argument('--num_batches', type=int, default = 50)
+    parser.add_argument('--compute_every', type=int, default = 10)
+
+    args = parser.parse_args()
+    main(model_path = args.model,
+         cuda_device = args.cuda_device,
+         input_file = args.input_file,
+         batch_size = args.batch_size,
+         num_batches = args.num_batches,
+         compute_every = args.compute_every)
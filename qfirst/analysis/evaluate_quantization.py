@@ -0,0 +1,77 @@
+ # completely ridiculous hack to import stuff properly. somebody save me from myself
+import importlib
+importlib.invalidate_caches()
+import sys
+sys.path.append(".")
+
+import torch, os, argparse, time
+
+from allennlp.data import DatasetReader
+from allennlp.data.iterators import BasicIterator
+
+from qfirst.util.archival_utils import load_archive_from_folder
+
+# Compares the dev metrics (e.g., full-question-acc for question models, span F1 for span models)
+# and throughput of a model on CPU against its dynamically int8-quantized version,
+# or against another model of the same type (e.g., a distilled student, see export_distilled_model.py).
+
+def evaluate(model, instances, batch_size):
+    iterator = BasicIterator(batch_size = batch_size)
+    iterator.index_with(model.vocab)
+    model.eval()
+    model.get_metrics(reset = True)
+    start_time = time.time()
+    with torch.no_grad():
+        for batch in iterator(instances, num_epochs = 1, shuffle = False):
+            model(**batch)
+    elapsed = time.time() - start_time
+    metrics = model.get_metrics(reset = True)
+    metrics["instances/sec"] = len(instances) / elapsed
+    return metrics
+
+def main(model_path: str,
+         input_file: str,
+         batch_size: int,
+         num_threads: int,
+         compare_model_path: str = None) -> None:
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    weights_file = os.path.join(model_path, "best.th")
+    print("Loading models...", flush = True)
+    float_archive = load_archive_from_folder(model_path, cuda_device = -1, weights_file = weights_file)
+    if compare_model_path is None:
+        other_name = "int8"
+        other_archive = load_archive_from_folder(model_path, cuda_device = -1, weights_file = weights_file, quantize = True)
+        # the slot decoder runs its cells from lists, so make sure those are the quantized ones
+        question_generator = getattr(other_archive.model, "_question_generator", None)
+        if question_generator is not None:
+            cell_type = type(question_generator._rnn_cells[0][0])
+            if cell_type is not torch.nn.quantized.dynamic.LSTMCell:
+                raise RuntimeError("Question generator cells were not quantized (got %s)." % cell_type.__name__)
+    else:
+        other_name = "other"
+        other_archive = load_archive_from_folder(compare_model_path, cuda_device = -1, weights_file = os.path.join(compare_model_path, "best.th"))
+    dataset_reader_params = float_archive.config.get("validation_dataset_reader", float_archive.config["dataset_reader"]).duplicate()
+    instances = list(DatasetReader.from_params(dataset_reader_params).read(input_file))
+    print("Evaluating on %d instances..." % len(instances), flush = True)
+    float_metrics = evaluate(float_archive.model, instances, batch_size)
+    other_metrics = evaluate(other_archive.model, instances, batch_size)
+    print("%-32s %12s %12s %12s" % ("metric", "float", other_name, "delta"))
+    for k in sorted(float_metrics.keys()):
+        if k in other_metrics and isinstance(float_metrics[k], float):
+            print("%-32s %12.4f %12.4f %+12.4f" % (k, float_metrics[k], other_metrics[k], other_metrics[k] - float_metrics[k]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare a model against its int8-quantized version (or another model) on a dev file")
+    parser.add_argument('--model', type=str, help = "Path to model serialization dir.")
+    parser.add_argument('--input_file', type=str, help = "Dev data to evaluate on.")
+    parser.add_argument('--batch_size', type=int, default = 32)
+    parser.add_argument('--num_threads', type=int, default = None)
+    parser.add_argument('--compare_model', type=str, default = None, help = "Model serialization dir to compare against instead of the quantized model.")
+
+    args = parser.parse_args()
+    main(model_path = args.model,
+         input_file = args.input_file,
+         batch_size = args.batch_size,
+         num_threads = args.num_threads,
+         compare_model_path = args.compare_model)
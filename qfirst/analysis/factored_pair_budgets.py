@@ -0,0 +1,115 @@
+ # completely ridiculous hack to import stuff properly. somebody save me from myself
+import importlib
+importlib.invalidate_caches()
+import sys
+sys.path.append(".")
+
+import json, argparse, time
+
+from allennlp.common.checks import check_for_gpu
+from allennlp.common.file_utils import cached_path
+
+from qfirst.data.util import read_lines
+from qfirst.data.qasrl_instance_reader import QasrlQuestionFactoredReader
+from qfirst.pipelines.factored_pipeline import FactoredPipeline, load_pipeline_models
+from qfirst.pipelines.factored_pipeline import clause_minimum_threshold_default, span_minimum_threshold_default, tan_minimum_threshold_default
+
+# Measures throughput of the factored pipeline against recall of gold QA pairs
+# for several joint clause x span budgets (max pairs per verb / min joint probability).
+
+def get_gold_sets(gold_reader, qasrl_filter, token_indexers, sentence_json):
+    gold_sets = {}
+    for verb_dict in qasrl_filter.filter_sentence(sentence_json):
+        for instance_dict in gold_reader.read_instances(token_indexers, **verb_dict):
+            gold_sets[verb_dict["verb_index"]] = instance_dict["metadata"].metadata["gold_set"]
+    return gold_sets
+
+def run_budget(pipeline, sentence_jsons, gold_sets, qarg_min_prob):
+    num_gold_pairs, num_covered_pairs = 0, 0
+    num_gold_qas, num_covered_qas = 0, 0
+    num_verbs, num_scored_pairs = 0, 0
+    start_time = time.time()
+    outputs = [pipeline.predict(sentence_json) for sentence_json in sentence_jsons]
+    elapsed = time.time() - start_time
+    for output, sentence_gold_sets in zip(outputs, gold_sets):
+        for verb in output["verbs"]:
+            num_verbs += 1
+            qa_beam = verb["beam"]["qa_beam"]
+            num_scored_pairs += len(qa_beam)
+            gold_set = sentence_gold_sets.get(verb["verbIndex"], set())
+            # gold spans are inclusive; beam spans are exclusive
+            pred_pairs = set([(e["clause"], (e["span"][0], e["span"][1] - 1)) for e in qa_beam])
+            pred_qas = set([
+                (e["clause"], qarg, (e["span"][0], e["span"][1] - 1))
+                for e in qa_beam
+                for qarg, p in e["answerSlots"].items()
+                if p >= qarg_min_prob
+            ])
+            gold_pairs = set([(clause, span) for clause, _, span in gold_set])
+            num_gold_pairs += len(gold_pairs)
+            num_covered_pairs += len(gold_pairs & pred_pairs)
+            num_gold_qas += len(gold_set)
+            num_covered_qas += len(gold_set & pred_qas)
+    return {
+        "sentences/sec": len(sentence_jsons) / elapsed,
+        "verbs/sec": num_verbs / elapsed,
+        "pairs/verb": num_scored_pairs / max(num_verbs, 1),
+        "pair recall": num_covered_pairs / max(num_gold_pairs, 1),
+        "QA recall": num_covered_qas / max(num_gold_qas, 1)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Report throughput versus gold QA recall of the factored pipeline at several clause x span budgets")
+    parser.add_argument('--clause', type=str, help = "Path to clause detector model serialization dir.")
+    parser.add_argument('--span', type=str, help = "Path to span detector model serialization dir.")
+    parser.add_argument('--answer_slot', type=str, help = "Path to answer slot model serialization dir.")
+    parser.add_argument('--tan', type=str, help = "Path to TAN model serialization dir.")
+    parser.add_argument('--span_to_tan', type=str, help = "Path to TAN model serialization dir.")
+    parser.add_argument('--animacy', type=str, help = "Path to animacy model serialization dir .")
+    parser.add_argument('--cuda_device', type=int, default=-1)
+    parser.add_argument('--input_file', type=str, help = "Gold QA-SRL data.")
+    parser.add_argument('--clause_info_file', type=str, help = "Clause info for the gold QA-SRL data.")
+    parser.add_argument('--max_sentences', type=int, default = None)
+    parser.add_argument('--clause_min_prob', type=float, default = clause_minimum_threshold_default)
+    parser.add_argument('--span_min_prob', type=float, default = span_minimum_threshold_default)
+    parser.add_argument('--tan_min_prob', type=float, default = tan_minimum_threshold_default)
+    parser.add_argument('--qarg_min_prob', type=float, default = 0.5)
+    parser.add_argument('--max_pairs', type=str, default = "-1,64,32,16,8,4", help = "Comma-separated max pairs per verb; -1 means no limit.")
+    parser.add_argument('--pair_min_probs', type=str, default = "0.0,0.01,0.05", help = "Comma-separated min joint pair probabilities.")
+    args = parser.parse_args()
+
+    check_for_gpu(args.cuda_device)
+    models = load_pipeline_models(
+        clause_model_path = args.clause,
+        span_model_path = args.span,
+        answer_slot_model_path = args.answer_slot,
+        tan_model_path = args.tan,
+        span_to_tan_model_path = args.span_to_tan,
+        animacy_model_path = args.animacy,
+        cuda_device = args.cuda_device)
+
+    sentence_jsons = []
+    for line in read_lines(cached_path(args.input_file)):
+        sentence_jsons.append(json.loads(line))
+        if args.max_sentences is not None and len(sentence_jsons) >= args.max_sentences:
+            break
+    answer_slot_reader = models["answer_slot_model_dataset_reader"]
+    gold_reader = QasrlQuestionFactoredReader(clause_info_files = [args.clause_info_file])
+    gold_sets = [
+        get_gold_sets(gold_reader, answer_slot_reader._qasrl_filter, answer_slot_reader._token_indexers, sentence_json)
+        for sentence_json in sentence_jsons
+    ]
+
+    for max_pairs in [int(x) for x in args.max_pairs.split(",")]:
+        for pair_min_prob in [float(x) for x in args.pair_min_probs.split(",")]:
+            pipeline = FactoredPipeline(
+                **models,
+                clause_minimum_threshold = args.clause_min_prob,
+                span_minimum_threshold = args.span_min_prob,
+                tan_minimum_threshold = args.tan_min_prob,
+                max_pairs_per_verb = max_pairs if max_pairs > 0 else None,
+                pair_minimum_threshold = pair_min_prob)
+            results = run_budget(pipeline, sentence_jsons, gold_sets, args.qarg_min_prob)
+            print("max pairs: %s, min pair prob: %.3f" % (max_pairs if max_pairs > 0 else "all", pair_min_prob))
+            for k, v in results.items():
+                print("    %s: %.4f" % (k, v))
@@ -1,10 +1,8 @@
  # completely ridiculous hack to import stuff properly. somebody save me from myself
 import importlib
-from allennlp.common.util import import_submodules
 importlib.invalidate_caches()
 import sys
 sys.path.append(".")
-import_submodules("qfirst")
 
 from typing import List, Iterator, Optional
 
@@ -214,16 +212,18 @@ def main(model_path: str,
     model = model_archive.model
     dataset_reader = DatasetReader.from_params(model_archive.config["dataset_reader"].duplicate())
     print("Model loaded. Running...", flush = True)
+    model.eval()
+    all_frame_probs = model.get_frame_clause_probs().tolist()
+    frame_biases = model._frame_pred.bias.tolist()
     frames = []
     for fi in range(model._num_frames):
-        frame_bias = model._frame_pred.bias[fi]
-        frame_logits = model._frames_matrix[fi]
-        frame_probs = F.softmax(frame_logits)
+        frame_bias = frame_biases[fi]
+        frame_probs = all_frame_probs[fi]
         clauses = []
         for ci in range(model.vocab.get_vocab_size("abst-clause-labels")):
-            clause = model.vocab.get_token_from_index(ci, namespace = "abst-clause-labels")
-            clause_prob = frame_probs[ci].item()
+            clause_prob = frame_probs[ci]
             if clause_prob >= clause_min_prob:
+                clause = model.vocab.get_token_from_index(ci, namespace = "abst-clause-labels")
                 clauses.append((clause, clause_prob))
         clauses.sort(key = lambda t: -t[1])
         frames.append((clauses, frame_bias))
@@ -0,0 +1,51 @@
+from typing import Dict, List, Tuple
+
+import json
+import os
+
+import numpy
+
+# On-disk store of precomputed contextual features (e.g., all ELMo layers) for every token of every sentence.
+# Written by qfirst/scripts/write_elmo.py --feature_store; files for a given prefix:
+#   <prefix>_features_meta.json: { "numLayers": ..., "dim": ... }
+#   <prefix>_features_index.jsonl: { "sentenceId": ..., "sentenceTokens": [...], "offset": ... } per sentence
+#   <prefix>_features.bin: float32 array of shape (total_num_tokens, num_layers, dim), sentences laid out consecutively
+# Each sentence's tokens occupy rows offset ... offset + len(sentenceTokens) - 1.
+# Features are looked up by a sentence's (cleansed) tokens rather than its id, since token indexers only see the tokens.
+# The features depend only on the tokens, so sentences with identical tokens share rows,
+# while differently tokenized versions of the same text are kept apart.
+
+_stores = {}
+
+def get_feature_store(file_prefix: str) -> "PrecomputedFeatureStore":
+    # stores are shared between the indexer and embedder (and all models) in a process
+    file_prefix = os.path.abspath(file_prefix)
+    if file_prefix not in _stores:
+        _stores[file_prefix] = PrecomputedFeatureStore(file_prefix)
+    return _stores[file_prefix]
+
+class PrecomputedFeatureStore():
+    def __init__(self, file_prefix: str) -> None:
+        with open(file_prefix + "_features_meta.json", "r") as f:
+            meta = json.load(f)
+        self.num_layers = meta["numLayers"]
+        self.dim = meta["dim"]
+        self._token_offsets: Dict[Tuple[str, ...], int] = {}
+        with open(file_prefix + "_features_index.jsonl", "r") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._token_offsets[tuple(entry["sentenceTokens"])] = entry["offset"]
+        num_rows = os.path.getsize(file_prefix + "_features.bin") // (4 * self.num_layers * self.dim)
+        self.features = numpy.memmap(file_prefix + "_features.bin", dtype = numpy.float32, mode = "r",
+                                     shape = (num_rows, self.num_layers, self.dim))
+
+    def get_token_rows(self, sentence_tokens: List[str]) -> List[int]:
+        key = tuple(sentence_tokens)
+        if key not in self._token_offsets:
+            raise KeyError("No precomputed features for sentence: %s" % " ".join(sentence_tokens))
+        offset = self._token_offsets[key]
+        return list(range(offset, offset + len(sentence_tokens)))
+
+    def get_features(self, rows: numpy.ndarray) -> numpy.ndarray:
+        # Shape: rows.shape, num_layers, dim
+        return self.features[rows]
@@ -32,14 +32,15 @@ class QasrlInstanceReader(Registrable):
 
 @QasrlInstanceReader.register("verb_only")
 class QasrlVerbOnlyReader(QasrlInstanceReader):
+    # also reads unlabeled data (e.g., for distillation), where verbs may not have questions or inflected forms
     @overrides
     def read_instances(self,
                        token_indexers: Dict[str, TokenIndexer],
                        sentence_id: str,
                        sentence_tokens: List[str],
                        verb_index: int,
-                       verb_inflected_forms: Dict[str, str],
-                       question_labels): # Iterable[Instance]
+                       verb_inflected_forms: Dict[str, str] = None,
+                       question_labels = None): # Iterable[Instance]
         yield get_verb_fields(token_indexers, sentence_tokens, verb_index)
 
 # simple_clause_arg_slots = ["subj", "obj", "obj2"]
@@ -0,0 +1,77 @@
+from typing import Dict, List, Tuple
+
+import hashlib
+import json
+import logging
+import os
+
+from overrides import overrides
+
+from allennlp.data.vocabulary import Vocabulary
+from allennlp.data.tokenizers.token import Token
+from allennlp.data.token_indexers.token_indexer import TokenIndexer
+from allennlp.data.token_indexers.wordpiece_indexer import PretrainedBertIndexer
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# (indexer settings) -> (sentence tokens -> indexer output), shared by all indexers with the same settings in a process
+_caches: Dict[Tuple, Dict[Tuple[str, ...], Dict[str, List[int]]]] = {}
+
+@TokenIndexer.register("bert-pretrained-cached")
+class CachedPretrainedBertIndexer(PretrainedBertIndexer):
+    """
+    A ``bert-pretrained`` indexer which remembers the wordpiece ids and offsets of every sentence it has indexed,
+    so each sentence is only wordpiece-tokenized once, no matter how many verbs (instances) or models it appears in.
+    If ``cache_file`` is given, entries are also loaded from it on startup and appended to it as they are computed,
+    so the cache persists across epochs and runs.
+    Takes the same arguments as ``PretrainedBertIndexer``, plus ``cache_file``.
+    """
+    def __init__(self,
+                 pretrained_model: str,
+                 use_starting_offsets: bool = False,
+                 do_lowercase: bool = True,
+                 never_lowercase: List[str] = None,
+                 max_pieces: int = 512,
+                 cache_file: str = None) -> None:
+        super(CachedPretrainedBertIndexer, self).__init__(
+            pretrained_model = pretrained_model,
+            use_starting_offsets = use_starting_offsets,
+            do_lowercase = do_lowercase,
+            never_lowercase = never_lowercase,
+            max_pieces = max_pieces)
+        settings = (pretrained_model, use_starting_offsets, do_lowercase, tuple(never_lowercase or []), max_pieces)
+        if settings not in _caches:
+            _caches[settings] = {}
+        self._cache = _caches[settings]
+        self._cache_file = None
+        if cache_file is not None:
+            # entries depend on the settings, so each combination of them gets its own file
+            settings_hash = hashlib.md5(json.dumps(settings).encode("utf8")).hexdigest()[:8]
+            self._cache_file = "%s.%s" % (cache_file, settings_hash)
+            self._load_cache_file()
+
+    def _load_cache_file(self):
+        if os.path.exists(self._cache_file):
+            with open(self._cache_file, "r", encoding = "utf8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._cache[tuple(entry["tokens"])] = entry["indices"]
+            logger.info("Loaded %d cached wordpiece entries from %s" % (len(self._cache), self._cache_file))
+
+    @overrides
+    def tokens_to_indices(self,
+                          tokens: List[Token],
+                          vocabulary: Vocabulary,
+                          index_name: str) -> Dict[str, List[int]]:
+        key = tuple([t.text for t in tokens])
+        if key not in self._cache:
+            indices = super(CachedPretrainedBertIndexer, self).tokens_to_indices(tokens, vocabulary, "bert")
+            self._cache[key] = indices
+            if self._cache_file is not None:
+                with open(self._cache_file, "a", encoding = "utf8") as f:
+                    f.write(json.dumps({"tokens": list(key), "indices": indices}) + "\n")
+        # cached under the name "bert"; rename the keys for this field's index name
+        return {
+            (index_name + k[len("bert"):] if k.startswith("bert") else k): list(v)
+            for k, v in self._cache[key].items()
+        }
@@ -0,0 +1,49 @@
+from typing import Dict, List
+
+from overrides import overrides
+
+from allennlp.common.util import pad_sequence_to_length
+from allennlp.data.vocabulary import Vocabulary
+from allennlp.data.tokenizers.token import Token
+from allennlp.data.token_indexers.token_indexer import TokenIndexer
+
+from qfirst.data.precomputed_features import get_feature_store
+
+@TokenIndexer.register("precomputed_features")
+class PrecomputedFeatureIndexer(TokenIndexer[int]):
+    """
+    Indexes each token by its row in a precomputed feature store (see ``qfirst.data.precomputed_features``),
+    so a ``PrecomputedFeatureEmbedder`` over the same store can look up its features without running the language model.
+    Sentences are matched by their (cleansed) tokens, not their ids (see ``qfirst.data.precomputed_features``).
+    Ids are row + 1, so that 0 is left for padding (and masking).
+    """
+    def __init__(self, feature_file_prefix: str) -> None:
+        self._feature_file_prefix = feature_file_prefix
+
+    @overrides
+    def count_vocab_items(self, token: Token, counter: Dict[str, Dict[str, int]]):
+        pass
+
+    @overrides
+    def tokens_to_indices(self,
+                          tokens: List[Token],
+                          vocabulary: Vocabulary,
+                          index_name: str) -> Dict[str, List[int]]:
+        store = get_feature_store(self._feature_file_prefix)
+        return {index_name: [row + 1 for row in store.get_token_rows([t.text for t in tokens])]}
+
+    @overrides
+    def get_padding_token(self) -> int:
+        return 0
+
+    @overrides
+    def get_padding_lengths(self, token: int) -> Dict[str, int]:  # pylint: disable=unused-argument
+        return {}
+
+    @overrides
+    def pad_token_sequence(self,
+                           tokens: Dict[str, List[int]],
+                           desired_num_tokens: Dict[str, int],
+                           padding_lengths: Dict[str, int]) -> Dict[str, List[int]]:  # pylint: disable=unused-argument
+        return {key: pad_sequence_to_length(val, desired_num_tokens[key])
+                for key, val in tokens.items()}
@@ -1,3 +1,4 @@
 from qfirst.metrics.question_metric import QuestionMetric
 from qfirst.metrics.binary_f1 import BinaryF1
 from qfirst.metrics.moments_metric import MomentsMetric
+from qfirst.metrics.metric_schedule import MetricSchedule
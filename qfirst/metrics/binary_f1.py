@@ -8,61 +8,94 @@ from allennlp.training.metrics.metric import Metric
 import math
 
 from qfirst.common.span import Span
+from qfirst.metrics.metric_schedule import MetricSchedule
 
 class BinaryF1(Metric, Registrable):
     def __init__(self,
-                 thresholds = [.05, .15, .25, .35, .40, .45, .50, .55, .60, .65, .75, .85, .95]):
-        self._thresholds = thresholds
+                 thresholds = [.05, .15, .25, .35, .40, .45, .50, .55, .60, .65, .75, .85, .95],
+                 deferred: bool = False,
+                 materialize_every: int = 0):
+        self._thresholds = sorted(thresholds)
+        # if deferred, the counts are only transferred in get_curve with reset or on every materialize_every-th
+        # call (only with reset if 0); other calls return the last materialized curve
+        self._deferred = deferred
+        self._materialize_schedule = MetricSchedule(materialize_every)
 
         self.reset()
 
+    def with_schedule(self, deferred: bool, materialize_every: int) -> "BinaryF1":
+        """
+        Returns a fresh copy of this metric (same thresholds, no counts) with the given deferral settings.
+        """
+        return BinaryF1(self._thresholds, deferred = deferred, materialize_every = materialize_every)
+
     def reset(self):
-        def make_confs(thresholds):
-            return [{
-                "threshold": t,
-                "instances": 0,
-                "tp": 0,
-                "tn": 0,
-                "fp": 0,
-                "fn": 0
-            } for t in thresholds]
-        self._confs = make_confs(self._thresholds)
+        self._instances = 0
+        # Shape: 4 (tp, fn, fp, tn), num_thresholds; kept on the device of the scores until get_metric
+        self._counts = None
+        self._threshold_tensor = None
+        # last materialized curve, reused until the next update (or until the next scheduled materialization,
+        # if deferred) so repeated get_metric calls don't sync
+        self._curve = None
+        self._curve_is_current = False
 
     def __call__(self,
                  scores,
                  labels,
                  mask = None):
-        scores, labels = Metric.unwrap_to_tensors(scores, labels.long())
-        if mask is not None:
-            mask, = Metric.unwrap_to_tensors(mask)
+        scores = scores.detach()
+        if not scores.is_floating_point():
+            scores = scores.float()
+        labels = labels.detach().long().expand_as(scores)
+        if self._threshold_tensor is None or self._threshold_tensor.device != scores.device:
+            self._threshold_tensor = torch.tensor(self._thresholds, dtype = scores.dtype, device = scores.device)
+        num_thresholds = len(self._thresholds)
 
-        for conf in self._confs:
-            conf["instances"] += scores.size(0)
-        if mask is None:
-            num_true = labels.sum().item()
-            for conf in self._confs:
-                preds = (scores > conf["threshold"]).long()
-                num_tp = torch.min(preds, labels).sum().item()
-                conf["tp"] += num_tp
-                conf["fn"] += num_true - num_tp
-                conf["fp"] += preds.sum().item() - num_tp
-                conf["tn"] += (1 - torch.max(preds, labels)).sum().item()
+        self._instances += scores.size(0)
+        self._curve_is_current = False
+        # number of thresholds each score is above, i.e., the prediction is positive for thresholds 0 ... bucket - 1
+        if hasattr(torch, "bucketize"):
+            buckets = torch.bucketize(scores.contiguous().view(-1), self._threshold_tensor)
+        else:
+            buckets = (scores.contiguous().view(-1, 1) > self._threshold_tensor).sum(-1)
+        true_weights = labels.contiguous().view(-1).double()
+        false_weights = 1.0 - true_weights
+        if mask is not None:
+            mask = mask.detach().expand_as(scores).contiguous().view(-1).double()
+            true_weights = true_weights * mask
+            false_weights = false_weights * mask
+        # Shape: num_thresholds + 1
+        true_hist = torch.bincount(buckets, weights = true_weights, minlength = num_thresholds + 1)
+        false_hist = torch.bincount(buckets, weights = false_weights, minlength = num_thresholds + 1)
+        # Shape: num_thresholds; number of (weighted) items above each threshold
+        true_above = true_hist.flip(0).cumsum(0).flip(0)[1:]
+        false_above = false_hist.flip(0).cumsum(0).flip(0)[1:]
+        # Shape: 4, num_thresholds
+        counts = torch.stack([
+            true_above, true_hist.sum() - true_above,
+            false_above, false_hist.sum() - false_above
+        ])
+        if self._counts is None:
+            self._counts = counts
         else:
-            num_true = (labels * mask).sum().item()
-            for conf in self._confs:
-                preds = (scores > conf["threshold"]).long()
-                num_tp = (torch.min(preds, labels) * mask).sum().item()
-                conf["tp"] += num_tp
-                conf["fn"] += num_true - num_tp
-                conf["fp"] += (preds * mask).sum().item() - num_tp
-                conf["tn"] += ((1 - torch.max(preds, labels)) * mask).sum().item()
+            self._counts += counts.to(self._counts.device)
 
-    def get_metric(self, reset = False):
-        def stats(conf):
-            tp = conf["tp"]
-            fp = conf["fp"]
-            tn = conf["tn"]
-            fn = conf["fn"]
+    def get_curve(self, reset = False):
+        """
+        Returns the stats (precision, recall, f1, etc.) at every threshold, in increasing order of threshold.
+        """
+        if self._curve is not None and (self._curve_is_current or (
+                self._deferred and not reset and not self._materialize_schedule.should_compute(training = True))):
+            curve = self._curve
+            if reset:
+                self.reset()
+            return curve
+        if self._counts is None:
+            all_counts = [[0.0 for _ in self._thresholds] for _ in range(4)]
+        else:
+            all_counts = self._counts.tolist()
+        instances = max(self._instances, 1)
+        def stats(threshold, tp, fn, fp, tn):
             num_predicted = tp + fp
             precision = 0.
             if num_predicted > 0.0:
@@ -80,17 +113,23 @@ class BinaryF1(Metric, Registrable):
             if abs(mccDenom) > 0.0:
                 mcc = mccNum / mccDenom
             return {
-                "threshold": conf["threshold"],
-                "avg-predicted": num_predicted / conf["instances"],
-                "avg-gold": num_gold / conf["instances"],
+                "threshold": threshold,
+                "avg-predicted": num_predicted / instances,
+                "avg-gold": num_gold / instances,
                 "precision": precision,
                 "recall": recall,
                 "f1": f1,
                 "mcc": mcc
             }
-        stats_dict = max([stats(conf) for conf in self._confs], key = lambda d: d["f1"])
+        curve = [stats(t, *c) for t, c in zip(self._thresholds, zip(*all_counts))]
+        self._curve = curve
+        self._curve_is_current = True
 
         if reset:
             self.reset()
 
+        return curve
+
+    def get_metric(self, reset = False):
+        stats_dict = max(self.get_curve(reset = reset), key = lambda d: d["f1"])
         return { k: v for k, v in stats_dict.items() }
@@ -0,0 +1,23 @@
+class MetricSchedule():
+    """
+    Decides on which batches a module computes its metrics: always outside of training,
+    and during training on every ``compute_every``-th batch (never if ``compute_every`` is 0).
+    Subsumes the older ``skip_metrics_during_training`` flag, which corresponds to ``compute_every = 0``.
+    """
+    def __init__(self, compute_every: int = 1) -> None:
+        self._compute_every = compute_every
+        self._num_training_batches = 0
+
+    @classmethod
+    def from_flags(cls, skip_metrics_during_training: bool, compute_metrics_every: int = None) -> "MetricSchedule":
+        if compute_metrics_every is None:
+            compute_metrics_every = 0 if skip_metrics_during_training else 1
+        return cls(compute_metrics_every)
+
+    def should_compute(self, training: bool) -> bool:
+        if not training:
+            return True
+        if self._compute_every <= 0:
+            return False
+        self._num_training_batches += 1
+        return (self._num_training_batches - 1) % self._compute_every == 0
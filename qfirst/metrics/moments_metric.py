@@ -1,33 +1,99 @@
 from typing import Dict, List, Optional, Set, Tuple
 
+import torch
+
 from allennlp.common import Registrable
 from allennlp.training.metrics.metric import Metric
 
 import math
 
+from qfirst.metrics.metric_schedule import MetricSchedule
+
 class MomentsMetric(Metric, Registrable):
-    def __init__(self):
+    def __init__(self, deferred: bool = False, materialize_every: int = 0):
+        # if deferred, the running moments stay on the device, and are only transferred in get_metric
+        # with reset or on every materialize_every-th call (only with reset if 0); other calls return the last values
+        self._deferred = deferred
+        self._materialize_schedule = MetricSchedule(materialize_every)
         self.reset()
 
     def reset(self):
+        # Shape: 2 (mean, m2), on the device, or None
+        self._pending_moments = None
+        self._pending_num_values = 0.0
         self._num_values = 0.0
         self._mean = 0.0
         self._m2 = 0.0
+        self._last_metric = None
 
     def __call__(self, xs):
-        xs, = Metric.unwrap_to_tensors(xs)
-        for i in range(xs.size(0)):
-            x = xs[i].item()
-            self._num_values += 1
-            delta1 = x - self._mean
-            self._mean += delta1 / self._num_values
-            delta2 = x - self._mean
-            self._m2 += delta1 * delta2
+        xs = xs.detach()
+        if xs.numel() == 0:
+            return
+        xs = xs.double().view(-1)
+        # batch moments, merged into the running ones with Chan et al.'s parallel update
+        batch_mean = xs.mean()
+        batch_m2 = (xs - batch_mean).pow(2).sum()
+        batch_moments = torch.stack([batch_mean, batch_m2])
+        if self._deferred:
+            self._merge_pending_moments(float(xs.numel()), batch_moments)
+        else:
+            batch_mean, batch_m2 = batch_moments.tolist()
+            self._merge_moments(float(xs.numel()), batch_mean, batch_m2)
+
+    def _merge_pending_moments(self, num_values, moments):
+        # the same parallel update as _merge_moments, on the device
+        if self._pending_moments is None:
+            self._pending_moments = moments
+        else:
+            total = self._pending_num_values + num_values
+            delta = moments[0] - self._pending_moments[0]
+            self._pending_moments = torch.stack([
+                self._pending_moments[0] + delta * num_values / total,
+                self._pending_moments[1] + moments[1] + delta * delta * self._pending_num_values * num_values / total
+            ])
+        self._pending_num_values += num_values
+
+    def _flush(self):
+        if self._pending_moments is not None:
+            mean, m2 = self._pending_moments.tolist()
+            self._merge_moments(self._pending_num_values, mean, m2)
+            self._pending_moments = None
+            self._pending_num_values = 0.0
+
+    def merge(self, other: "MomentsMetric"):
+        """
+        Merges in the values accumulated by another instance of this metric (e.g., from another worker).
+        """
+        other._flush()
+        self._merge_moments(other._num_values, other._mean, other._m2)
+
+    def get_state(self):
+        self._flush()
+        return {"n": self._num_values, "mean": self._mean, "m2": self._m2}
+
+    def merge_state(self, state):
+        self._merge_moments(state["n"], state["mean"], state["m2"])
+
+    def _merge_moments(self, num_values, mean, m2):
+        if num_values == 0:
+            return
+        total = self._num_values + num_values
+        delta = mean - self._mean
+        self._mean += delta * num_values / total
+        self._m2 += m2 + delta * delta * self._num_values * num_values / total
+        self._num_values = total
 
     def get_metric(self, reset = False):
+        if self._deferred and not reset and self._last_metric is not None and \
+           not self._materialize_schedule.should_compute(training = True):
+            return self._last_metric
+        self._flush()
         stdev = math.sqrt(self._m2 / self._num_values) if self._num_values > 0 else 0.0
-        return {
+        # as before, the moments accumulate across resets; reset only forces the pending ones to be transferred
+        self._last_metric = {
             "n": self._num_values,
             "mean": self._mean,
             "stdev": stdev
         }
+        return self._last_metric
@@ -9,13 +9,20 @@ from allennlp.training.metrics.metric import Metric
 import math
 
 from qfirst.data.util import get_slot_label_namespace
+from qfirst.metrics.metric_schedule import MetricSchedule
 
 class QuestionMetric(Metric):
     def __init__(self,
             vocabulary: Vocabulary,
-            slot_names: List[str]):
+            slot_names: List[str],
+            deferred: bool = False,
+            materialize_every: int = 0):
         self._vocabulary = vocabulary
         self._slot_names = slot_names
+        # if deferred, per-batch sums are accumulated on the device, and are only transferred in get_metric
+        # with reset or on every materialize_every-th call (only with reset if 0); other calls return the last values
+        self._deferred = deferred
+        self._materialize_schedule = MetricSchedule(materialize_every)
 
         self.reset()
 
@@ -25,6 +32,8 @@ class QuestionMetric(Metric):
         self._slot_correct = { l: 0 for l in self._slot_names }
         self._negative_log_likelihood = 0.
         self._slot_nlls = { l: 0 for l in self._slot_names }
+        self._pending_sums = None
+        self._last_metric = None
 
     def __call__(self,
                  slot_logits: Dict[str, torch.Tensor],
@@ -32,52 +41,51 @@ class QuestionMetric(Metric):
                  mask: torch.Tensor,
                  slot_nlls: Dict[str, torch.Tensor],
                  negative_log_likelihood: float):
-        mask, negative_log_likelihood = self.unwrap_to_tensors(mask.long(), negative_log_likelihood)
-
         # this metric handles the case where each instance has a sequence of questions
         # as well as the case where each instance has a single question (where the mask is, I assume, all ones).
-        has_sequence = len(list(mask.size())) > 1
-        if has_sequence:
-            batch_size, num_questions = mask.size()
-        else:
-            batch_size = mask.size(0)
-
-        num_total_questions = mask.sum().item()
-
-        self._total_questions += num_total_questions
-        self._negative_log_likelihood += negative_log_likelihood
-
-        # we'll mask out questions as we miss slots to get the full question accuracy
-        correct_questions = mask.clone()
+        device = slot_logits[self._slot_names[0]].device
+        # Shape: batch_size(, num_questions)
+        mask = (mask.detach() > 0).double().to(device)
 
+        # a question is correct iff all of its slots are
+        correct_questions = mask
+        slot_correct_counts = []
         for slot_name in self._slot_names:
-            self._slot_nlls[slot_name] += slot_nlls[slot_name]
-            # logits Shape: batch_size, slot_name_vocab_size
-            # gold_labels Shape: batch_size, 1?
-            logits, gold_labels = self.unwrap_to_tensors(slot_logits[slot_name], slot_labels[slot_name])
-            # Shape: batch_size, question_length, 1?
-            argmax_predictions = logits.argmax(-1)
-
-            if has_sequence:
-                for bi in range(batch_size):
-                    for qi in range(num_questions):
-                        if mask[bi, qi].item() > 0:
-                            if argmax_predictions[bi, qi].item() == gold_labels[bi, qi].item():
-                                self._slot_correct[slot_name] += 1
-                            else:
-                                correct_questions[bi, qi] = 0
-            else:
-                for bi in range(batch_size):
-                    if mask[bi].item() > 0:
-                        if argmax_predictions[bi].item() == gold_labels[bi].item():
-                            self._slot_correct[slot_name] += 1
-                        else:
-                            correct_questions[bi] = 0
-
-
-        self._questions_correct += correct_questions.sum().item()
+            # Shape: batch_size(, num_questions)
+            argmax_predictions = slot_logits[slot_name].detach().argmax(-1)
+            gold_labels = slot_labels[slot_name].detach().view(argmax_predictions.size())
+            slot_correct = (argmax_predictions == gold_labels).double() * mask
+            slot_correct_counts.append(slot_correct.sum())
+            correct_questions = correct_questions * slot_correct
+
+        # transfer all of the sums at once
+        sums = torch.stack([
+            mask.sum(), correct_questions.sum(),
+            torch.as_tensor(negative_log_likelihood).detach().double().to(device),
+            *slot_correct_counts,
+            *[torch.as_tensor(slot_nlls[slot_name]).detach().double().to(device) for slot_name in self._slot_names]
+        ])
+        if self._deferred:
+            self._pending_sums = sums if self._pending_sums is None else self._pending_sums + sums
+        else:
+            self._add_sums(sums.tolist())
+
+    def _add_sums(self, sums):
+        num_slots = len(self._slot_names)
+        self._total_questions += sums[0]
+        self._questions_correct += sums[1]
+        self._negative_log_likelihood += sums[2]
+        for i, slot_name in enumerate(self._slot_names):
+            self._slot_correct[slot_name] += sums[3 + i]
+            self._slot_nlls[slot_name] += sums[3 + num_slots + i]
 
     def get_metric(self, reset=False):
+        if self._deferred and not reset and self._last_metric is not None and \
+           not self._materialize_schedule.should_compute(training = True):
+            return self._last_metric
+        if self._pending_sums is not None:
+            self._add_sums(self._pending_sums.tolist())
+            self._pending_sums = None
 
         def get_slot_accuracy(slot_name):
             return self._slot_correct[slot_name] /  self._total_questions
@@ -96,7 +104,10 @@ class QuestionMetric(Metric):
             "perplexity-per-question": perplexity_per_question
         }
 
+        metric = {**slot_wise_metrics, **other_metrics}
         if reset:
             self.reset()
-        return {**slot_wise_metrics, **other_metrics}
+        else:
+            self._last_metric = metric
+        return metric
 
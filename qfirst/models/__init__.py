@@ -1,7 +0,0 @@
-from qfirst.models.span import SpanModel
-from qfirst.models.question import QuestionModel
-from qfirst.models.question_to_span import QuestionToSpanModel
-from qfirst.models.span_to_question import SpanToQuestionModel
-from qfirst.models.multiclass import MulticlassModel
-from qfirst.models.clause_answering import ClauseAnsweringModel
-
@@ -28,6 +28,8 @@ class AnimacyModel(Model):
                  sentence_encoder: SentenceEncoder,
                  animacy_ffnn: FeedForward,
                  inject_predicate: bool = False,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(AnimacyModel, self).__init__(vocab, regularizer)
@@ -43,7 +45,7 @@ class AnimacyModel(Model):
                 ReLU(),
                 self._animacy_ffnn,
                 Linear(self._animacy_ffnn.get_output_dim(), 1)))
-        self._metric = BinaryF1()
+        self._metric = BinaryF1(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     @overrides
     def forward(self,
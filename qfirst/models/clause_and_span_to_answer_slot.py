@@ -27,6 +27,8 @@ class ClauseAndSpanToAnswerSlotModel(Model):
     def __init__(self, vocab: Vocabulary,
                  sentence_encoder: SentenceEncoder,
                  qarg_ffnn: FeedForward,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(ClauseAndSpanToAnswerSlotModel, self).__init__(vocab, regularizer)
@@ -38,7 +40,7 @@ class ClauseAndSpanToAnswerSlotModel(Model):
         self._span_hidden = TimeDistributed(Linear(2 * self._sentence_encoder.get_output_dim(), self._qarg_ffnn.get_input_dim()))
         self._predicate_hidden = Linear(self._sentence_encoder.get_output_dim(), self._qarg_ffnn.get_input_dim())
         self._qarg_predictor = Linear(self._qarg_ffnn.get_output_dim(), self.vocab.get_vocab_size("qarg-labels"))
-        self._metric = BinaryF1()
+        self._metric = BinaryF1(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     @overrides
     def forward(self,
@@ -71,10 +73,8 @@ class ClauseAndSpanToAnswerSlotModel(Model):
 
         # Shape: batch_size, 1, self._final_input_dim
         pred_embedding = self._predicate_hidden(pred_rep)
-        # Shape: batch_size, num_labeled_instances, self._final_input_dim
-        qarg_inputs = F.relu(pred_embedding.unsqueeze(1) + input_clauses + input_span_hidden)
         # Shape: batch_size, num_labeled_instances, get_vocab_size("qarg-labels")
-        qarg_logits = self._qarg_predictor(self._qarg_ffnn(qarg_inputs))
+        qarg_logits = self._get_qarg_logits(pred_embedding.unsqueeze(1) + input_clauses + input_span_hidden)
 
         final_mask = qarg_labeled_mask.unsqueeze(-1) \
                         .expand(batch_size, num_labeled_instances, self.vocab.get_vocab_size("qarg-labels")) \
@@ -89,5 +89,85 @@ class ClauseAndSpanToAnswerSlotModel(Model):
             self._metric(qarg_probs, qarg_labels)
         return output_dict
 
+    def predict_clause_span_grid(self,
+                                 text: Dict[str, torch.LongTensor],
+                                 predicate_indicator: torch.LongTensor,
+                                 predicate_index: torch.LongTensor,
+                                 clauses: torch.LongTensor,
+                                 spans: torch.LongTensor,
+                                 clause_probs: torch.FloatTensor = None,
+                                 span_probs: torch.FloatTensor = None,
+                                 max_num_pairs: int = None,
+                                 pair_indices: torch.LongTensor = None):
+        # Inference over all (clause, span) pairs without building a field per pair:
+        # clauses (batch_size, num_clauses) and spans (batch_size, num_spans, 2) are padded with -1,
+        # and since the FFNN input is additive in the clause and span, the pair grid is formed by broadcasting.
+        # If max_num_pairs is given, only the top pairs by clause_prob * span_prob are run through the FFNN;
+        # alternatively, pair_indices (batch_size, num_pairs; -1 for padding) picks the pairs to score
+        # by their index in the clause-major grid.
+        # Returns pairs in clause-major grid order, each with its clause and span index.
+        # Shape: batch_size, num_tokens, encoder_output_dim
+        encoded_text, text_mask = self._sentence_encoder(text, predicate_indicator)
+        # Shape: batch_size, encoder_output_dim
+        pred_rep = batched_index_select(encoded_text, predicate_index).squeeze(1)
+
+        batch_size, num_clauses = clauses.size()
+        num_spans = spans.size(1)
+        # Shape: batch_size, num_clauses
+        clause_mask = (clauses >= 0).long()
+        # Shape: batch_size, num_spans
+        span_mask = (spans[:, :, 0] >= 0).long()
+        # Shape: batch_size, num_clauses * num_spans
+        pair_mask = (clause_mask.unsqueeze(2) * span_mask.unsqueeze(1)).view(batch_size, -1)
+
+        # Shape: batch_size, num_clauses, self._final_input_dim
+        clause_hidden = self._clause_embedding(clauses.max(torch.zeros_like(clauses)))
+        # Shape: batch_size, num_spans, self._final_input_dim
+        span_hidden = self._span_hidden(self._span_extractor(encoded_text, spans, text_mask, span_mask))
+        # Shape: batch_size, self._final_input_dim
+        pred_embedding = self._predicate_hidden(pred_rep)
+
+        grid_indices = torch.arange(num_clauses * num_spans, dtype = torch.long, device = clauses.device) \
+                            .unsqueeze(0).expand(batch_size, -1)
+        if pair_indices is None and max_num_pairs is not None and max_num_pairs < num_clauses * num_spans:
+            if clause_probs is None or span_probs is None:
+                raise ConfigurationError("Pruning the clause-span grid requires clause and span probabilities.")
+            # Shape: batch_size, num_clauses * num_spans
+            pair_scores = (clause_probs.unsqueeze(2) * span_probs.unsqueeze(1)).view(batch_size, -1)
+            pair_scores = pair_scores.masked_fill(pair_mask == 0, -1.)
+            # keep the surviving pairs in grid order
+            pair_indices, _ = pair_scores.topk(max_num_pairs, dim = 1)[1].sort(dim = 1)
+        if pair_indices is not None:
+            selected_pair_mask = (pair_indices >= 0).long()
+            pair_indices = pair_indices.max(torch.zeros_like(pair_indices))
+            pair_mask = pair_mask.gather(1, pair_indices) * selected_pair_mask
+            clause_indices = pair_indices // num_spans
+            span_indices = pair_indices - (clause_indices * num_spans)
+            # Shape: batch_size, num_pairs, self._final_input_dim
+            qarg_hidden = pred_embedding.unsqueeze(1) + \
+                          batched_index_select(clause_hidden, clause_indices) + \
+                          batched_index_select(span_hidden, span_indices)
+        else:
+            clause_indices = grid_indices // num_spans
+            span_indices = grid_indices - (clause_indices * num_spans)
+            # Shape: batch_size, num_clauses * num_spans, self._final_input_dim
+            qarg_hidden = (pred_embedding.unsqueeze(1).unsqueeze(1) +
+                           clause_hidden.unsqueeze(2) +
+                           span_hidden.unsqueeze(1)).view(batch_size, num_clauses * num_spans, -1)
+
+        # Shape: batch_size, num_pairs, get_vocab_size("qarg-labels")
+        qarg_logits = self._get_qarg_logits(qarg_hidden)
+        qarg_probs = torch.sigmoid(qarg_logits) * pair_mask.unsqueeze(-1).float()
+        return {
+            "logits": qarg_logits,
+            "probs": qarg_probs,
+            "pair_mask": pair_mask,
+            "clause_indices": clause_indices,
+            "span_indices": span_indices
+        }
+
+    def _get_qarg_logits(self, qarg_hidden):
+        return self._qarg_predictor(self._qarg_ffnn(F.relu(qarg_hidden)))
+
     def get_metrics(self, reset: bool = False):
         return self._metric.get_metric(reset=reset)
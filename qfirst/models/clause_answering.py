@@ -73,6 +73,32 @@ class ClauseAnsweringModel(Model):
             num_answers = num_answers,
             metadata = metadata)
 
+    def predict_clause_questions(self,
+                                 text: Dict[str, torch.LongTensor],
+                                 predicate_indicator: torch.LongTensor,
+                                 predicate_index: torch.LongTensor,
+                                 clauses: torch.LongTensor,
+                                 answer_slots: torch.LongTensor):
+        # Inference over many (clause, answer slot) questions per verb without an instance per question:
+        # clauses and answer_slots (batch_size, num_questions) are padded with -1.
+        # The sentence is encoded once per verb and all of its questions go through one span selector call.
+        # Returns span selector outputs with one row per question, in row-major order.
+        # Shape: batch_size, num_tokens, encoder_output_dim
+        encoded_text, text_mask = self._sentence_encoder(text, predicate_indicator)
+        # Shape: batch_size, encoder_output_dim
+        pred_rep = batched_index_select(encoded_text, predicate_index).squeeze(1)
+        num_questions = clauses.size(1)
+        # Shape: batch_size, num_questions
+        question_mask = (clauses >= 0).long()
+        embedded_clauses = self._clause_embedding(clauses.max(torch.zeros_like(clauses)))
+        embedded_slots = self._slot_embedding(answer_slots.max(torch.zeros_like(answer_slots)))
+        expanded_pred_rep = pred_rep.unsqueeze(1).expand(-1, num_questions, -1)
+        combined_embeddings = torch.cat([embedded_clauses, embedded_slots, expanded_pred_rep], -1)
+        # Shape: batch_size, num_questions, question_embedding_dim
+        question_embeddings = self._question_projection(combined_embeddings)
+        return self._span_selector.forward_on_extra_inputs(
+            encoded_text, text_mask, question_embeddings, question_mask)
+
     @overrides
     def decode(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         return self._span_selector.decode(output_dict)
@@ -29,6 +29,9 @@ class ClauseFrameModel(Model):
     def __init__(self, vocab: Vocabulary,
                  sentence_encoder: SentenceEncoder,
                  num_frames: int = 100,
+                 max_inference_frames: Optional[int] = None,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(ClauseFrameModel, self).__init__(vocab, regularizer)
@@ -37,11 +40,50 @@ class ClauseFrameModel(Model):
         self._sentence_encoder = sentence_encoder
         self._frames_matrix = Parameter(data = torch.zeros([self._num_frames, self._num_clauses], dtype = torch.float32))
         self._frame_pred = Linear(self._sentence_encoder.get_output_dim(), self._num_frames)
-        self._metric = BinaryF1()
-        self._kl_divergence_metric = MomentsMetric()
+        self._max_inference_frames = max_inference_frames
+        # normalized frames matrix for inference, along with the parameter version it was computed from
+        self._cached_frames = None
+        self._cached_frames_key = None
+        self._metric = BinaryF1(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
+        self._kl_divergence_metric = MomentsMetric(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
         initializer(self)
 
+    def get_frame_clause_probs(self):
+        """
+        Returns the clause distribution of every frame, of shape ``(num_frames, num_clauses)``.
+        Outside of training this is computed once and cached until the frames matrix changes
+        (i.e., an in-place update or a reload bumps its version) or the model goes back into training mode.
+        """
+        if self.training and torch.is_grad_enabled():
+            return F.softmax(self._frames_matrix, dim = 1)
+        key = (self._frames_matrix._version, self._frames_matrix.data_ptr())
+        if self._cached_frames is None or self._cached_frames_key != key:
+            with torch.no_grad():
+                self._cached_frames = F.softmax(self._frames_matrix, dim = 1)
+            self._cached_frames_key = key
+        return self._cached_frames
+
+    @overrides
+    def train(self, mode: bool = True):
+        self._cached_frames = None
+        self._cached_frames_key = None
+        return super(ClauseFrameModel, self).train(mode)
+
+    def _get_clause_probs(self, frame_probs: torch.Tensor):
+        frames = self.get_frame_clause_probs()
+        if self.training or self._max_inference_frames is None or self._max_inference_frames >= self._num_frames:
+            return torch.matmul(frame_probs, frames)
+        # only mix the clause distributions of each item's most probable frames,
+        # renormalized over those frames so that the clause probabilities still sum to 1
+        # Shape: batch_size, max_inference_frames
+        top_frame_probs, top_frame_indices = frame_probs.topk(self._max_inference_frames, dim = 1)
+        top_frame_probs = top_frame_probs / top_frame_probs.sum(1, keepdim = True)
+        # Shape: batch_size, max_inference_frames, num_clauses
+        top_frames = frames[top_frame_indices]
+        # Shape: batch_size, num_clauses
+        return torch.bmm(top_frame_probs.unsqueeze(1), top_frames).squeeze(1)
+
     # TODO figure out how to use this with a null input / maybe to have logits to reuse the setclassifier one
     @overrides
     def forward(self,
@@ -57,10 +99,9 @@ class ClauseFrameModel(Model):
         # Shape: batch_size, get_vocab_size(self._label_namespace)
         frame_logits = self._frame_pred(pred_rep)
         frame_probs = F.softmax(frame_logits, dim = 1)
-        frames = F.softmax(self._frames_matrix, dim = 1)
-        clause_probs = torch.matmul(frame_probs, frames)
+        clause_probs = self._get_clause_probs(frame_probs)
         clause_log_probs = clause_probs.log()
-        output_dict = { "probs": frame_probs }
+        output_dict = { "probs": frame_probs, "clause_probs": clause_probs }
         # TODO figure out how to do this with logits
         # TODO figure out how to handle the null case
         if clause_dist is not None and clause_dist.sum().item() > 0.1:
@@ -29,6 +29,8 @@ class MulticlassModel(Model):
                  label_name: str,
                  label_namespace: str,
                  classifier: SetClassifier,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(MulticlassModel, self).__init__(vocab, regularizer)
@@ -37,7 +39,7 @@ class MulticlassModel(Model):
         self._label_namespace = label_namespace
         self._classifier = classifier
         self._final_pred = Linear(self._sentence_encoder.get_output_dim(), self.vocab.get_vocab_size(self._label_namespace))
-        self._metric = BinaryF1()
+        self._metric = BinaryF1(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     @overrides
     def forward(self,
@@ -27,6 +27,8 @@ class QuestionModel(Model):
     def __init__(self, vocab: Vocabulary,
                  sentence_encoder: SentenceEncoder,
                  question_generator: SlotSequenceGenerator,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(QuestionModel, self).__init__(vocab, regularizer)
@@ -36,7 +38,7 @@ class QuestionModel(Model):
             raise ConfigurationError(
                 ("Input dimension of question generator (%s) must be " % self._question_generator.get_input_dim()) + \
                 ("equal to the output dimension of the sentence encoder (%s)." % self._sentence_encoder.get_output_dim()))
-        self.metric = QuestionMetric(vocab, self._question_generator.get_slot_names())
+        self.metric = QuestionMetric(vocab, self._question_generator.get_slot_names(), deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     def get_slot_names(self):
         return self._question_generator.get_slot_names()
@@ -79,6 +81,21 @@ class QuestionModel(Model):
         pred_rep = batched_index_select(encoded_text, predicate_index).squeeze(1)
         return self._question_generator.beam_decode(pred_rep, max_beam_size, min_beam_probability, clause_mode)
 
+    def beam_decode_batch(self,
+                          text: Dict[str, torch.LongTensor],
+                          predicate_indicator: torch.LongTensor,
+                          predicate_index: torch.LongTensor,
+                          max_beam_size: int,
+                          min_beam_probability: float,
+                          clause_mode: bool = False):
+        # Same as beam_decode, for every verb in the batch at once;
+        # returns one (slot_indices, slot_labels, probs) triple per batch item.
+        # Shape: batch_size, num_tokens, self._sentence_encoder.get_output_dim()
+        encoded_text, text_mask = self._sentence_encoder(text, predicate_indicator)
+        # Shape: batch_size, self._sentence_encoder.get_output_dim()
+        pred_rep = batched_index_select(encoded_text, predicate_index).squeeze(1)
+        return self._question_generator.beam_decode_batch(pred_rep, max_beam_size, min_beam_probability, clause_mode)
+
     def get_metrics(self, reset: bool = False):
         return self.metric.get_metric(reset=reset)
 
@@ -29,6 +29,8 @@ class QuestionToSpanModel(Model):
                  span_selector: PruningSpanSelector,
                  classify_invalids: bool = True,
                  invalid_hidden_dim: int = 100,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(QuestionToSpanModel, self).__init__(vocab, regularizer)
@@ -48,7 +50,7 @@ class QuestionToSpanModel(Model):
                 Linear(extra_input_dim, self._invalid_hidden_dim),
                 ReLU(),
                 Linear(self._invalid_hidden_dim, 1))
-            self._invalid_metric = BinaryF1()
+            self._invalid_metric = BinaryF1(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     def classifies_invalids(self):
         return self._classify_invalids
@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional
+
+import os
+
+from overrides import overrides
+import torch
+import torch.nn.functional as F
+
+from allennlp.common.checks import ConfigurationError
+from allennlp.data import Vocabulary
+from allennlp.models.model import Model
+from allennlp.nn import InitializerApplicator, RegularizerApplicator
+from allennlp.nn.util import batched_index_select
+
+from qfirst.modules.sentence_encoder import SentenceEncoder
+from qfirst.metrics.moments_metric import MomentsMetric
+from qfirst.util.archival_utils import load_archive_from_folder
+
+# Trains a (smaller) student SentenceEncoder to mimic the sentence encoder of a trained teacher model
+# on unlabeled verbs: it matches the teacher's encoded token states, and, through the teacher's own (frozen) heads,
+# its question slot distributions and span logits. Use qfirst/scripts/export_distilled_model.py
+# to turn the result into an archive of the teacher's model type.
+@Model.register("qasrl_sentence_encoder_distillation")
+class SentenceEncoderDistillationModel(Model):
+    def __init__(self, vocab: Vocabulary,
+                 teacher_model_path: str,
+                 student_encoder: SentenceEncoder,
+                 state_loss_weight: float = 1.0,
+                 head_loss_weight: float = 1.0,
+                 temperature: float = 1.0,
+                 initializer: InitializerApplicator = InitializerApplicator(),
+                 regularizer: Optional[RegularizerApplicator] = None):
+        super(SentenceEncoderDistillationModel, self).__init__(vocab, regularizer)
+        teacher = load_archive_from_folder(teacher_model_path, weights_file = os.path.join(teacher_model_path, "best.th")).model
+        for p in teacher.parameters():
+            p.requires_grad = False
+        teacher.eval()
+        # kept in a list so the teacher isn't registered as a submodule (and saved with the student)
+        self._teacher = [teacher]
+        if not hasattr(teacher, "_sentence_encoder"):
+            raise ConfigurationError("Teacher model %s has no sentence encoder to distill." % type(teacher).__name__)
+        self._distill_question_head = hasattr(teacher, "_question_generator")
+        # span selectors which take other extra inputs (e.g., question embeddings) can't be run on unlabeled verbs
+        span_selector = getattr(teacher, "_span_selector", None)
+        self._distill_span_head = span_selector is not None and \
+                                  (getattr(teacher, "_inject_predicate", None) is not None or span_selector.get_extra_input_dim() == 0)
+        if head_loss_weight > 0.0 and not (self._distill_question_head or self._distill_span_head):
+            raise ConfigurationError(
+                ("Teacher model %s has no head which can be distilled on unlabeled verbs; " % type(teacher).__name__) + \
+                "set head_loss_weight to 0 to distill the sentence encoder states only.")
+        self._student_encoder = student_encoder
+        if self._student_encoder.get_output_dim() != teacher._sentence_encoder.get_output_dim():
+            raise ConfigurationError(
+                ("Output dimension of student encoder (%s) must be " % self._student_encoder.get_output_dim()) + \
+                ("equal to the output dimension of the teacher's sentence encoder (%s)." % teacher._sentence_encoder.get_output_dim()))
+        self._state_loss_weight = state_loss_weight
+        self._head_loss_weight = head_loss_weight
+        self._temperature = temperature
+        self._state_loss_metric = MomentsMetric()
+        self._head_loss_metric = MomentsMetric()
+        initializer(self)
+
+    def _get_teacher(self, device):
+        teacher = self._teacher[0]
+        if next(teacher.parameters()).device != device:
+            teacher.to(device)
+        teacher.eval()
+        return teacher
+
+    @overrides
+    def forward(self,
+                text: Dict[str, torch.LongTensor],
+                predicate_indicator: torch.LongTensor,
+                predicate_index: torch.LongTensor,
+                **kwargs):
+        teacher = self._get_teacher(predicate_indicator.device)
+        with torch.no_grad():
+            # Shape: batch_size, num_tokens, encoder_output_dim
+            teacher_encoded_text, text_mask = teacher._sentence_encoder(text, predicate_indicator)
+        # Shape: batch_size, num_tokens, encoder_output_dim
+        student_encoded_text, _ = self._student_encoder(text, predicate_indicator)
+        float_mask = text_mask.float()
+
+        # Shape: batch_size
+        state_losses = ((student_encoded_text - teacher_encoded_text).pow(2).mean(-1) * float_mask).sum(1) / float_mask.sum(1)
+        head_losses = self._get_head_losses(teacher, teacher_encoded_text, student_encoded_text, text_mask, predicate_index)
+        loss = self._state_loss_weight * state_losses.mean()
+        if head_losses is not None:
+            loss = loss + self._head_loss_weight * head_losses.mean()
+            self._head_loss_metric(head_losses)
+        self._state_loss_metric(state_losses)
+        return {"encoded_text": student_encoded_text, "loss": loss}
+
+    def _get_head_losses(self, teacher, teacher_encoded_text, student_encoded_text, text_mask, predicate_index):
+        head_losses = None
+        if self._distill_question_head:
+            generator = teacher._question_generator
+            # Shape: batch_size, encoder_output_dim
+            teacher_pred_rep = batched_index_select(teacher_encoded_text, predicate_index).squeeze(1)
+            student_pred_rep = batched_index_select(student_encoded_text, predicate_index).squeeze(1)
+            with torch.no_grad():
+                slot_labels = self._get_greedy_slot_labels(generator, teacher_pred_rep)
+                teacher_slot_logits = generator(teacher_pred_rep, **slot_labels)
+            student_slot_logits = generator(student_pred_rep, **slot_labels)
+            # Shape: batch_size
+            question_losses = sum([
+                self._get_soft_cross_entropy(teacher_slot_logits[n], student_slot_logits[n])
+                for n in generator.get_slot_names()
+            ])
+            head_losses = question_losses
+        if self._distill_span_head:
+            span_selector = teacher._span_selector
+            inject_predicate = getattr(teacher, "_inject_predicate", False)
+            def get_span_output(encoded_text):
+                extra_input = batched_index_select(encoded_text, predicate_index) if inject_predicate else None
+                return span_selector(encoded_text, text_mask, extra_input_embedding = extra_input)
+            with torch.no_grad():
+                teacher_span_output = get_span_output(teacher_encoded_text)
+            student_span_output = get_span_output(student_encoded_text)
+            # Shape: batch_size, num_spans
+            span_mask = teacher_span_output["mask"].float() if "mask" in teacher_span_output else torch.ones_like(teacher_span_output["logits"])
+            # Shape: batch_size
+            span_losses = ((student_span_output["logits"] - teacher_span_output["logits"]).pow(2) * span_mask).sum(1) / span_mask.sum(1).clamp(min = 1.0)
+            head_losses = span_losses if head_losses is None else head_losses + span_losses
+        return head_losses
+
+    def _get_greedy_slot_labels(self, generator, pred_rep):
+        # the teacher's own most likely question, used for teacher forcing since the sentences are unlabeled
+        curr_embedding, curr_mem = generator._init_recurrence(pred_rep)
+        slot_labels = {}
+        slot_names = generator.get_slot_names()
+        for i, n in enumerate(slot_names):
+            recurrence_dict = generator._slot_quasi_recurrence(i, n, pred_rep, curr_embedding, curr_mem)
+            curr_mem = recurrence_dict["next_mem"]
+            # Shape: batch_size
+            labels = recurrence_dict["logits"].argmax(-1)
+            slot_labels[n] = labels.unsqueeze(-1)
+            if i < len(slot_names) - 1:
+                curr_embedding = generator._slot_embedders[i](labels)
+        return slot_labels
+
+    def _get_soft_cross_entropy(self, teacher_logits, student_logits):
+        teacher_probs = F.softmax(teacher_logits / self._temperature, dim = -1)
+        student_log_probs = F.log_softmax(student_logits / self._temperature, dim = -1)
+        return -(teacher_probs * student_log_probs).sum(-1) * (self._temperature ** 2)
+
+    def get_metrics(self, reset: bool = False):
+        metrics_dict = {}
+        state_loss_dict = self._state_loss_metric.get_metric(reset = reset)
+        if state_loss_dict["n"] != 0:
+            metrics_dict["state-mse"] = state_loss_dict["mean"]
+        head_loss_dict = self._head_loss_metric.get_metric(reset = reset)
+        if head_loss_dict["n"] != 0:
+            metrics_dict["head-loss"] = head_loss_dict["mean"]
+        if reset:
+            self._state_loss_metric.reset()
+            self._head_loss_metric.reset()
+        return metrics_dict
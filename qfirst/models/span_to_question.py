@@ -30,6 +30,8 @@ class SpanToQuestionModel(Model):
                  sentence_encoder: SentenceEncoder,
                  question_generator: SlotSequenceGenerator,
                  inject_predicate: bool = False,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(SpanToQuestionModel, self).__init__(vocab, regularizer)
@@ -45,7 +47,7 @@ class SpanToQuestionModel(Model):
             raise ConfigurationError(
                 ("Input dimension of question generator (%s) must " % self._question_generator.get_input_dim()) + \
                 ("equal the span embedding dimension (plus predicate representation if necessary) (%s)." % question_input_dim))
-        self._metric = QuestionMetric(vocab, self._question_generator.get_slot_names())
+        self._metric = QuestionMetric(vocab, self._question_generator.get_slot_names(), deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     @overrides
     def forward(self,
@@ -72,15 +74,19 @@ class SpanToQuestionModel(Model):
                     answer_spans: torch.LongTensor,
                     max_beam_size: int,
                     min_beam_probability: float):
-        # Shape: 1, num_spans, question generator input dim
-        question_inputs, _ = self._get_question_inputs(text, predicate_indicator, predicate_index, answer_spans)
-        batch_size, num_spans, _ = question_inputs.size()
-        if batch_size > 1:
-            raise ConfigurationError("Must have a batch size of 1 for beam decoding (had batch size %s)" % (num_spans, batch_size))
-        question_inputs = question_inputs.squeeze(0)
-        return [self._question_generator.beam_decode(
-            question_inputs[i].unsqueeze(0), max_beam_size, min_beam_probability
-        ) for i in range(num_spans)]
+        # Shape: batch_size, num_spans, question generator input dim
+        question_inputs, span_mask = self._get_question_inputs(text, predicate_indicator, predicate_index, answer_spans)
+        batch_size, num_spans, input_dim = question_inputs.size()
+        # decode all non-padding spans of all batch items in a single beam search
+        span_mask_list = span_mask.tolist()
+        valid_span_indices = span_mask.view(-1).nonzero().view(-1)
+        span_beams = self._question_generator.beam_decode_batch(
+            question_inputs.view(-1, input_dim).index_select(0, valid_span_indices),
+            max_beam_size, min_beam_probability)
+        # regroup into a list of per-span beams for each batch item
+        span_beams_iter = iter(span_beams)
+        return [[next(span_beams_iter) for is_valid in span_mask_list[b] if is_valid > 0]
+                for b in range(batch_size)]
 
     def get_slot_names(self):
         return self._question_generator.get_slot_names()
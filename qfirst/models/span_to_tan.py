@@ -28,6 +28,8 @@ class SpanToTanModel(Model):
                  sentence_encoder: SentenceEncoder,
                  tan_ffnn: FeedForward,
                  inject_predicate: bool = False,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(SpanToTanModel, self).__init__(vocab, regularizer)
@@ -43,7 +45,7 @@ class SpanToTanModel(Model):
                 ReLU(),
                 self._tan_ffnn,
                 Linear(self._tan_ffnn.get_output_dim(), self.vocab.get_vocab_size("tan-string-labels"))))
-        self._metric = BinaryF1()
+        self._metric = BinaryF1(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     @overrides
     def forward(self,
@@ -24,6 +24,7 @@ from allennlp.training.metrics import SpanBasedF1Measure
 
 from qfirst.modules.span_rep_assembly import SpanRepAssembly
 from qfirst.common.span import Span
+from qfirst.metrics.metric_schedule import MetricSchedule
 
 # from qfirst.metrics.span_metric import SpanMetric
 
@@ -42,6 +43,7 @@ class PruningSpanSelector(torch.nn.Module, Registrable):
                  gold_span_selection_policy: str = "union",
                  pruning_ratio: float = 2.0,
                  skip_metrics_during_training: bool = True,
+                 compute_metrics_every: int = None,
                  # metric: SpanMetric = SpanMetric(),
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
@@ -54,7 +56,7 @@ class PruningSpanSelector(torch.nn.Module, Registrable):
         self._pruning_ratio = pruning_ratio
         self._objective = objective
         self._gold_span_selection_policy = gold_span_selection_policy
-        self._skip_metrics_during_training = skip_metrics_during_training
+        self._metric_schedule = MetricSchedule.from_flags(skip_metrics_during_training, compute_metrics_every)
 
         if objective not in objective_values:
             raise ConfigurationError("QA objective must be one of the following: " + str(qa_objective_values))
@@ -143,7 +145,7 @@ class PruningSpanSelector(torch.nn.Module, Registrable):
             loss = F.binary_cross_entropy_with_logits(top_span_logits, prediction_mask,
                                                         weight = top_span_mask, reduction = "sum")
             output_dict["loss"] = loss
-        if not (self.training and self._skip_metrics_during_training):
+        if self._metric_schedule.should_compute(self.training):
             output_dict = self.decode(output_dict)
             # self._metric(output_dict["spans"], [m["gold_spans"] for m in metadata])
         return output_dict
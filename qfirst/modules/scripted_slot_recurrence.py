@@ -0,0 +1,149 @@
+from typing import List, Tuple
+
+import torch
+from torch.nn.modules import LSTMCell
+import torch.nn.functional as F
+
+from allennlp.common.checks import ConfigurationError
+
+class _ScriptedSlotRecurrence(torch.nn.Module):
+    """
+    Inference-only (no dropout) version of the slot recurrence shared by ``SlotSequenceGenerator``
+    and ``SlotSequenceEncoder``, written so it can be compiled with ``torch.jit.script``.
+    It holds (detached) references to the eager module's parameters rather than copies,
+    so in-place weight updates (e.g., ``load_state_dict``) are picked up, but moving the eager
+    module to another device requires rebuilding it.
+    Parameters of slot ``i`` at layer ``l`` are stored at index ``i * num_layers + l``.
+    """
+    # declared here so TorchScript knows the element type even when a list is empty (e.g., no highway)
+    cell_w_ih: List[torch.Tensor]
+    cell_w_hh: List[torch.Tensor]
+    cell_b_ih: List[torch.Tensor]
+    cell_b_hh: List[torch.Tensor]
+    highway_nonlin_w: List[torch.Tensor]
+    highway_nonlin_b: List[torch.Tensor]
+    highway_lin_w: List[torch.Tensor]
+    embedding_weights: List[torch.Tensor]
+
+    def __init__(self, slot_module, hidden_dim: int) -> None:
+        super(_ScriptedSlotRecurrence, self).__init__()
+        self.num_slots = len(slot_module._slot_names)
+        self.num_layers = slot_module._num_layers
+        self.highway = slot_module._highway
+        self.hidden_dim = hidden_dim
+        cell_w_ih = []
+        cell_w_hh = []
+        cell_b_ih = []
+        cell_b_hh = []
+        highway_nonlin_w = []
+        highway_nonlin_b = []
+        highway_lin_w = []
+        for i in range(self.num_slots):
+            for l in range(self.num_layers):
+                cell = slot_module._rnn_cells[l][i]
+                if type(cell) != LSTMCell:
+                    raise ConfigurationError("Slot recurrence can only be scripted with plain LSTMCells; got %s" % type(cell))
+                cell_w_ih.append(cell.weight_ih.detach())
+                cell_w_hh.append(cell.weight_hh.detach())
+                cell_b_ih.append(cell.bias_ih.detach())
+                cell_b_hh.append(cell.bias_hh.detach())
+                if self.highway:
+                    highway_nonlin_w.append(slot_module._highway_nonlin[l][i].weight.detach())
+                    highway_nonlin_b.append(slot_module._highway_nonlin[l][i].bias.detach())
+                    highway_lin_w.append(slot_module._highway_lin[l][i].weight.detach())
+        self.cell_w_ih = cell_w_ih
+        self.cell_w_hh = cell_w_hh
+        self.cell_b_ih = cell_b_ih
+        self.cell_b_hh = cell_b_hh
+        self.highway_nonlin_w = highway_nonlin_w
+        self.highway_nonlin_b = highway_nonlin_b
+        self.highway_lin_w = highway_lin_w
+        embedding_weights = [e.weight.detach() for e in slot_module._slot_embedders]
+        self.embedding_weights = embedding_weights
+
+    @torch.jit.export
+    def recurrence(self,
+                   slot_index: int,
+                   inputs: torch.Tensor,
+                   curr_embedding: torch.Tensor,
+                   mem_h: List[torch.Tensor],
+                   mem_c: List[torch.Tensor]) -> Tuple[torch.Tensor, List[torch.Tensor], List[torch.Tensor]]:
+        next_h: List[torch.Tensor] = []
+        next_c: List[torch.Tensor] = []
+        curr_input = torch.cat([inputs, curr_embedding], -1)
+        new_h = curr_input
+        for l in range(self.num_layers):
+            p = slot_index * self.num_layers + l
+            new_h, new_c = torch.lstm_cell(
+                curr_input, [mem_h[l], mem_c[l]],
+                self.cell_w_ih[p], self.cell_w_hh[p], self.cell_b_ih[p], self.cell_b_hh[p])
+            next_h.append(new_h)
+            next_c.append(new_c)
+            if self.highway:
+                nonlin = F.linear(torch.cat([curr_input, new_h], -1), self.highway_nonlin_w[p], self.highway_nonlin_b[p])
+                gate = torch.sigmoid(nonlin)
+                curr_input = gate * new_h + (1. - gate) * F.linear(curr_input, self.highway_lin_w[p])
+            else:
+                curr_input = new_h
+        return new_h, next_h, next_c
+
+    def _init_mem(self, inputs: torch.Tensor) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        batch_size = inputs.size(0)
+        mem_h: List[torch.Tensor] = []
+        mem_c: List[torch.Tensor] = []
+        for l in range(self.num_layers):
+            mem_h.append(torch.zeros([batch_size, self.hidden_dim], dtype = inputs.dtype, device = inputs.device))
+            mem_c.append(torch.zeros([batch_size, self.hidden_dim], dtype = inputs.dtype, device = inputs.device))
+        return mem_h, mem_c
+
+class ScriptedSlotSequenceGenerator(_ScriptedSlotRecurrence):
+    slot_hidden_w: List[torch.Tensor]
+    slot_hidden_b: List[torch.Tensor]
+    slot_pred_w: List[torch.Tensor]
+    slot_pred_b: List[torch.Tensor]
+
+    def __init__(self, generator) -> None:
+        super(ScriptedSlotSequenceGenerator, self).__init__(generator, generator._rnn_hidden_dim)
+        slot_hidden_w = [l.weight.detach() for l in generator._slot_hiddens]
+        slot_hidden_b = [l.bias.detach() for l in generator._slot_hiddens]
+        slot_pred_w = [l.weight.detach() for l in generator._slot_preds]
+        slot_pred_b = [l.bias.detach() for l in generator._slot_preds]
+        self.slot_hidden_w = slot_hidden_w
+        self.slot_hidden_b = slot_hidden_b
+        self.slot_pred_w = slot_pred_w
+        self.slot_pred_b = slot_pred_b
+        self.start_symbol = generator._start_symbol.detach()
+
+    @torch.jit.export
+    def slot_logits(self, slot_index: int, h: torch.Tensor) -> torch.Tensor:
+        hidden = F.relu(F.linear(h, self.slot_hidden_w[slot_index], self.slot_hidden_b[slot_index]))
+        return F.linear(hidden, self.slot_pred_w[slot_index], self.slot_pred_b[slot_index])
+
+    def forward(self,
+                inputs: torch.Tensor,
+                slot_labels: List[torch.Tensor]) -> List[torch.Tensor]:
+        # teacher-forced; slot_labels[i] of Shape: batch_size (the last slot's labels are not needed)
+        mem_h, mem_c = self._init_mem(inputs)
+        curr_embedding = self.start_symbol.view(1, -1).expand(inputs.size(0), -1)
+        slot_logits: List[torch.Tensor] = []
+        for i in range(self.num_slots):
+            h, mem_h, mem_c = self.recurrence(i, inputs, curr_embedding, mem_h, mem_c)
+            slot_logits.append(self.slot_logits(i, h))
+            if i < self.num_slots - 1:
+                curr_embedding = F.embedding(slot_labels[i], self.embedding_weights[i])
+        return slot_logits
+
+class ScriptedSlotSequenceEncoder(_ScriptedSlotRecurrence):
+    def __init__(self, encoder) -> None:
+        super(ScriptedSlotSequenceEncoder, self).__init__(encoder, encoder._output_dim)
+
+    def forward(self,
+                pred_reps: torch.Tensor,
+                slot_labels: List[torch.Tensor]) -> torch.Tensor:
+        # slot_labels[i] of Shape: batch_size
+        mem_h, mem_c = self._init_mem(pred_reps)
+        last_h = pred_reps
+        for i in range(self.num_slots):
+            curr_embedding = F.embedding(slot_labels[i], self.embedding_weights[i])
+            last_h, mem_h, mem_c = self.recurrence(i, pred_reps, curr_embedding, mem_h, mem_c)
+        return last_h
@@ -26,6 +26,8 @@ class SentenceEncoder(torch.nn.Module, Registrable):
                  stacked_encoder: Seq2SeqEncoder = None,
                  predicate_feature_dim: int = 0,
                  embedding_dropout: float = 0.0,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  initializer: InitializerApplicator = InitializerApplicator(),
                  regularizer: Optional[RegularizerApplicator] = None):
         super(SentenceEncoder, self).__init__()
@@ -44,7 +46,7 @@ class SentenceEncoder(torch.nn.Module, Registrable):
                     ("Input dimension of sentence encoder (%s) must be " % self._stacked_encoder.get_input_dim()) + \
                     ("the sum of predicate feature dim and text embedding dim (%s)." % (embedding_dim_with_predicate_feature)))
 
-        self._metric = BinaryF1()
+        self._metric = BinaryF1(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     def get_output_dim(self):
         if self._stacked_encoder is not None:
@@ -25,6 +25,7 @@ from allennlp.training.metrics import SpanBasedF1Measure
 from qfirst.common.span import Span
 from qfirst.metrics.binary_f1 import BinaryF1
 from qfirst.metrics.moments_metric import MomentsMetric
+from qfirst.metrics.metric_schedule import MetricSchedule
 from qfirst.modules.span_rep_assembly import SpanRepAssembly
 from qfirst.modules.set_classifier.set_classifier import SetClassifier
 
@@ -35,6 +36,9 @@ class SetBinaryClassifier(torch.nn.Module, Registrable):
     def __init__(self,
                  label_selection_policy = "union",
                  skip_metrics_during_training: bool = False,
+                 compute_metrics_every: int = None,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  metric: BinaryF1 = BinaryF1()):
         super(SetBinaryClassifier, self).__init__()
 
@@ -42,9 +46,9 @@ class SetBinaryClassifier(torch.nn.Module, Registrable):
             raise ConfigurationError("Label selection policy must be one of: " + str(label_selection_policy_values))
 
         self._label_selection_policy = label_selection_policy
-        self._skip_metrics_during_training = skip_metrics_during_training
-        self._metric = metric
-        self._kl_divergence_metric = MomentsMetric()
+        self._metric_schedule = MetricSchedule.from_flags(skip_metrics_during_training, compute_metrics_every)
+        self._metric = metric.with_schedule(deferred_metrics, materialize_metrics_every)
+        self._kl_divergence_metric = MomentsMetric(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
 
     def forward(self,  # type: ignore
                 logits: torch.LongTensor, # batch_size, set_size, 1
@@ -75,7 +79,7 @@ class SetBinaryClassifier(torch.nn.Module, Registrable):
                 logits, labels, weight = float_mask, reduction = "none"
             ).sum(1)
             output_dict["loss"] = cross_entropy.sum()
-            if not (self.training and self._skip_metrics_during_training):
+            if self._metric_schedule.should_compute(self.training):
                 self._metric(probs, label_counts > 0.0, mask)
                 if self._label_selection_policy == "weighted":
                     inverse_labels = 1.0 - labels
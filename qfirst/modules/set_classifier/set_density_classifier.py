@@ -23,6 +23,7 @@ from allennlp.training.metrics import SpanBasedF1Measure
 from qfirst.common.span import Span
 from qfirst.metrics.binary_f1 import BinaryF1
 from qfirst.metrics.moments_metric import MomentsMetric
+from qfirst.metrics.metric_schedule import MetricSchedule
 from qfirst.modules.span_rep_assembly import SpanRepAssembly
 from qfirst.modules.set_classifier.set_classifier import SetClassifier
 from qfirst.util.sparsemax import sparsemax, multilabel_sparsemax_loss
@@ -37,6 +38,9 @@ class SetDensityClassifier(torch.nn.Module, Registrable):
                  uncertainty_factor: float = None, # only used with softmax/null
                  sparsemax_gamma: float = 1.0, # only used with sparsemax
                  skip_metrics_during_training: bool = False,
+                 compute_metrics_every: int = None,
+                 deferred_metrics: bool = False,
+                 materialize_metrics_every: int = 0,
                  prob_metric: BinaryF1 = BinaryF1(),
                  score_metric: BinaryF1 = BinaryF1([-1, 0, 1, 2, 4, 6, 8, 12, 16])):
         super(SetDensityClassifier, self).__init__()
@@ -47,17 +51,17 @@ class SetDensityClassifier(torch.nn.Module, Registrable):
 
         self._uncertainty_factor = uncertainty_factor
         self._sparsemax_gamma = sparsemax_gamma
-        self._skip_metrics_during_training = skip_metrics_during_training
+        self._metric_schedule = MetricSchedule.from_flags(skip_metrics_during_training, compute_metrics_every)
 
-        self._gold_recall_metric = MomentsMetric()
-        self._prob_metric = prob_metric
+        self._gold_recall_metric = MomentsMetric(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
+        self._prob_metric = prob_metric.with_schedule(deferred_metrics, materialize_metrics_every)
 
         if objective == "softmax_with_null":
-            self._score_metric = score_metric
-            self._kl_divergence_metric = MomentsMetric()
-            self._null_prob_metric = MomentsMetric()
+            self._score_metric = score_metric.with_schedule(deferred_metrics, materialize_metrics_every)
+            self._kl_divergence_metric = MomentsMetric(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
+            self._null_prob_metric = MomentsMetric(deferred = deferred_metrics, materialize_every = materialize_metrics_every)
         elif objective == "sparsemax":
-            self._zero_metric = BinaryF1([0.0])
+            self._zero_metric = BinaryF1([0.0], deferred = deferred_metrics, materialize_every = materialize_metrics_every)
         else:
             raise ConfigurationError("should never happen")
 
@@ -104,7 +108,7 @@ class SetDensityClassifier(torch.nn.Module, Registrable):
                 full_gold_probs = F.normalize(full_gold_counts, p = 1, dim = 1)
                 cross_entropy = torch.sum(-full_gold_probs * full_log_probs, 1)
                 output_dict["loss"] = torch.mean(cross_entropy)
-                if not (self.training and self._skip_metrics_during_training):
+                if self._metric_schedule.should_compute(self.training):
                     labels = label_counts > 0.0
                     self._prob_metric(probs, labels, mask)
                     self._score_metric(logits, labels, mask)
@@ -128,7 +132,7 @@ class SetDensityClassifier(torch.nn.Module, Registrable):
             if label_counts is not None:
                 loss = multilabel_sparsemax_loss(logits, gold_probs, mask).mean()
                 output_dict["loss"] = loss
-                if not (self.training and self._skip_metrics_during_training):
+                if self._metric_schedule.should_compute(self.training):
                     labels = label_counts > 0.0
                     self._prob_metric(probs, labels, mask)
                     self._zero_metric(probs, labels, mask)
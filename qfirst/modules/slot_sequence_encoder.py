@@ -13,6 +13,7 @@ from allennlp.modules import TimeDistributed
 
 from qfirst.util.model_utils import block_orthonormal_initialization
 from qfirst.data.util import get_slot_label_namespace
+from qfirst.modules.scripted_slot_recurrence import ScriptedSlotSequenceEncoder
 
 class SlotSequenceEncoder(torch.nn.Module, Registrable):
     def __init__(self,
@@ -24,7 +25,8 @@ class SlotSequenceEncoder(torch.nn.Module, Registrable):
             num_layers: int = 1,
             recurrent_dropout: float = 0.1,
             highway: bool = True,
-            share_rnn_cell: bool =  False):
+            share_rnn_cell: bool =  False,
+            script_inference: bool = False):
         super(SlotSequenceEncoder, self).__init__()
         self._vocab = vocab
         self._slot_names = slot_names
@@ -93,9 +95,23 @@ class SlotSequenceEncoder(torch.nn.Module, Registrable):
             self._highway_nonlin = highway_nonlin
             self._highway_lin = highway_lin
 
+        # use the TorchScript-compiled recurrence outside of training
+        self._script_inference = script_inference
+        # (parameter location, compiled recurrence) pair; kept in a list so it isn't registered as a submodule
+        self._scripted = []
+
+    def get_scripted(self):
+        key = self._slot_embedders[0].weight.data_ptr()
+        if len(self._scripted) == 0 or self._scripted[0][0] != key:
+            self._scripted[:] = [(key, torch.jit.script(ScriptedSlotSequenceEncoder(self)))]
+        return self._scripted[0][1]
+
     def forward(self,
                 pred_reps,
                 slot_labels: Dict[str, torch.LongTensor]):
+        if self._script_inference and not self.training:
+            return self.get_scripted()(pred_reps, [slot_labels[n] for n in self._slot_names])
+
         # Shape: batch_size, numpred_rep_dim
         batch_size, pred_rep_dim = pred_reps.size()
 
@@ -16,6 +16,7 @@ from allennlp.modules import TimeDistributed
 
 from qfirst.util.model_utils import block_orthonormal_initialization
 from qfirst.data.util import get_slot_label_namespace
+from qfirst.modules.scripted_slot_recurrence import ScriptedSlotSequenceGenerator
 
 import logging
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -33,6 +34,7 @@ class SlotSequenceGenerator(torch.nn.Module, Registrable):
                  highway: bool = True,
                  share_rnn_cell: bool =  False,
                  share_slot_hidden: bool = False,
+                 script_inference: bool = False,
                  clause_mode: bool = False): # clause_mode flag no longer used
         super(SlotSequenceGenerator, self).__init__()
         self.vocab = vocab
@@ -139,6 +141,17 @@ class SlotSequenceGenerator(torch.nn.Module, Registrable):
 
         self._start_symbol = Parameter(torch.Tensor(self._slot_embedding_dim).normal_(0, 1))
 
+        # use the TorchScript-compiled recurrence outside of training
+        self._script_inference = script_inference
+        # (parameter location, compiled recurrence) pair; kept in a list so it isn't registered as a submodule
+        self._scripted = []
+
+    def get_scripted(self):
+        key = self._start_symbol.data_ptr()
+        if len(self._scripted) == 0 or self._scripted[0][0] != key:
+            self._scripted[:] = [(key, torch.jit.script(ScriptedSlotSequenceGenerator(self)))]
+        return self._scripted[0][1]
+
     def get_slot_names(self):
         return self._slot_names
 
@@ -152,6 +165,15 @@ class SlotSequenceGenerator(torch.nn.Module, Registrable):
                               curr_embedding,
                               curr_mem):
 
+        if self._script_inference and not self.training:
+            scripted = self.get_scripted()
+            new_h, next_h, next_c = scripted.recurrence(
+                slot_index, inputs, curr_embedding, [h for h, _ in curr_mem], [c for _, c in curr_mem])
+            return {
+                "next_mem": list(zip(next_h, next_c)),
+                "logits": scripted.slot_logits(slot_index, new_h)
+            }
+
         next_mem  = []
         curr_input = torch.cat([inputs, curr_embedding], -1)
         for l in range(self._num_layers):
@@ -197,6 +219,10 @@ class SlotSequenceGenerator(torch.nn.Module, Registrable):
 
         # TODO check input_dim == input_dim
 
+        if self._script_inference and not self.training:
+            all_slot_logits = self.get_scripted()(inputs, [slot_labels[n] for n in self._slot_names[:-1]])
+            return dict(zip(self._slot_names, all_slot_logits))
+
         curr_embedding, curr_mem = self._init_recurrence(inputs)
         slot_logits = {}
         for i, n in enumerate(self._slot_names):
@@ -307,3 +333,102 @@ class SlotSequenceGenerator(torch.nn.Module, Registrable):
         }
         final_probs = final_log_probs.exp()
         return final_slot_indices, final_slot_labels, final_probs.tolist()
+
+    def beam_decode_batch(self,
+                          inputs, # shape: num_inputs, input_dim
+                          max_beam_size,
+                          min_beam_probability,
+                          clause_mode: bool = False):
+        # Same search as beam_decode, run for every row of inputs at once.
+        # The beams of all inputs live in one (num_inputs, beam_size) grid, so each slot costs a single
+        # batched recurrence step. Returns one (slot_indices, slot_labels, probs) triple per input row.
+        min_beam_log_probability = math.log(min_beam_probability)
+        num_inputs, input_dim = inputs.size()
+        if input_dim != self.get_input_dim():
+            raise ConfigurationError("input dimension must match dimensionality of slot sequence model input.")
+        if num_inputs == 0:
+            return []
+
+        # Shape: num_inputs * beam_size, ... (the beam starts out with a single entry per input)
+        curr_embedding, curr_mem = self._init_recurrence(inputs)
+        # accumulate in double precision to match the python float arithmetic of beam_decode.
+        # Entries that fell below the threshold are kept as -inf and sort to the end of the beam.
+        # Shape: num_inputs, beam_size
+        beam_log_probs = inputs.new_zeros([num_inputs, 1], dtype = torch.float64)
+        beam_size = 1
+        input_offsets = torch.arange(num_inputs, dtype = torch.long, device = inputs.device).unsqueeze(1)
+
+        ## metadata to recover sequences
+        # per slot, Shape: num_inputs, beam_size; values index into the previous slot's beam
+        backpointers = []
+        # per slot, Shape: num_inputs, beam_size; values are slot value indices
+        slot_beam_labels = []
+
+        for slot_index, slot_name in enumerate(self._slot_names):
+            ending_clause_with_qarg = clause_mode and slot_index == (len(self._slot_names) - 1) and slot_name == "clause-qarg"
+            # Shape: num_inputs * beam_size, input_dim
+            beam_inputs = inputs.unsqueeze(1).expand(num_inputs, beam_size, input_dim).contiguous().view(-1, input_dim)
+            recurrence_dict = self._slot_quasi_recurrence(slot_index, slot_name, beam_inputs, curr_embedding, curr_mem)
+            num_slot_values = recurrence_dict["logits"].size(-1)
+            # Shape: num_inputs, beam_size, num_slot_values
+            log_probabilities = F.log_softmax(recurrence_dict["logits"], -1).double() \
+                                 .view(num_inputs, beam_size, num_slot_values)
+            # Shape: num_inputs, beam_size * num_slot_values
+            candidate_log_probs = (beam_log_probs.unsqueeze(-1) + log_probabilities).view(num_inputs, -1)
+
+            # as in beam_decode, keep all expansions of the last step if we're on the qarg slot of a clause; they're filtered below
+            new_beam_size = min(max_beam_size, beam_size * num_slot_values) if not ending_clause_with_qarg else beam_size * num_slot_values
+            # Shape: num_inputs, new_beam_size
+            beam_log_probs, candidate_indices = candidate_log_probs.topk(new_beam_size, dim = 1)
+            if not ending_clause_with_qarg:
+                beam_log_probs = beam_log_probs.masked_fill(beam_log_probs < min_beam_log_probability, float("-inf"))
+            backpointer = candidate_indices // num_slot_values
+            slot_values = candidate_indices - (backpointer * num_slot_values)
+            backpointers.append(backpointer)
+            slot_beam_labels.append(slot_values)
+
+            # Shape: num_inputs * new_beam_size
+            flat_backpointer = (backpointer + (input_offsets * beam_size)).view(-1)
+            curr_mem = [(h.index_select(0, flat_backpointer), c.index_select(0, flat_backpointer))
+                        for h, c in recurrence_dict["next_mem"]]
+            if slot_index < len(self._slot_names) - 1:
+                curr_embedding = self._slot_embedders[slot_index](slot_values.view(-1))
+            beam_size = new_beam_size
+
+        final_slots = {}
+        current_backpointer = torch.arange(beam_size, dtype = torch.long, device = inputs.device) \
+                                   .unsqueeze(0).expand(num_inputs, beam_size)
+        for slot_index in reversed(range(len(self._slot_names))):
+            slot_name = self._slot_names[slot_index]
+            final_slots[slot_name] = slot_beam_labels[slot_index].gather(1, current_backpointer).tolist()
+            current_backpointer = backpointers[slot_index].gather(1, current_backpointer)
+
+        # valid entries form a prefix of each row since topk returns them in descending order
+        final_beam_sizes = (beam_log_probs > float("-inf")).long().sum(1).tolist()
+        final_probs = beam_log_probs.exp().tolist()
+        results = []
+        for input_index, final_beam_size in enumerate(final_beam_sizes):
+            chosen_beam_indices = list(range(final_beam_size))
+            if clause_mode:
+                # remove questions whose core argument is invalid, as in beam_decode
+                chosen_beam_indices = []
+                for beam_index in range(final_beam_size):
+                    qarg_name = self.vocab.get_token_from_index(final_slots["clause-qarg"][input_index][beam_index], get_slot_label_namespace("clause-qarg"))
+                    qarg = "clause-%s" % qarg_name
+                    if qarg in self.get_slot_names():
+                        arg_value = self.vocab.get_token_from_index(final_slots[qarg][input_index][beam_index], get_slot_label_namespace(qarg))
+                        should_keep = arg_value != "_"
+                    else:
+                        should_keep = True
+                    if should_keep:
+                        chosen_beam_indices.append(beam_index)
+            final_slot_indices = {
+                slot_name: [slot_indices[input_index][i] for i in chosen_beam_indices]
+                for slot_name, slot_indices in final_slots.items() }
+            final_slot_labels = {
+                slot_name: [self.vocab.get_token_from_index(index, get_slot_label_namespace(slot_name))
+                            for index in slot_indices]
+                for slot_name, slot_indices in final_slot_indices.items()
+            }
+            results.append((final_slot_indices, final_slot_labels, [final_probs[input_index][i] for i in chosen_beam_indices]))
+        return results
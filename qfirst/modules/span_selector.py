@@ -115,6 +115,30 @@ class SpanSelector(torch.nn.Module, Registrable):
 
         return self._classifier(logits = span_logits, mask = span_mask, label_counts = span_counts_dist, num_labelers = num_answers)
 
+    def forward_on_extra_inputs(self,
+                                inputs: torch.FloatTensor,
+                                input_mask: torch.LongTensor,
+                                extra_input_embeddings: torch.FloatTensor,
+                                extra_input_mask: torch.LongTensor):
+        # Inference with several extra inputs (e.g., question embeddings) per input:
+        # extra_input_embeddings (batch_size, num_extra_inputs, extra_input_dim) with extra_input_mask (batch_size, num_extra_inputs).
+        # The span representations are computed once per input rather than once per extra input.
+        # Returns the classifier outputs with one row per unmasked extra input, in row-major order.
+        if self._extra_input_dim == 0:
+            raise ConfigurationError("SpanSelector must have extra input configured to run on extra inputs.")
+        num_extra_inputs = extra_input_embeddings.size(1)
+        # Shape: batch_size, num_spans, span_hidden_dim
+        span_hidden, span_mask = self._span_hidden(inputs, inputs, input_mask, input_mask)
+        # Shape: num_selected
+        selected_indices = extra_input_mask.view(-1).nonzero().squeeze(-1)
+        input_indices = selected_indices // num_extra_inputs
+        # Shape: num_selected, extra_input_dim
+        selected_embeddings = extra_input_embeddings.view(-1, self._extra_input_dim).index_select(0, selected_indices)
+        # Shape: num_selected, num_spans, span_hidden_dim
+        full_hidden = self._extra_input_lin(selected_embeddings).unsqueeze(1) + span_hidden.index_select(0, input_indices)
+        span_logits = self._span_scorer(full_hidden).squeeze(-1)
+        return self._classifier(logits = span_logits, mask = span_mask.index_select(0, input_indices))
+
     def decode(self, output_dict: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         if "spans" not in output_dict:
             o = output_dict
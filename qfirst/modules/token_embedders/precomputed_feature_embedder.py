@@ -0,0 +1,46 @@
+from typing import Optional
+
+from overrides import overrides
+import torch
+
+from allennlp.common.checks import ConfigurationError
+from allennlp.modules.scalar_mix import ScalarMix
+from allennlp.modules.token_embedders.token_embedder import TokenEmbedder
+
+from qfirst.data.precomputed_features import get_feature_store
+
+@TokenEmbedder.register("precomputed_features")
+class PrecomputedFeatureEmbedder(TokenEmbedder):
+    """
+    Looks up frozen contextual features from a memory-mapped feature store, by the row ids produced by
+    ``PrecomputedFeatureIndexer``. Uses a single layer if ``layer_index`` is given,
+    and otherwise a learned scalar mix of all layers (as ELMo does).
+    """
+    def __init__(self,
+                 feature_file_prefix: str,
+                 layer_index: Optional[int] = None,
+                 dropout: float = 0.0) -> None:
+        super(PrecomputedFeatureEmbedder, self).__init__()
+        self._store = get_feature_store(feature_file_prefix)
+        self._layer_index = layer_index
+        if layer_index is not None and not (0 <= layer_index < self._store.num_layers):
+            raise ConfigurationError("Layer index %d out of range for feature store with %d layers." % (layer_index, self._store.num_layers))
+        self._scalar_mix = ScalarMix(self._store.num_layers) if layer_index is None else None
+        self._dropout = torch.nn.Dropout(p = dropout)
+
+    @overrides
+    def get_output_dim(self) -> int:
+        return self._store.dim
+
+    @overrides
+    def forward(self, inputs: torch.LongTensor) -> torch.Tensor:  # pylint: disable=arguments-differ
+        # Shape: batch_size, num_tokens; ids are row + 1, with 0 for padding
+        rows = (inputs - 1).clamp(min = 0).cpu().numpy()
+        if self._layer_index is not None:
+            # Shape: batch_size, num_tokens, dim
+            features = torch.from_numpy(self._store.features[rows, self._layer_index]).to(inputs.device)
+        else:
+            # Shape: batch_size, num_tokens, num_layers, dim
+            all_features = torch.from_numpy(self._store.get_features(rows)).to(inputs.device)
+            features = self._scalar_mix([all_features[:, :, l] for l in range(self._store.num_layers)])
+        return self._dropout(features)
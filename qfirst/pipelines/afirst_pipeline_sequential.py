@@ -1,10 +1,8 @@
  # completely ridiculous hack to import stuff properly. somebody save me from myself
 import importlib
-from allennlp.common.util import import_submodules
 importlib.invalidate_caches()
 import sys
 sys.path.append(".")
-import_submodules("qfirst")
 
 from typing import List, Iterator, Optional, Set
 
@@ -36,6 +34,7 @@ from qfirst.data.util import read_lines, get_verb_fields
 from qfirst.models.span import SpanModel
 from qfirst.models.span_to_question import SpanToQuestionModel
 from qfirst.util.archival_utils import load_archive_from_folder
+from qfirst.util.pipeline_runner import run_pipeline
 
 span_minimum_threshold_default = 0.3
 question_minimum_threshold_default = 0.01
@@ -88,27 +87,36 @@ class AFirstPipelineSequential():
         verb_dicts = []
         if len(span_verb_instances) > 0:
             span_outputs = self._span_model.forward_on_instances(span_verb_instances)
+            verb_scored_spans = []
+            qgen_instances = []
             for (verb_instance, span_output, ref_spans) in zip(span_to_question_verb_instances, span_outputs, verb_spans):
-                beam = []
                 scored_spans = [
                     (s, p)
                     for s, p in span_output["spans"]
                     if p >= self._span_minimum_threshold or s in ref_spans # always include reference spans
                 ]
+                verb_scored_spans.append(scored_spans)
                 span_fields = [SpanField(span.start(), span.end(), verb_instance["text"]) for span, _ in scored_spans]
                 if len(span_fields) > 0:
                     verb_instance.index_fields(self._span_to_question_model.vocab)
                     verb_instance.add_field("answer_spans", ListField(span_fields), self._span_to_question_model.vocab)
-                    qgen_input_tensors = move_to_device(
-                        Batch([verb_instance]).as_tensor_dict(),
-                        self._span_to_question_model._get_prediction_device())
-                    question_beams = self._span_to_question_model.beam_decode(
-                        text = qgen_input_tensors["text"],
-                        predicate_indicator = qgen_input_tensors["predicate_indicator"],
-                        predicate_index = qgen_input_tensors["predicate_index"],
-                        answer_spans = qgen_input_tensors["answer_spans"],
-                        max_beam_size = self._question_beam_size,
-                        min_beam_probability = self._question_minimum_threshold)
+                    qgen_instances.append(verb_instance)
+            # decode questions for the spans of all verbs in one batch
+            if len(qgen_instances) > 0:
+                qgen_input_tensors = move_to_device(
+                    Batch(qgen_instances).as_tensor_dict(),
+                    self._span_to_question_model._get_prediction_device())
+                verb_question_beams = iter(self._span_to_question_model.beam_decode(
+                    text = qgen_input_tensors["text"],
+                    predicate_indicator = qgen_input_tensors["predicate_indicator"],
+                    predicate_index = qgen_input_tensors["predicate_index"],
+                    answer_spans = qgen_input_tensors["answer_spans"],
+                    max_beam_size = self._question_beam_size,
+                    min_beam_probability = self._question_minimum_threshold))
+            for (verb_instance, scored_spans) in zip(span_to_question_verb_instances, verb_scored_spans):
+                beam = []
+                if len(scored_spans) > 0:
+                    question_beams = next(verb_question_beams)
                     for (span, span_prob), (_, slot_values, question_probs) in zip(scored_spans, question_beams):
                         scored_questions = []
                         for i in range(len(question_probs)):
@@ -142,7 +150,11 @@ def main(span_model_path: str,
          output_file: str,
          span_min_prob: float,
          question_min_prob: float,
-         question_beam_size: int) -> None:
+         question_beam_size: int,
+         quantize: bool = False,
+         num_workers: int = 1,
+         resume: bool = False,
+         prediction_cache: str = None) -> None:
 
     check_for_gpu(cuda_device)
 
@@ -150,14 +162,14 @@ def main(span_model_path: str,
         span_model_path,
         cuda_device = cuda_device,
         overrides = '{ "model": { "span_selector": {"span_decoding_threshold": 0.00} } }',
-        weights_file = os.path.join(span_model_path, "best.th"))
+        weights_file = os.path.join(span_model_path, "best.th"), quantize = quantize)
 
     # override span detection threshold to be low enough so we can reasonably approximate bad spans
     # as having probability 0.
     span_to_question_model_archive = load_archive_from_folder(
         span_to_question_model_path,
         cuda_device = cuda_device,
-        weights_file = os.path.join(span_to_question_model_path, "best.th"))
+        weights_file = os.path.join(span_to_question_model_path, "best.th"), quantize = quantize)
 
     span_model_dataset_reader_params = span_model_archive.config["dataset_reader"].duplicate()
     span_model_dataset_reader_params["qasrl_filter"]["allow_all"] = True
@@ -173,24 +185,7 @@ def main(span_model_path: str,
         span_minimum_threshold = span_min_prob,
         question_minimum_threshold = question_min_prob,
         question_beam_size = question_beam_size)
-    if output_file is None:
-        for line in tqdm(read_lines(cached_path(input_file))):
-            input_json = json.loads(line)
-            output_json = pipeline.predict(input_json)
-            print(json.dumps(output_json))
-    elif output_file.endswith('.gz'):
-        with gzip.open(output_file, 'wt') as f:
-            for line in tqdm(read_lines(cached_path(input_file))):
-                input_json = json.loads(line)
-                output_json = pipeline.predict(input_json)
-                f.write(json.dumps(output_json))
-                f.write('\n')
-    else:
-        with open(output_file, 'w', encoding = 'utf8') as out:
-            for line in tqdm(read_lines(cached_path(input_file))):
-                input_json = json.loads(line)
-                output_json = pipeline.predict(input_json)
-                print(json.dumps(output_json), file = out)
+    run_pipeline(pipeline, input_file, output_file, show_progress = True, num_workers = num_workers, resume = resume, prediction_cache = prediction_cache)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Run the answer-first pipeline")
@@ -202,6 +197,10 @@ if __name__ == "__main__":
     parser.add_argument('--span_min_prob', type=float, default = span_minimum_threshold_default)
     parser.add_argument('--question_min_prob', type=float, default = question_minimum_threshold_default)
     parser.add_argument('--question_beam_size', type=int, default = question_beam_size_default)
+    parser.add_argument('--quantize', action = 'store_true', help = "Apply dynamic int8 quantization to the models (CPU only).")
+    parser.add_argument('--num_workers', type=int, default = 1, help = "Number of CPU worker processes to shard the input over.")
+    parser.add_argument('--resume', action = 'store_true', help = "Continue an interrupted run from the checkpoint next to the output file.")
+    parser.add_argument('--prediction_cache', type=str, default = None, help = "Path to an on-disk cache of outputs, reused across runs with the same models and settings.")
 
     args = parser.parse_args()
     main(span_model_path = args.span,
@@ -211,4 +210,8 @@ if __name__ == "__main__":
          output_file = args.output_file,
          span_min_prob = args.span_min_prob,
          question_min_prob = args.question_min_prob,
-         question_beam_size = args.question_beam_size)
+         question_beam_size = args.question_beam_size,
+         quantize = args.quantize,
+         num_workers = args.num_workers,
+         resume = args.resume,
+         prediction_cache = args.prediction_cache)
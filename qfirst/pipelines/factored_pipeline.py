@@ -1,14 +1,12 @@
  # completely ridiculous hack to import stuff properly. somebody save me from myself
 import importlib
-from allennlp.common.util import import_submodules
 importlib.invalidate_caches()
 import sys
 sys.path.append(".")
-import_submodules("qfirst")
 
 from typing import List, Iterator, Optional, Dict
 
-import torch, os, json, tarfile, argparse, uuid, shutil
+import torch, os, json, tarfile, argparse, uuid, shutil, time
 import sys
 
 from overrides import overrides
@@ -35,11 +33,14 @@ from qfirst.models.span import SpanModel
 from qfirst.models.span_to_tan import SpanToTanModel
 from qfirst.models.animacy import AnimacyModel
 from qfirst.models.clause_and_span_to_answer_slot import ClauseAndSpanToAnswerSlotModel
-from qfirst.util.archival_utils import load_archive_from_folder
+from qfirst.util.archival_utils import ArchiveLoader
+from qfirst.util.pipeline_utils import forward_on_verb_spans, k_best_pairs
+from qfirst.util.pipeline_runner import run_pipeline
 
 clause_minimum_threshold_default = 0.10
 span_minimum_threshold_default = 0.10
 tan_minimum_threshold_default = 0.20
+pair_minimum_threshold_default = 0.0
 
 class FactoredPipeline():
     def __init__(self,
@@ -57,7 +58,9 @@ class FactoredPipeline():
                  animacy_model_dataset_reader: QasrlReader,
                  clause_minimum_threshold: float = span_minimum_threshold_default,
                  span_minimum_threshold: float = clause_minimum_threshold_default,
-                 tan_minimum_threshold: float = tan_minimum_threshold_default) -> None:
+                 tan_minimum_threshold: float = tan_minimum_threshold_default,
+                 max_pairs_per_verb: Optional[int] = None,
+                 pair_minimum_threshold: float = pair_minimum_threshold_default) -> None:
         self._span_model = span_model
         self._span_model_dataset_reader = span_model_dataset_reader
         self._clause_model = clause_model
@@ -73,6 +76,86 @@ class FactoredPipeline():
         self._clause_minimum_threshold = clause_minimum_threshold
         self._span_minimum_threshold = span_minimum_threshold
         self._tan_minimum_threshold = tan_minimum_threshold
+        self._max_pairs_per_verb = max_pairs_per_verb
+        self._pair_minimum_threshold = pair_minimum_threshold
+
+    def _predict_answer_slots(self,
+                              answer_slot_instances: List[Instance],
+                              verb_scored_clauses,
+                              verb_scored_spans):
+        # scores the clause x span grid of every verb in one batch; returns the QA beam for each verb
+        if self._max_pairs_per_verb is not None or self._pair_minimum_threshold > 0.0:
+            # joint budget: only the k-best pairs by clauseProb * spanProb get scored
+            verb_pairs = [
+                k_best_pairs([p for _, p in scored_clauses], [p for _, p in scored_spans],
+                             self._max_pairs_per_verb, self._pair_minimum_threshold)
+                for scored_clauses, scored_spans in zip(verb_scored_clauses, verb_scored_spans)
+            ]
+        else:
+            verb_pairs = None
+        grid_verbs = [
+            i for i, (scored_clauses, scored_spans) in enumerate(zip(verb_scored_clauses, verb_scored_spans))
+            if len(scored_clauses) > 0 and len(scored_spans) > 0 and (verb_pairs is None or len(verb_pairs[i]) > 0)
+        ]
+        verb_qa_beams = [[] for _ in answer_slot_instances]
+        if len(grid_verbs) == 0:
+            return verb_qa_beams
+        vocab = self._answer_slot_model.vocab
+        grid_instances = [answer_slot_instances[i] for i in grid_verbs]
+        for instance in grid_instances:
+            instance.index_fields(vocab)
+        max_num_clauses = max([len(verb_scored_clauses[i]) for i in grid_verbs])
+        max_num_spans = max([len(verb_scored_spans[i]) for i in grid_verbs])
+        def pad(xs, length, padding):
+            return xs + [padding for _ in range(length - len(xs))]
+        grid_tensors = Batch(grid_instances).as_tensor_dict()
+        if verb_pairs is not None:
+            max_num_pairs = max([len(verb_pairs[i]) for i in grid_verbs])
+            grid_tensors["pair_indices"] = torch.LongTensor([
+                pad(sorted([c * max_num_spans + s for c, s in verb_pairs[i]]), max_num_pairs, -1)
+                for i in grid_verbs])
+        input_tensors = move_to_device({
+            **grid_tensors,
+            "clauses": torch.LongTensor([
+                pad([vocab.get_token_index(c, namespace = "abst-clause-labels") for c, _ in verb_scored_clauses[i]], max_num_clauses, -1)
+                for i in grid_verbs]),
+            "spans": torch.LongTensor([
+                pad([[s.start(), s.end()] for s, _ in verb_scored_spans[i]], max_num_spans, [-1, -1])
+                for i in grid_verbs])
+        }, self._answer_slot_model._get_prediction_device())
+        with torch.no_grad():
+            self._answer_slot_model.eval()
+            grid_output = self._answer_slot_model.predict_clause_span_grid(
+                text = input_tensors["text"],
+                predicate_indicator = input_tensors["predicate_indicator"],
+                predicate_index = input_tensors["predicate_index"],
+                clauses = input_tensors["clauses"],
+                spans = input_tensors["spans"],
+                pair_indices = input_tensors.get("pair_indices"))
+
+        qarg_labels = [
+            vocab.get_token_from_index(slot_index, namespace = "qarg-labels")
+            for slot_index in range(vocab.get_vocab_size("qarg-labels"))
+        ]
+        all_pair_probs = grid_output["probs"].tolist()
+        all_pair_masks = grid_output["pair_mask"].tolist()
+        all_clause_indices = grid_output["clause_indices"].tolist()
+        all_span_indices = grid_output["span_indices"].tolist()
+        for b, verb in enumerate(grid_verbs):
+            qa_beam = verb_qa_beams[verb]
+            for pair_probs, pair_mask, clause_index, span_index in zip(all_pair_probs[b], all_pair_masks[b], all_clause_indices[b], all_span_indices[b]):
+                if pair_mask == 0:
+                    continue
+                clause, clause_prob = verb_scored_clauses[verb][clause_index]
+                span, span_prob = verb_scored_spans[verb][span_index]
+                qa_beam.append({
+                    "clause": clause,
+                    "clauseProb": clause_prob,
+                    "span": [span.start(), span.end() + 1],
+                    "spanProb": span_prob,
+                    "answerSlots": dict(zip(qarg_labels, pair_probs))
+                })
+        return verb_qa_beams
 
     def predict(self, inputs: JsonDict) -> JsonDict:
         clause_instances = list(self._clause_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
@@ -82,63 +165,29 @@ class FactoredPipeline():
         tan_instances = list(self._tan_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
         tan_outputs = self._tan_model.forward_on_instances(tan_instances)
 
-        answer_slot_instances = self._answer_slot_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True)
+        answer_slot_instances = list(self._answer_slot_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
         span_to_tan_instances = list(self._span_to_tan_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
         animacy_instances = list(self._animacy_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
 
+        verb_scored_spans = [
+            [(s, p)
+             for s, p in span_output["spans"]
+             if p >= self._span_minimum_threshold]
+            for span_output in span_outputs]
+        # run each span-level head once over the spans of all verbs
+        verb_all_spans = [[s for s, _ in scored_spans] for scored_spans in verb_scored_spans]
+        span_to_tan_outputs = forward_on_verb_spans(self._span_to_tan_model, span_to_tan_instances, "tan_spans", verb_all_spans)
+        animacy_outputs = forward_on_verb_spans(self._animacy_model, animacy_instances, "animacy_spans", verb_all_spans)
+
+        verb_scored_clauses = [
+            [(self._clause_model.vocab.get_token_from_index(c, namespace = "abst-clause-labels"), p)
+             for c, p in enumerate(clause_output["probs"].tolist())
+             if p >= self._clause_minimum_threshold]
+            for clause_output in clause_outputs]
+        verb_qa_beams = self._predict_answer_slots(answer_slot_instances, verb_scored_clauses, verb_scored_spans)
+
         verb_dicts = []
-        for answer_slot_instance, clause_output, span_output, tan_output, span_to_tan_instance, animacy_instance in zip(answer_slot_instances, clause_outputs, span_outputs, tan_outputs, span_to_tan_instances, animacy_instances):
-            beam = []
-            scored_spans = [
-                (s, p)
-                for s, p in span_output["spans"]
-                if p >= self._span_minimum_threshold]
-            all_spans = [s for s, _ in scored_spans]
-            if len(all_spans) > 0:
-                span_to_tan_instance.add_field("tan_spans", ListField([SpanField(s.start(), s.end(), span_to_tan_instance["text"]) for s in all_spans]))
-                span_to_tan_output = self._span_to_tan_model.forward_on_instance(span_to_tan_instance)
-                animacy_instance.add_field("animacy_spans", ListField([SpanField(s.start(), s.end(), animacy_instance["text"]) for s in all_spans]))
-                animacy_output = self._animacy_model.forward_on_instance(animacy_instance)
-            else:
-                span_to_tan_output = None
-                animacy_output = None
-
-            scored_clauses = [
-                (self._clause_model.vocab.get_token_from_index(c, namespace = "abst-clause-labels"), p)
-                for c, p in enumerate(clause_output["probs"].tolist())
-                if p >= self._clause_minimum_threshold]
-            clause_span_pairs = [
-                (clause, clause_prob, span, span_prob)
-                for clause, clause_prob in scored_clauses
-                for span, span_prob in scored_spans
-            ]
-            answer_slot_clause_fields = [
-                LabelField(clause, label_namespace = "abst-clause-labels")
-                for clause, _, _, _ in clause_span_pairs
-            ]
-            answer_slot_span_fields = [
-                SpanField(span.start(), span.end(), answer_slot_instance["text"])
-                for _, _, span, _ in clause_span_pairs
-            ]
-            qa_beam = []
-            if len(answer_slot_clause_fields) > 0:
-                answer_slot_instance.add_field("qarg_labeled_clauses", ListField(answer_slot_clause_fields))
-                answer_slot_instance.add_field("qarg_labeled_spans", ListField(answer_slot_span_fields))
-                answer_slot_output = self._answer_slot_model.forward_on_instance(answer_slot_instance)
-
-                for i in range(len(clause_span_pairs)):
-                    clause, clause_prob, span, span_prob = clause_span_pairs[i]
-                    answer_slots_with_probs = {
-                        self._answer_slot_model.vocab.get_token_from_index(slot_index, namespace = "qarg-labels"): answer_slot_output["probs"][i, slot_index].item()
-                        for slot_index in range(self._answer_slot_model.vocab.get_vocab_size("qarg-labels"))
-                    }
-                    qa_beam.append({
-                        "clause": clause,
-                        "clauseProb": clause_prob,
-                        "span": [span.start(), span.end() + 1],
-                        "spanProb": span_prob,
-                        "answerSlots": answer_slots_with_probs
-                    })
+        for answer_slot_instance, qa_beam, all_spans, tan_output, span_to_tan_output, animacy_output in zip(answer_slot_instances, verb_qa_beams, verb_all_spans, tan_outputs, span_to_tan_outputs, animacy_outputs):
             beam = {
                 "qa_beam": qa_beam,
                 "tans": [
@@ -171,6 +220,35 @@ class FactoredPipeline():
             "verbs": verb_dicts
         }
 
+def load_pipeline_models(clause_model_path: str,
+                         span_model_path: str,
+                         answer_slot_model_path: str,
+                         tan_model_path: str,
+                         span_to_tan_model_path: str,
+                         animacy_model_path: str,
+                         cuda_device: int,
+                         quantize: bool = False,
+                         load_threads: int = 6):
+    # returns the models and dataset readers as keyword arguments for FactoredPipeline.
+    # The archives are loaded concurrently, sharing identical vocabularies.
+    loader = ArchiveLoader(cuda_device = cuda_device, quantize = quantize, max_workers = load_threads)
+    model_paths = [
+        ("clause", clause_model_path),
+        ("span", span_model_path),
+        ("answer_slot", answer_slot_model_path),
+        ("tan", tan_model_path),
+        ("span_to_tan", span_to_tan_model_path),
+        ("animacy", animacy_model_path)
+    ]
+    archive_futures = [(name, loader.submit(path, weights_file = os.path.join(path, "best.th"))) for name, path in model_paths]
+    kwargs = {}
+    for name, archive_future in archive_futures:
+        archive = archive_future.result()
+        kwargs["%s_model" % name] = archive.model
+        kwargs["%s_model_dataset_reader" % name] = DatasetReader.from_params(archive.config["dataset_reader"].duplicate())
+    loader.shutdown()
+    return kwargs
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Run the answer-first pipeline")
     parser.add_argument('--clause', type=str, help = "Path to clause detector model serialization dir.")
@@ -185,39 +263,32 @@ if __name__ == "__main__":
     parser.add_argument('--clause_min_prob', type=float, default = clause_minimum_threshold_default)
     parser.add_argument('--span_min_prob', type=float, default = span_minimum_threshold_default)
     parser.add_argument('--tan_min_prob', type=float, default = tan_minimum_threshold_default)
+    parser.add_argument('--max_pairs_per_verb', type=int, default = None, help = "Max number of clause-span pairs scored per verb.")
+    parser.add_argument('--pair_min_prob', type=float, default = pair_minimum_threshold_default, help = "Min clauseProb * spanProb of a scored clause-span pair.")
+    parser.add_argument('--quantize', action = 'store_true', help = "Apply dynamic int8 quantization to the models (CPU only).")
+    parser.add_argument('--num_workers', type=int, default = 1, help = "Number of CPU worker processes to shard the input over.")
+    parser.add_argument('--resume', action = 'store_true', help = "Continue an interrupted run from the checkpoint next to the output file.")
+    parser.add_argument('--load_threads', type=int, default = 6, help = "Number of model archives to load concurrently (1 loads them one by one).")
+    parser.add_argument('--prediction_cache', type=str, default = None, help = "Path to an on-disk cache of outputs, reused across runs with the same models and settings.")
     args = parser.parse_args()
 
     check_for_gpu(args.cuda_device)
-    clause_model_archive = load_archive_from_folder(args.clause, cuda_device = args.cuda_device, weights_file = os.path.join(args.clause, "best.th"))
-    span_model_archive = load_archive_from_folder(args.span, cuda_device = args.cuda_device, weights_file = os.path.join(args.span, "best.th"))
-    answer_slot_model_archive = load_archive_from_folder(args.answer_slot, cuda_device = args.cuda_device, weights_file = os.path.join(args.answer_slot, "best.th"))
-    tan_model_archive = load_archive_from_folder(args.tan, cuda_device = args.cuda_device, weights_file = os.path.join(args.tan, "best.th"))
-    span_to_tan_model_archive = load_archive_from_folder(args.span_to_tan, cuda_device = args.cuda_device, weights_file = os.path.join(args.span_to_tan, "best.th"))
-    animacy_model_archive = load_archive_from_folder(args.animacy, cuda_device = args.cuda_device, weights_file = os.path.join(args.animacy, "best.th"))
+    start_time = time.time()
     pipeline = FactoredPipeline(
-        clause_model = clause_model_archive.model,
-        clause_model_dataset_reader = DatasetReader.from_params(clause_model_archive.config["dataset_reader"].duplicate()),
-        span_model = span_model_archive.model,
-        span_model_dataset_reader = DatasetReader.from_params(span_model_archive.config["dataset_reader"].duplicate()),
-        answer_slot_model = answer_slot_model_archive.model,
-        answer_slot_model_dataset_reader = DatasetReader.from_params(answer_slot_model_archive.config["dataset_reader"].duplicate()),
-        tan_model = tan_model_archive.model,
-        tan_model_dataset_reader = DatasetReader.from_params(tan_model_archive.config["dataset_reader"].duplicate()),
-        span_to_tan_model = span_to_tan_model_archive.model,
-        span_to_tan_model_dataset_reader = DatasetReader.from_params(span_to_tan_model_archive.config["dataset_reader"].duplicate()),
-        animacy_model = animacy_model_archive.model,
-        animacy_model_dataset_reader = DatasetReader.from_params(animacy_model_archive.config["dataset_reader"].duplicate()),
+        **load_pipeline_models(
+            clause_model_path = args.clause,
+            span_model_path = args.span,
+            answer_slot_model_path = args.answer_slot,
+            tan_model_path = args.tan,
+            span_to_tan_model_path = args.span_to_tan,
+            animacy_model_path = args.animacy,
+            cuda_device = args.cuda_device,
+            quantize = args.quantize,
+            load_threads = args.load_threads),
         clause_minimum_threshold = args.clause_min_prob,
         span_minimum_threshold = args.span_min_prob,
-        tan_minimum_threshold = args.tan_min_prob)
-    if args.output_file is None:
-        for line in read_lines(cached_path(args.input_file)):
-            input_json = json.loads(line)
-            output_json = pipeline.predict(input_json)
-            print(json.dumps(output_json))
-    else:
-        with open(args.output_file, 'w', encoding = 'utf8') as out:
-            for line in read_lines(cached_path(args.input_file)):
-                input_json = json.loads(line)
-                output_json = pipeline.predict(input_json)
-                print(json.dumps(output_json), file = out)
+        tan_minimum_threshold = args.tan_min_prob,
+        max_pairs_per_verb = args.max_pairs_per_verb,
+        pair_minimum_threshold = args.pair_min_prob)
+    print("Models loaded in %.1fs." % (time.time() - start_time), file = sys.stderr, flush = True)
+    run_pipeline(pipeline, args.input_file, args.output_file, num_workers = args.num_workers, resume = args.resume, prediction_cache = args.prediction_cache)
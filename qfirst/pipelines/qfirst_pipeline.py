@@ -1,14 +1,12 @@
  # completely ridiculous hack to import stuff properly. somebody save me from myself
 import importlib
-from allennlp.common.util import import_submodules
 importlib.invalidate_caches()
 import sys
 sys.path.append(".")
-import_submodules("qfirst")
 
 from typing import List, Iterator, Optional
 
-import torch, os, json, tarfile, argparse, uuid, shutil
+import torch, os, json, tarfile, argparse, uuid, shutil, time
 import sys
 
 from overrides import overrides
@@ -35,7 +33,10 @@ from qfirst.models.question_to_span import QuestionToSpanModel
 from qfirst.models.multiclass import MulticlassModel
 from qfirst.models.span_to_tan import SpanToTanModel
 from qfirst.models.animacy import AnimacyModel
-from qfirst.util.archival_utils import load_archive_from_folder
+from qfirst.util.archival_utils import ArchiveLoader, resolve_archive
+from qfirst.util.pipeline_utils import forward_on_verb_spans
+from qfirst.util.pipeline_runner import run_pipeline
+from qfirst.util.pipeline_server import serve_pipeline
 
 span_minimum_threshold_default = 0.10
 question_minimum_threshold_default = 0.03
@@ -48,6 +49,8 @@ class QFirstPipeline():
                  # question_model_dataset_reader: QasrlReader,
                  question_to_span_model_archive: QuestionToSpanModel,
                  # question_to_span_model_dataset_reader: QasrlReader,
+                 # the optional heads may also be given as futures of archives (see ArchiveLoader),
+                 # in which case they are only waited on when they're first used
                  tan_model_archive: Optional[Archive] = None,
                  span_to_tan_model_archive: Optional[Archive] = None,
                  animacy_model_archive: Optional[Archive] = None,
@@ -55,38 +58,32 @@ class QFirstPipeline():
                  span_minimum_threshold: float = span_minimum_threshold_default,
                  tan_minimum_threshold: float = tan_minimum_threshold_default,
                  question_beam_size: int = question_beam_size_default,
-                 clause_mode: bool = False) -> None:
+                 clause_mode: bool = False,
+                 max_batch_size: int = 64) -> None:
+        question_model_archive = resolve_archive(question_model_archive)
+        question_to_span_model_archive = resolve_archive(question_to_span_model_archive)
         self._question_model = question_model_archive.model
         self._question_model_dataset_reader = DatasetReader.from_params(question_model_archive.config["dataset_reader"].duplicate())
         print("Question model loaded.", flush = True)
         self._question_to_span_model = question_to_span_model_archive.model
         self._question_to_span_model_dataset_reader = DatasetReader.from_params(question_to_span_model_archive.config["dataset_reader"].duplicate())
         print("Question-to-span model loaded.", flush = True)
-        if tan_model_archive is not None:
-            self._tan_model = tan_model_archive.model
-            self._tan_model_dataset_reader = DatasetReader.from_params(tan_model_archive.config["dataset_reader"].duplicate())
-            print("TAN model loaded.", flush = True)
-        else:
-            self._tan_model = None
-        if span_to_tan_model_archive is not None:
-            self._span_to_tan_model = span_to_tan_model_archive.model
-            self._span_to_tan_model_dataset_reader = DatasetReader.from_params(span_to_tan_model_archive.config["dataset_reader"].duplicate())
-            print("Span-to-TAN model loaded.", flush = True)
-        else:
-            self._span_to_tan_model = None
-        if animacy_model_archive is not None:
-            self._animacy_model = animacy_model_archive.model
-            self._animacy_model_dataset_reader = DatasetReader.from_params(animacy_model_archive.config["dataset_reader"].duplicate())
-            print("Animacy model loaded.", flush = True)
-        else:
-            self._animacy_model = None
-        print("All models loaded.", flush = True)
+        self._tan_model = None
+        self._span_to_tan_model = None
+        self._animacy_model = None
+        self._pending_head_archives = [
+            ("tan", "TAN", tan_model_archive),
+            ("span_to_tan", "Span-to-TAN", span_to_tan_model_archive),
+            ("animacy", "Animacy", animacy_model_archive)
+        ]
 
         self._span_minimum_threshold = span_minimum_threshold
         self._question_minimum_threshold = question_minimum_threshold
         self._tan_minimum_threshold = tan_minimum_threshold
         self._question_beam_size = question_beam_size
         self._clause_mode = clause_mode
+        # maximum number of instances per forward pass, e.g., for the questions of all verbs in a batch of sentences
+        self._max_batch_size = max_batch_size
 
         qg_slots = set(self._question_model.get_slot_names())
         qa_slots = set(self._question_to_span_model.get_slot_names())
@@ -95,38 +92,75 @@ class QFirstPipeline():
                 "Question Answerer must read in a subset of question slots generated by the Question Generator. " + \
                 ("QG slots: %s; QA slots: %s" % (qg_slots, qa_slots)))
 
+    def load_models(self) -> None:
+        # sets up the optional heads, waiting for any which are still loading
+        if self._pending_head_archives is None:
+            return
+        for name, display_name, archive in self._pending_head_archives:
+            if archive is not None:
+                archive = resolve_archive(archive)
+                setattr(self, "_%s_model" % name, archive.model)
+                setattr(self, "_%s_model_dataset_reader" % name, DatasetReader.from_params(archive.config["dataset_reader"].duplicate()))
+                print("%s model loaded." % display_name, flush = True)
+        self._pending_head_archives = None
+        print("All models loaded.", flush = True)
+
     def predict(self, inputs: JsonDict) -> JsonDict:
-        qg_instances = list(self._question_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
-        qa_instances = list(self._question_to_span_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
+        return self.predict_batch([inputs])[0]
+
+    def predict_batch(self, inputs_list: List[JsonDict]) -> List[JsonDict]:
+        self.load_models()
+        # every stage runs once over the verbs of all of the sentences;
+        # verbs are kept in sentence order, and regrouped by sentence at the end.
+        def get_verb_instances(dataset_reader):
+            return [instance
+                    for inputs in inputs_list
+                    for instance in dataset_reader.sentence_json_to_instances(inputs, verbs_only = True)]
+        def forward_on_all(model, instances):
+            outputs = []
+            for i in range(0, len(instances), self._max_batch_size):
+                outputs.extend(model.forward_on_instances(instances[i:i + self._max_batch_size]))
+            return outputs
+        sentence_qg_instances = [
+            list(self._question_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
+            for inputs in inputs_list
+        ]
+        qg_instances = [instance for instances in sentence_qg_instances for instance in instances]
+        qa_instances = get_verb_instances(self._question_to_span_model_dataset_reader)
         if self._tan_model is not None:
-            tan_instances = list(self._tan_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
-            tan_outputs = self._tan_model.forward_on_instances(tan_instances)
+            tan_outputs = forward_on_all(self._tan_model, get_verb_instances(self._tan_model_dataset_reader))
         else:
             tan_outputs = [None for _ in qg_instances]
         if self._span_to_tan_model is not None:
-            span_to_tan_instances = list(self._span_to_tan_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
+            span_to_tan_instances = get_verb_instances(self._span_to_tan_model_dataset_reader)
         else:
             span_to_tan_instances = [None for _ in qg_instances]
         if self._animacy_model is not None:
-            animacy_instances = list(self._animacy_model_dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
+            animacy_instances = get_verb_instances(self._animacy_model_dataset_reader)
         else:
             animacy_instances = [None for _ in qg_instances]
 
-        verb_dicts = []
-        for (qg_instance, qa_instance_template, tan_output, span_to_tan_instance, animacy_instance) in zip(qg_instances, qa_instances, tan_outputs, span_to_tan_instances, animacy_instances):
+        # decode the question beams of all verbs at once
+        for qg_instance in qg_instances:
             qg_instance.index_fields(self._question_model.vocab)
+        # decode the questions of at most max_batch_size verbs at once, as in forward_on_all
+        verb_question_beams = []
+        for i in range(0, len(qg_instances), self._max_batch_size):
             qgen_input_tensors = move_to_device(
-                Batch([qg_instance]).as_tensor_dict(),
+                Batch(qg_instances[i:i + self._max_batch_size]).as_tensor_dict(),
                 self._question_model._get_prediction_device())
-            _, all_question_slots, question_probs = self._question_model.beam_decode(
+            verb_question_beams.extend(self._question_model.beam_decode_batch(
                 text = qgen_input_tensors["text"],
                 predicate_indicator = qgen_input_tensors["predicate_indicator"],
                 predicate_index = qgen_input_tensors["predicate_index"],
                 max_beam_size = self._question_beam_size,
                 min_beam_probability = self._question_minimum_threshold,
-                clause_mode = self._clause_mode)
+                clause_mode = self._clause_mode))
 
-            verb_qa_instances = []
+        # answer the questions of all verbs at once
+        all_qa_instances = []
+        verb_question_slots_lists = []
+        for qa_instance_template, (_, all_question_slots, question_probs) in zip(qa_instances, verb_question_beams):
             question_slots_list = []
             for i in range(len(question_probs)):
                 qa_instance = Instance({k: v for k, v in qa_instance_template.fields.items()})
@@ -137,26 +171,34 @@ class QFirstPipeline():
                     slot_label_field = LabelField(slot_label, get_slot_label_namespace(slot_name))
                     qa_instance.add_field(slot_name, slot_label_field, self._question_to_span_model.vocab)
                 question_slots_list.append(question_slots)
-                verb_qa_instances.append(qa_instance)
-            if len(verb_qa_instances) > 0:
-                qa_outputs = self._question_to_span_model.forward_on_instances(verb_qa_instances)
-                if self._animacy_model is not None or self._span_to_tan_model is not None:
-                    all_spans = list(set([s for qa_output in qa_outputs for s, p in qa_output["spans"] if p >= self._span_minimum_threshold]))
-                if self._animacy_model is not None:
-                    animacy_instance.add_field("animacy_spans", ListField([SpanField(s.start(), s.end(), animacy_instance["text"]) for s in all_spans]), self._animacy_model.vocab)
-                    animacy_output = self._animacy_model.forward_on_instance(animacy_instance)
-                else:
-                    animacy_output = None
-                if self._span_to_tan_model is not None:
-                    span_to_tan_instance.add_field("tan_spans", ListField([SpanField(s.start(), s.end(), span_to_tan_instance["text"]) for s in all_spans]))
-                    span_to_tan_output = self._span_to_tan_model.forward_on_instance(span_to_tan_instance)
-                else:
-                    span_to_tan_output = None
+                all_qa_instances.append(qa_instance)
+            verb_question_slots_lists.append(question_slots_list)
+        all_qa_outputs = iter(forward_on_all(self._question_to_span_model, all_qa_instances))
+
+        verb_qa_results = []
+        for question_slots_list, (_, _, question_probs) in zip(verb_question_slots_lists, verb_question_beams):
+            if len(question_slots_list) > 0:
+                qa_outputs = [next(all_qa_outputs) for _ in question_slots_list]
+                all_spans = list(set([s for qa_output in qa_outputs for s, p in qa_output["spans"] if p >= self._span_minimum_threshold]))
             else:
                 qa_outputs = []
-                animacy_output = None
-                span_to_tan_output = None
+                all_spans = None
+            verb_qa_results.append((question_slots_list, question_probs, qa_outputs, all_spans))
 
+        # run each span-level head once over the answer spans of all verbs
+        verb_all_spans = [all_spans for _, _, _, all_spans in verb_qa_results]
+        if self._animacy_model is not None:
+            animacy_outputs = forward_on_verb_spans(self._animacy_model, animacy_instances, "animacy_spans", verb_all_spans)
+        else:
+            animacy_outputs = [None for _ in qg_instances]
+        if self._span_to_tan_model is not None:
+            span_to_tan_outputs = forward_on_verb_spans(self._span_to_tan_model, span_to_tan_instances, "tan_spans", verb_all_spans)
+        else:
+            span_to_tan_outputs = [None for _ in qg_instances]
+
+        verb_dicts = []
+        for (qg_instance, tan_output, animacy_output, span_to_tan_output, verb_qa_result) in zip(qg_instances, tan_outputs, animacy_outputs, span_to_tan_outputs, verb_qa_results):
+            question_slots_list, question_probs, qa_outputs, all_spans = verb_qa_result
             qa_beam = []
             for question_slots, question_prob, qa_output in zip(question_slots_list, question_probs, qa_outputs):
                 scored_spans = [(s, p) for s, p in qa_output["spans"] if p >= self._span_minimum_threshold]
@@ -196,11 +238,17 @@ class QFirstPipeline():
                 "verbInflectedForms": qg_instance["metadata"]["verb_inflected_forms"],
                 "beam": beam
             })
-        return {
-            "sentenceId": inputs["sentenceId"],
-            "sentenceTokens": inputs["sentenceTokens"],
-            "verbs": verb_dicts
-        }
+
+        # verb instances come out in the order of the sentences they belong to
+        verb_dicts_iter = iter(verb_dicts)
+        outputs = []
+        for inputs, instances in zip(inputs_list, sentence_qg_instances):
+            outputs.append({
+                "sentenceId": inputs["sentenceId"],
+                "sentenceTokens": inputs["sentenceTokens"],
+                "verbs": [next(verb_dicts_iter) for _ in instances]
+            })
+        return outputs
 
 def main(question_model_path: str,
          question_to_span_model_path: str,
@@ -214,35 +262,46 @@ def main(question_model_path: str,
          question_min_prob: float,
          tan_min_prob: float,
          question_beam_size: int,
-         clause_mode: bool) -> None:
+         clause_mode: bool,
+         quantize: bool = False,
+         batch_size: int = 1,
+         num_workers: int = 1,
+         resume: bool = False,
+         prediction_cache: str = None,
+         load_threads: int = 6,
+         max_batch_size: int = 64,
+         serve_port: int = None,
+         serve_host: str = "127.0.0.1",
+         serve_batch_size: int = 32,
+         serve_max_wait_ms: float = 10.0) -> None:
     clause_mode = True
     print("Checking device...", flush = True)
     check_for_gpu(cuda_device)
     print("Loading models...", flush = True)
+    start_time = time.time()
+    loader = ArchiveLoader(cuda_device = cuda_device, quantize = quantize, max_workers = load_threads)
+    def submit(model_path):
+        return loader.submit(model_path, weights_file = os.path.join(model_path, "best.th")) if model_path is not None else None
     pipeline = QFirstPipeline(
-        question_model_archive = load_archive_from_folder(question_model_path, cuda_device = cuda_device, weights_file = os.path.join(question_model_path, "best.th")),
-        question_to_span_model_archive = load_archive_from_folder(question_to_span_model_path, cuda_device = cuda_device, weights_file = os.path.join(question_to_span_model_path, "best.th")),
-        tan_model_archive = load_archive_from_folder(tan_model_path, cuda_device = cuda_device, weights_file = os.path.join(tan_model_path, "best.th")) if tan_model_path is not None else None,
-        span_to_tan_model_archive = load_archive_from_folder(span_to_tan_model_path, cuda_device = cuda_device, weights_file = os.path.join(span_to_tan_model_path, "best.th")) if span_to_tan_model_path is not None else None,
-        animacy_model_archive = load_archive_from_folder(animacy_model_path, cuda_device = cuda_device, weights_file = os.path.join(animacy_model_path, "best.th")) if animacy_model_path is not None else None,
+        question_model_archive = submit(question_model_path),
+        question_to_span_model_archive = submit(question_to_span_model_path),
+        tan_model_archive = submit(tan_model_path),
+        span_to_tan_model_archive = submit(span_to_tan_model_path),
+        animacy_model_archive = submit(animacy_model_path),
         question_minimum_threshold = question_min_prob,
         span_minimum_threshold = span_min_prob,
         tan_minimum_threshold = tan_min_prob,
         question_beam_size = question_beam_size,
-        clause_mode = clause_mode)
-    print("Models loaded. Running...", flush = True)
-    if output_file is None:
-        for line in read_lines(cached_path(input_file)):
-            input_json = json.loads(line)
-            output_json = pipeline.predict(input_json)
-            print(json.dumps(output_json))
-    else:
-        with open(output_file, 'w', encoding = 'utf8') as out:
-            for line in read_lines(cached_path(input_file)):
-                input_json = json.loads(line)
-                output_json = pipeline.predict(input_json)
-                print(".", end = "", flush = True)
-                print(json.dumps(output_json), file = out)
+        clause_mode = clause_mode,
+        max_batch_size = max_batch_size)
+    loader.shutdown()
+    print("Required models loaded in %.1fs. Running..." % (time.time() - start_time), flush = True)
+    if serve_port is not None:
+        serve_pipeline(pipeline, host = serve_host, port = serve_port,
+                       max_batch_size = serve_batch_size, max_wait_time = serve_max_wait_ms / 1000.0,
+                       prediction_cache = prediction_cache)
+        return
+    run_pipeline(pipeline, input_file, output_file, batch_size = batch_size, show_progress = output_file is not None, num_workers = num_workers, resume = resume, prediction_cache = prediction_cache)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Run the answer-first pipeline")
@@ -259,6 +318,17 @@ if __name__ == "__main__":
     parser.add_argument('--tan_min_prob', type=float, default = tan_minimum_threshold_default)
     parser.add_argument('--question_beam_size', type=int, default = question_beam_size_default)
     parser.add_argument('--clause_mode', type=bool, default = False)
+    parser.add_argument('--quantize', action = 'store_true', help = "Apply dynamic int8 quantization to the models (CPU only).")
+    parser.add_argument('--num_workers', type=int, default = 1, help = "Number of CPU worker processes to shard the input over.")
+    parser.add_argument('--resume', action = 'store_true', help = "Continue an interrupted run from the checkpoint next to the output file.")
+    parser.add_argument('--load_threads', type=int, default = 6, help = "Number of model archives to load concurrently (1 loads them one by one).")
+    parser.add_argument('--prediction_cache', type=str, default = None, help = "Path to an on-disk cache of outputs, reused across runs with the same models and settings.")
+    parser.add_argument('--batch_size', type=int, default = 1, help = "Number of sentences to run through each stage of the pipeline at once.")
+    parser.add_argument('--max_batch_size', type=int, default = 64, help = "Maximum number of instances (e.g., questions) to run through a model at once.")
+    parser.add_argument('--serve_port', type=int, default = None, help = "Instead of running on the input file, serve the pipeline over HTTP on this port.")
+    parser.add_argument('--serve_host', type=str, default = "127.0.0.1", help = "Host to serve on, with --serve_port.")
+    parser.add_argument('--serve_batch_size', type=int, default = 32, help = "Maximum number of sentences from concurrent requests to batch together when serving.")
+    parser.add_argument('--serve_max_wait_ms', type=float, default = 10.0, help = "Maximum time a sentence waits for its batch to fill when serving.")
 
     args = parser.parse_args()
     main(question_model_path = args.question,
@@ -273,4 +343,15 @@ if __name__ == "__main__":
          question_min_prob = args.question_min_prob,
          tan_min_prob = args.tan_min_prob,
          question_beam_size = args.question_beam_size,
-         clause_mode = args.clause_mode)
+         clause_mode = args.clause_mode,
+         quantize = args.quantize,
+         batch_size = args.batch_size,
+         num_workers = args.num_workers,
+         resume = args.resume,
+         prediction_cache = args.prediction_cache,
+         load_threads = args.load_threads,
+         max_batch_size = args.max_batch_size,
+         serve_port = args.serve_port,
+         serve_host = args.serve_host,
+         serve_batch_size = args.serve_batch_size,
+         serve_max_wait_ms = args.serve_max_wait_ms)
@@ -2,24 +2,51 @@ from typing import List
 
 from overrides import overrides
 
+import torch
+
 from allennlp.common.util import JsonDict, sanitize
 from allennlp.common.util import get_spacy_model
 from allennlp.data import DatasetReader, Instance
-from allennlp.data.fields import LabelField
+from allennlp.data.dataset import Batch
 from allennlp.models import Model
+from allennlp.nn.util import move_to_device
 from allennlp.predictors.predictor import Predictor
 
 from qfirst.data.dataset_readers import QasrlReader
 from qfirst.data.util import get_verb_fields
 
-def chunks(l, n):
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+def budgeted_chunks(costs, budget):
+    """
+    Splits items (given by their ``(num_tokens, num_questions)``) into consecutive chunks whose
+    padded cost, the number of questions times the number of spans of the longest sentence,
+    stays within ``budget``. An item over budget on its own gets a chunk to itself.
+    """
+    chunk = []
+    max_num_spans = 0
+    num_questions = 0
+    for i, (item_num_tokens, item_num_questions) in enumerate(costs):
+        item_num_spans = item_num_tokens * (item_num_tokens + 1) // 2
+        new_max_num_spans = max(max_num_spans, item_num_spans)
+        if len(chunk) > 0 and (num_questions + item_num_questions) * new_max_num_spans > budget:
+            yield chunk
+            chunk = []
+            new_max_num_spans = item_num_spans
+            num_questions = 0
+        chunk.append(i)
+        max_num_spans = new_max_num_spans
+        num_questions += item_num_questions
+    if len(chunk) > 0:
+        yield chunk
 
 @Predictor.register("qasrl_clause_answering")
 class ClauseAnsweringPredictor(Predictor):
-    def __init__(self, model: Model, dataset_reader: QasrlReader) -> None:
+    """
+    Encodes each (sentence, verb) once and answers all of its clause questions in one span selector call.
+    Verbs are batched so that each batch scores at most ``max_question_spans_per_batch`` (question, span) pairs.
+    """
+    def __init__(self, model: Model, dataset_reader: QasrlReader, max_question_spans_per_batch: int = 100000) -> None:
         super(ClauseAnsweringPredictor, self).__init__(model, dataset_reader)
+        self._max_question_spans_per_batch = max_question_spans_per_batch
 
     @overrides
     def predict_json(self, inputs: JsonDict) -> JsonDict:
@@ -31,50 +58,61 @@ class ClauseAnsweringPredictor(Predictor):
 
     @overrides
     def predict_batch_json(self, inputs: List[JsonDict]) -> List[JsonDict]:
+        vocab = self._model.vocab
         sentence_ids = [s["sentenceId"] for s in inputs]
-        input_metas = []
-        input_instances = []
+        verb_metas = []
+        verb_instances = []
         for sentence_json in inputs:
             sentence_id = sentence_json["sentenceId"]
             sentence_tokens = sentence_json["sentenceTokens"]
             for verb_json in sentence_json["verbs"]:
+                if len(verb_json["clauses"]) == 0:
+                    continue
                 verb_index = int(verb_json["verbIndex"])
-                verb_dict = get_verb_fields(self._dataset_reader._token_indexers, sentence_tokens, verb_index)
-                for clause_info in verb_json["clauses"]:
-                    clause_field = LabelField(label = clause_info["clause"], label_namespace = "clause-template-labels")
-                    answer_slot_field = LabelField(label = clause_info["slot"], label_namespace = "answer-slot-labels")
-                    input_metas.append({
-                        "sentenceId": sentence_id,
-                        "verbIndex": verb_index,
-                        "clauseInfo": clause_info
-                    })
-                    input_instances.append(Instance({
-                        **verb_dict,
-                        "clause": clause_field,
-                        "answer_slot": answer_slot_field
-                    }))
-        if len(input_instances) == 0:
-            return []
-        # make sure to reproduce desired batch size
-        outputs = []
-        for input_batch in chunks(input_instances, len(inputs)):
-            outputs.extend(sanitize(self._model.forward_on_instances(input_batch)))
+                verb_metas.append({
+                    "sentenceId": sentence_id,
+                    "verbIndex": verb_index,
+                    "numTokens": len(sentence_tokens),
+                    "clauseInfos": verb_json["clauses"]
+                })
+                verb_instances.append(Instance(get_verb_fields(self._dataset_reader._token_indexers, sentence_tokens, verb_index)))
         outputs_grouped = { sid: {} for sid in sentence_ids}
         def get(targ, key, default):
             if key not in targ:
                 targ[key] = default
             return targ[key]
-        for input_meta, output in zip(input_metas, outputs):
-            sentence = outputs_grouped[input_meta["sentenceId"]]
-            verb = get(sentence, str(input_meta["verbIndex"]), [])
-            spans = [[[s[0], s[1]], p] for s, p in output["spans"]]
-            results = {
-                "question": input_meta["clauseInfo"],
-                "spans": output["spans"]
-            }
-            verb.append(results)
+        def pad(xs, length):
+            return xs + [-1 for _ in range(length - len(xs))]
+        costs = [(meta["numTokens"], len(meta["clauseInfos"])) for meta in verb_metas]
+        for chunk in budgeted_chunks(costs, self._max_question_spans_per_batch):
+            chunk_metas = [verb_metas[i] for i in chunk]
+            chunk_instances = [verb_instances[i] for i in chunk]
+            for instance in chunk_instances:
+                instance.index_fields(vocab)
+            max_num_questions = max([len(meta["clauseInfos"]) for meta in chunk_metas])
+            input_tensors = move_to_device({
+                **Batch(chunk_instances).as_tensor_dict(),
+                "clauses": torch.LongTensor([
+                    pad([vocab.get_token_index(c["clause"], namespace = "clause-template-labels") for c in meta["clauseInfos"]], max_num_questions)
+                    for meta in chunk_metas]),
+                "answer_slots": torch.LongTensor([
+                    pad([vocab.get_token_index(c["slot"], namespace = "answer-slot-labels") for c in meta["clauseInfos"]], max_num_questions)
+                    for meta in chunk_metas])
+            }, self._model._get_prediction_device())
+            with torch.no_grad():
+                self._model.eval()
+                output = self._model.predict_clause_questions(
+                    text = input_tensors["text"],
+                    predicate_indicator = input_tensors["predicate_indicator"],
+                    predicate_index = input_tensors["predicate_index"],
+                    clauses = input_tensors["clauses"],
+                    answer_slots = input_tensors["answer_slots"])
+                question_spans = iter(sanitize(self._model.decode(output)["spans"]))
+            for meta in chunk_metas:
+                verb = get(outputs_grouped[meta["sentenceId"]], str(meta["verbIndex"]), [])
+                for clause_info in meta["clauseInfos"]:
+                    verb.append({
+                        "question": clause_info,
+                        "spans": next(question_spans)
+                    })
         return [{ "sentenceId": sid, "verbs": outputs_grouped[sid] } for sid in sentence_ids]
-
-
-
-
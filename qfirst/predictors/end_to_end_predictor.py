@@ -10,15 +10,36 @@ from allennlp.predictors.predictor import Predictor
 
 from qfirst.data.dataset_readers import QasrlReader
 
+def chunks(l, n):
+    for i in range(0, len(l), n):
+        yield l[i:i + n]
+
 @Predictor.register("qasrl_end_to_end")
 class EndToEndPredictor(Predictor):
-    def __init__(self, model: Model, dataset_reader: QasrlReader) -> None:
+    """
+    Runs the verbs of all sentences in a batch through the model together,
+    in chunks of at most ``max_batch_size`` verb instances.
+    """
+    def __init__(self, model: Model, dataset_reader: QasrlReader, max_batch_size: int = 64) -> None:
         super(EndToEndPredictor, self).__init__(model, dataset_reader)
+        self._max_batch_size = max_batch_size
+
+    @overrides
+    def predict_json(self, inputs: JsonDict) -> JsonDict:
+        return self.predict_batch_json([inputs])[0]
 
     @overrides
-    def predict_json(self, inputs: JsonDict) -> List[JsonDict]:
-        instances = list(self._dataset_reader.sentence_json_to_instances(inputs, verbs_only = True))
-        results = sanitize(self._model.forward_on_instances(instances))
+    def predict_batch_json(self, inputs: List[JsonDict]) -> List[JsonDict]:
+        instances = []
+        # index of each instance's sentence in the batch, for regrouping the results
+        sentence_indices = []
+        for sentence_index, sentence_json in enumerate(inputs):
+            for instance in self._dataset_reader.sentence_json_to_instances(sentence_json, verbs_only = True):
+                instances.append(instance)
+                sentence_indices.append(sentence_index)
+        results = []
+        for instance_batch in chunks(instances, self._max_batch_size):
+            results.extend(sanitize(self._model.forward_on_instances(instance_batch)))
         def get_verb_dict(instance, result):
             return {
                 "verbIndex": instance["metadata"]["verb_index"],
@@ -27,13 +48,11 @@ class EndToEndPredictor(Predictor):
                 "tans": result["tans"],
                 "beam": result["beam"]
             }
-        result_dict = {
-            "sentenceId": inputs["sentenceId"],
-            "sentenceTokens": inputs["sentenceTokens"],
-            "verbs": [get_verb_dict(i, r) for i, r in zip(instances, results)]
-        }
-        return result_dict
-
-    @overrides
-    def predict_batch_json(self, inputs: List[JsonDict]) -> List[JsonDict]:
-        return map(inputs, self.predict_json)
+        result_dicts = [{
+            "sentenceId": sentence_json["sentenceId"],
+            "sentenceTokens": sentence_json["sentenceTokens"],
+            "verbs": []
+        } for sentence_json in inputs]
+        for sentence_index, instance, result in zip(sentence_indices, instances, results):
+            result_dicts[sentence_index]["verbs"].append(get_verb_dict(instance, result))
+        return result_dicts
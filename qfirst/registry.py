@@ -0,0 +1,94 @@
+from typing import Dict, Iterator, List
+
+import importlib
+import logging
+import os
+import re
+
+# Lazy registration of qfirst components. Instead of importing every qfirst module up front
+# (import_submodules("qfirst")), the registry manifest (qfirst/registry_manifest.py) maps each registered
+# name to the module registering it, and only the modules named by a config's "type"s are imported.
+# Regenerate the manifest with qfirst/scripts/write_registry_manifest.py after adding a registration.
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+_registration_regex = re.compile(r"""^@(\w+)\.register\(\s*["']([^"']+)["']""", re.MULTILINE)
+
+def scan_registrations(package_dir: str = None, package_name: str = "qfirst") -> Dict[str, Dict[str, str]]:
+    """
+    Finds all ``@Base.register("name")`` decorators in the package's source, without importing it.
+    Returns base class name -> registered name -> module name.
+    """
+    if package_dir is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+    manifest: Dict[str, Dict[str, str]] = {}
+    for dir_path, dir_names, file_names in os.walk(package_dir):
+        dir_names[:] = sorted([d for d in dir_names if not d.startswith("__")])
+        for file_name in sorted(file_names):
+            if not file_name.endswith(".py"):
+                continue
+            file_path = os.path.join(dir_path, file_name)
+            module_path = os.path.relpath(file_path, package_dir)[:-len(".py")].split(os.sep)
+            if module_path[-1] == "__init__":
+                module_path = module_path[:-1]
+            module_name = ".".join([package_name] + module_path)
+            with open(file_path, "r", encoding = "utf8") as f:
+                for base_name, name in _registration_regex.findall(f.read()):
+                    manifest.setdefault(base_name, {})[name] = module_name
+    return manifest
+
+def _get_manifest() -> Dict[str, Dict[str, str]]:
+    from qfirst.registry_manifest import REGISTRY_MANIFEST
+    return REGISTRY_MANIFEST
+
+def _get_config_types(config) -> Iterator[str]:
+    # all "type" values anywhere in a config (including lists, e.g., of initializers)
+    if hasattr(config, "as_dict"):
+        config = config.as_dict(quiet = True)
+    if isinstance(config, dict):
+        for key, value in config.items():
+            if key == "type" and isinstance(value, str):
+                yield value
+            else:
+                yield from _get_config_types(value)
+    elif isinstance(config, (list, tuple)):
+        for value in config:
+            yield from _get_config_types(value)
+
+def import_registered(base_name: str, name: str) -> bool:
+    """
+    Imports the module registering ``name`` under the registrable base class ``base_name`` (e.g., ``"Predictor"``),
+    returning whether the manifest has it.
+    """
+    module_name = _get_manifest().get(base_name, {}).get(name)
+    if module_name is not None:
+        importlib.import_module(module_name)
+    return module_name is not None
+
+def import_all() -> None:
+    from allennlp.common.util import import_submodules
+    import_submodules("qfirst")
+
+def import_for_config(config) -> None:
+    """
+    Imports the qfirst modules registering the components referenced in a config (``Params`` or dict).
+    If the config uses a type that is neither in the manifest nor already registered (e.g., the manifest is stale),
+    falls back to importing all of qfirst.
+    """
+    from allennlp.common.registrable import Registrable
+    modules_by_name: Dict[str, List[str]] = {}
+    for names in _get_manifest().values():
+        for name, module_name in names.items():
+            modules_by_name.setdefault(name, []).append(module_name)
+    unknown_types = []
+    for type_name in set(_get_config_types(config)):
+        if type_name in modules_by_name:
+            for module_name in modules_by_name[type_name]:
+                importlib.import_module(module_name)
+        else:
+            unknown_types.append(type_name)
+    registered_names = set([name for registry in Registrable._registry.values() for name in registry.keys()])
+    unregistered_types = [t for t in unknown_types if t not in registered_names]
+    if len(unregistered_types) > 0:
+        logger.info("Types %s are not in the registry manifest; importing all of qfirst" % unregistered_types)
+        import_all()
@@ -0,0 +1,51 @@
+# Generated by qfirst/scripts/write_registry_manifest.py; do not edit by hand.
+# Maps registrable base class name -> registered name -> module registering it (see qfirst/registry.py).
+
+REGISTRY_MANIFEST = {
+    "DatasetReader": {
+        "qfirst_qasrl": "qfirst.data.dataset_readers.qasrl_reader"
+    },
+    "Initializer": {
+        "pretrained_prefixing": "qfirst.nn.initializers"
+    },
+    "Model": {
+        "qasrl_animacy": "qfirst.models.animacy",
+        "qasrl_clause_and_span_to_answer_slot": "qfirst.models.clause_and_span_to_answer_slot",
+        "qasrl_clause_answering": "qfirst.models.clause_answering",
+        "qasrl_clause_frame": "qfirst.models.clause_frame",
+        "qasrl_multiclass": "qfirst.models.multiclass",
+        "qasrl_question": "qfirst.models.question",
+        "qasrl_question_to_span": "qfirst.models.question_to_span",
+        "qasrl_sentence_encoder_distillation": "qfirst.models.sentence_encoder_distillation",
+        "qasrl_span": "qfirst.models.span",
+        "qasrl_span_to_question": "qfirst.models.span_to_question",
+        "qasrl_span_to_tan": "qfirst.models.span_to_tan"
+    },
+    "Predictor": {
+        "qasrl_clause_answering": "qfirst.predictors.clause_answering_predictor",
+        "qasrl_end_to_end": "qfirst.predictors.end_to_end_predictor"
+    },
+    "QasrlInstanceReader": {
+        "clause_answers": "qfirst.data.qasrl_instance_reader",
+        "clause_dist": "qfirst.data.qasrl_instance_reader",
+        "question": "qfirst.data.qasrl_instance_reader",
+        "question_factored": "qfirst.data.qasrl_instance_reader",
+        "question_with_sentence_single_span": "qfirst.data.qasrl_instance_reader",
+        "span_animacy": "qfirst.data.qasrl_instance_reader",
+        "span_tan": "qfirst.data.qasrl_instance_reader",
+        "verb_answers": "qfirst.data.qasrl_instance_reader",
+        "verb_only": "qfirst.data.qasrl_instance_reader",
+        "verb_qas": "qfirst.data.qasrl_instance_reader"
+    },
+    "SetClassifier": {
+        "binary": "qfirst.modules.set_classifier.set_binary_classifier",
+        "density": "qfirst.modules.set_classifier.set_density_classifier"
+    },
+    "TokenEmbedder": {
+        "precomputed_features": "qfirst.modules.token_embedders.precomputed_feature_embedder"
+    },
+    "TokenIndexer": {
+        "bert-pretrained-cached": "qfirst.data.token_indexers.cached_bert_indexer",
+        "precomputed_features": "qfirst.data.token_indexers.precomputed_feature_indexer"
+    }
+}
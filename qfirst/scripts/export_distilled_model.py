@@ -0,0 +1,42 @@
+import argparse
+import json
+import os
+import shutil
+
+import torch
+
+# Turns a trained qasrl_sentence_encoder_distillation model into a serialization dir of the teacher's model type,
+# with the teacher's sentence encoder replaced by the student, so it can be loaded anywhere the teacher could.
+
+def main(teacher_path: str, student_path: str, output_path: str) -> None:
+    if os.path.exists(output_path):
+        raise ValueError("Output directory %s already exists." % output_path)
+    # vocabulary and supplemental files carry over; weights, config, metrics and logs don't
+    shutil.copytree(teacher_path, output_path, ignore = shutil.ignore_patterns("*.th", "config.json", "metrics*.json", "log"))
+
+    with open(os.path.join(teacher_path, "config.json"), 'r') as f:
+        config = json.load(f)
+    with open(os.path.join(student_path, "config.json"), 'r') as f:
+        student_config = json.load(f)
+    config["model"]["sentence_encoder"] = student_config["model"]["student_encoder"]
+    with open(os.path.join(output_path, "config.json"), 'w') as f:
+        json.dump(config, f, indent = 2)
+
+    teacher_state = torch.load(os.path.join(teacher_path, "best.th"), map_location = "cpu")
+    student_state = torch.load(os.path.join(student_path, "best.th"), map_location = "cpu")
+    state = {k: v for k, v in teacher_state.items() if not k.startswith("_sentence_encoder.")}
+    for k, v in student_state.items():
+        if k.startswith("_student_encoder."):
+            state["_sentence_encoder." + k[len("_student_encoder."):]] = v
+    torch.save(state, os.path.join(output_path, "best.th"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Export a distilled sentence encoder into a copy of its teacher model")
+    parser.add_argument('--teacher', type=str, help = "Path to teacher model serialization dir.")
+    parser.add_argument('--student', type=str, help = "Path to distillation model serialization dir.")
+    parser.add_argument('--output', type=str, help = "Path to write the student model serialization dir.")
+
+    args = parser.parse_args()
+    main(teacher_path = args.teacher,
+         student_path = args.student,
+         output_path = args.output)
@@ -0,0 +1,38 @@
+ # completely ridiculous hack to import stuff properly. somebody save me from myself
+import importlib
+importlib.invalidate_caches()
+import sys
+sys.path.append(".")
+
+import argparse, os, time
+
+from qfirst.util.archival_utils import export_frozen_archive, load_archive_from_folder
+
+# Writes a model serialization dir as a frozen archive (see qfirst/util/archival_utils.py),
+# which load_archive_from_folder (and so all of the pipelines) loads with memory-mapped weights.
+# Reports the time to load the original and the frozen archive.
+
+def main(model_path: str, output_path: str, overrides: str, weights_file: str) -> None:
+    if weights_file is None and os.path.exists(os.path.join(model_path, "best.th")):
+        weights_file = os.path.join(model_path, "best.th")
+    start_time = time.time()
+    load_archive_from_folder(model_path, overrides = overrides, weights_file = weights_file)
+    original_time = time.time() - start_time
+    export_frozen_archive(model_path, output_path, overrides = overrides, weights_file = weights_file)
+    start_time = time.time()
+    load_archive_from_folder(output_path)
+    frozen_time = time.time() - start_time
+    print("Load time: %.2fs original, %.2fs frozen (in a warm process)" % (original_time, frozen_time))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Export a model serialization dir as a frozen archive with memory-mapped weights")
+    parser.add_argument('--model', type=str, help = "Path to model serialization dir.")
+    parser.add_argument('--output', type=str, help = "Path to write the frozen archive dir.")
+    parser.add_argument('--overrides', type=str, default = "", help = "Config overrides to bake into the frozen archive.")
+    parser.add_argument('--weights_file', type=str, default = None, help = "Weights to export (defaults to best.th if present).")
+
+    args = parser.parse_args()
+    main(model_path = args.model,
+         output_path = args.output,
+         overrides = args.overrides,
+         weights_file = args.weights_file)
@@ -1,10 +1,8 @@
  # completely ridiculous hack to import stuff properly. somebody save me from myself
 import importlib
-from allennlp.common.util import import_submodules
 importlib.invalidate_caches()
 import sys
 sys.path.append(".")
-import_submodules("qfirst")
 
 import argparse
 import json
@@ -30,7 +28,7 @@ from allennlp.nn.util import remove_sentence_boundaries
 from allennlp.modules.elmo import _ElmoBiLm, batch_to_ids
 from allennlp.commands.subcommand import Subcommand
 
-from qfirst.data.util import read_lines, get_verb_fields
+from qfirst.data.util import read_lines, get_verb_fields, cleanse_sentence_text
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -129,16 +127,65 @@ class ElmoEmbedder():
                         bs = emb.numpy().tobytes()
                         f_emb.write(bs)
 
+    def write_feature_store(self,
+                            input_paths: List[str],
+                            output_file_prefix: str,
+                            batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        """
+        Writes all ELMo layers for every token of every sentence (deduplicated by sentence id)
+        in the format read by ``qfirst.data.precomputed_features``.
+        """
+        def get_sentences():
+            seen_sentence_ids = set()
+            for input_path in input_paths:
+                for sentence_tokens, meta in self.get_qasrl_sentences(input_path):
+                    if meta["sentence_id"] not in seen_sentence_ids:
+                        seen_sentence_ids.add(meta["sentence_id"])
+                        yield (cleanse_sentence_text(sentence_tokens), meta)
+
+        num_layers = None
+        dim = None
+        offset = 0
+        with open(output_file_prefix + "_features_index.jsonl", "w") as f_index:
+            with open(output_file_prefix + "_features.bin", "wb") as f_features:
+                for sentence_batch in lazy_groups_of(Tqdm.tqdm(get_sentences()), batch_size):
+                    batch_sentences, batch_metas = map(list, zip(*sentence_batch))
+                    character_ids = batch_to_ids(batch_sentences)
+                    if self.cuda_device >= 0:
+                        character_ids = character_ids.cuda(device=self.cuda_device)
+                    bilm_output = self.elmo_bilm(character_ids)
+                    # Shape: batch_size, num_tokens, num_layers, dim
+                    activations = torch.stack([
+                        remove_sentence_boundaries(layer_activations, bilm_output['mask'])[0]
+                        for layer_activations in bilm_output['activations']
+                    ], dim = 2).cpu()
+                    num_layers = activations.size(2)
+                    dim = activations.size(-1)
+                    for i, (sentence_tokens, meta) in enumerate(zip(batch_sentences, batch_metas)):
+                        f_index.write(json.dumps({"sentenceId": meta["sentence_id"], "sentenceTokens": sentence_tokens, "offset": offset}) + "\n")
+                        f_features.write(activations[i, :len(sentence_tokens)].numpy().astype(numpy.float32).tobytes())
+                        offset += len(sentence_tokens)
+        if num_layers is None:
+            raise ValueError("No sentences found in %s; not writing an empty feature store." % ", ".join(input_paths))
+        with open(output_file_prefix + "_features_meta.json", "w") as f_meta:
+            f_meta.write(json.dumps({"numLayers": num_layers, "dim": dim}))
+
 def elmo_command(args):
     elmo_embedder = ElmoEmbedder(args.options_file, args.weight_file, args.cuda_device)
     # prepare_global_logging(os.path.realpath(os.path.dirname(args.output_file)), args.file_friendly_logging)
 
     with torch.no_grad():
-        elmo_embedder.embed_file(
-            args.input_path,
-            args.output_file_prefix,
-            args.is_propbank,
-            args.batch_size)
+        if args.feature_store:
+            elmo_embedder.write_feature_store(
+                args.input_path.split(","),
+                args.output_file_prefix,
+                args.batch_size)
+        else:
+            elmo_embedder.embed_file(
+                args.input_path,
+                args.output_file_prefix,
+                args.is_propbank,
+                args.batch_size)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description = "Write ELMo vectors")
@@ -148,6 +195,8 @@ if __name__ == "__main__":
     # subparser.add_argument('input_file', type=argparse.FileType('r', encoding='utf-8'),
     #                        help='The path to the input file.')
     parser.add_argument('--is_propbank', type=bool, default = False)
+    parser.add_argument('--feature_store', action = 'store_true',
+                        help = "Write all layers for all tokens of each sentence (comma-separated input paths), for the precomputed_features embedder.")
     parser.add_argument(
         '--options-file',
         type=str,
@@ -0,0 +1,38 @@
+import argparse, json, os, sys
+
+sys.path.append(".")
+
+from qfirst.registry import scan_registrations
+
+# Regenerates qfirst/registry_manifest.py (registered name -> module, for lazy importing via qfirst.registry)
+# from the @Base.register("name") decorators in the source. Run from the repo root after adding a registration;
+# with --check, exits with an error if the manifest is out of date instead.
+
+_header = """# Generated by qfirst/scripts/write_registry_manifest.py; do not edit by hand.
+# Maps registrable base class name -> registered name -> module registering it (see qfirst/registry.py).
+
+"""
+
+def get_manifest_source() -> str:
+    manifest = scan_registrations()
+    return _header + "REGISTRY_MANIFEST = " + json.dumps(manifest, indent = 4, sort_keys = True) + "\n"
+
+def main(check: bool) -> None:
+    manifest_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "registry_manifest.py")
+    source = get_manifest_source()
+    if check:
+        with open(manifest_path, "r") as f:
+            if f.read() != source:
+                sys.exit("Registry manifest is out of date; rerun qfirst/scripts/write_registry_manifest.py")
+        print("Registry manifest is up to date.")
+    else:
+        with open(manifest_path, "w") as f:
+            f.write(source)
+        print("Wrote " + manifest_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Write the registry manifest used to lazily import qfirst components")
+    parser.add_argument('--check', action = 'store_true', help = "Only check that the manifest is up to date.")
+
+    args = parser.parse_args()
+    main(check = args.check)
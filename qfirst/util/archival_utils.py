@@ -1,19 +1,28 @@
 from typing import NamedTuple, Dict, Any
+from concurrent.futures import Future, ThreadPoolExecutor
 import atexit
+import hashlib
 import json
 import logging
 import os
 import tempfile
 import tarfile
 import shutil
+import threading
 
-from torch.nn import Module
+import numpy
+import torch
+from torch.nn import Module, Linear, LSTM, LSTMCell
 
 from allennlp.common.checks import ConfigurationError
 from allennlp.common.file_utils import cached_path
 from allennlp.common.params import Params, unflatten, with_fallback, parse_overrides
-from allennlp.models.model import Model, _DEFAULT_WEIGHTS
+from allennlp.data.vocabulary import Vocabulary
+from allennlp.models.model import Model, _DEFAULT_WEIGHTS, remove_pretrained_embedding_params
 from allennlp.models.archival import Archive
+from allennlp.nn.util import device_mapping
+
+from qfirst.registry import import_for_config
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -21,17 +30,58 @@ CONFIG_NAME = "config.json"
 _WEIGHTS_NAME = "weights.th"
 _FTA_NAME = "files_to_archive.json"
 
+# Frozen archives (written by export_frozen_archive) contain:
+#   frozen_config.json: the config with overrides applied, and without the initializer or pretrained embedding files
+#   vocabulary.json: { "nonPaddedNamespaces": [...], "namespaces": { namespace: [token at index 0, token at index 1, ...] } }
+#   weights.bin: the raw bytes of every tensor of the model's state dict, each aligned to FROZEN_WEIGHTS_ALIGNMENT bytes
+#   weights_index.json: [{ "name": ..., "dtype": (numpy dtype), "shape": [...], "offset": (in bytes) }, ...]
+# along with supplemental files (files_to_archive.json and fta/), if any.
+FROZEN_CONFIG_NAME = "frozen_config.json"
+FROZEN_VOCABULARY_NAME = "vocabulary.json"
+FROZEN_WEIGHTS_NAME = "weights.bin"
+FROZEN_WEIGHTS_INDEX_NAME = "weights_index.json"
+FROZEN_WEIGHTS_ALIGNMENT = 64
+
+# vocabulary content hash -> vocabulary, so models with identical vocabularies share one object
+_vocabularies: Dict[str, Vocabulary] = {}
+_vocabularies_lock = threading.Lock()
+
 def load_archive_from_folder(archive_file: str,
                              cuda_device: int = -1,
                              overrides: str = "",
-                             weights_file: str = None) -> Archive:
+                             weights_file: str = None,
+                             quantize: bool = False) -> Archive:
     # redirect to the cache, if necessary
     resolved_archive_file = cached_path(archive_file)
 
+    serialization_dir = resolved_archive_file
+
+    if os.path.exists(os.path.join(serialization_dir, FROZEN_WEIGHTS_INDEX_NAME)):
+        # frozen archives (see export_frozen_archive) carry their own weights
+        return load_frozen_archive(serialization_dir, cuda_device = cuda_device, overrides = overrides, quantize = quantize)
+
     logger.info(f"loading model from direactory {archive_file}")
 
-    serialization_dir = resolved_archive_file
+    # Load config
+    config = _load_config(serialization_dir, CONFIG_NAME, overrides)
+
+    if weights_file:
+        weights_path = weights_file
+    else:
+        weights_path = os.path.join(serialization_dir, _WEIGHTS_NAME)
+
+    # Instantiate model. Use a duplicate of the config, as it will get consumed.
+    model = _load_model(config.duplicate(),
+                        weights_file=weights_path,
+                        serialization_dir=serialization_dir,
+                        cuda_device=cuda_device)
 
+    if quantize:
+        model = quantize_model(model, cuda_device)
+
+    return Archive(model=model, config=config)
+
+def _load_config(serialization_dir: str, config_name: str, overrides: str = "") -> Params:
     # Check for supplemental files in archive
     fta_filename = os.path.join(serialization_dir, _FTA_NAME)
     if os.path.exists(fta_filename):
@@ -49,19 +99,246 @@ def load_archive_from_folder(archive_file: str,
         combined_dict = with_fallback(preferred=unflatten(replacements_dict), fallback=overrides_dict)
         overrides = json.dumps(combined_dict)
 
-    # Load config
-    config = Params.from_file(os.path.join(serialization_dir, CONFIG_NAME), overrides)
+    config = Params.from_file(os.path.join(serialization_dir, config_name), overrides)
     config.loading_from_archive = True
+    # register only the qfirst components this model uses
+    import_for_config(config)
+    return config
 
-    if weights_file:
-        weights_path = weights_file
+def _load_vocabulary(config: Params, serialization_dir: str) -> Vocabulary:
+    vocab_dir = os.path.join(serialization_dir, "vocabulary")
+    vocab_params = config.get("vocabulary", Params({}))
+    vocab_choice = vocab_params.pop_choice("type", Vocabulary.list_available(), True)
+    digest = hashlib.md5(vocab_choice.encode("utf8"))
+    for file_name in sorted(os.listdir(vocab_dir)):
+        digest.update(file_name.encode("utf8"))
+        with open(os.path.join(vocab_dir, file_name), "rb") as f:
+            digest.update(f.read())
+    return _get_shared_vocabulary(digest.hexdigest(), lambda: Vocabulary.by_name(vocab_choice).from_files(vocab_dir))
+
+def _get_shared_vocabulary(vocab_key: str, load_vocabulary) -> Vocabulary:
+    with _vocabularies_lock:
+        if vocab_key in _vocabularies:
+            logger.info("reusing identical vocabulary")
+            return _vocabularies[vocab_key]
+    vocab = load_vocabulary()
+    # if another thread loaded the same vocabulary in the meantime, use theirs
+    with _vocabularies_lock:
+        return _vocabularies.setdefault(vocab_key, vocab)
+
+def _load_model(config: Params,
+                weights_file: str,
+                serialization_dir: str,
+                cuda_device: int = -1) -> Model:
+    # same as Model.load, except that identical vocabularies are shared between models
+    vocab = _load_vocabulary(config, serialization_dir)
+    model_params = config.get("model")
+    # the pretrained embedding files aren't needed, since the weights are loaded from the archive
+    remove_pretrained_embedding_params(model_params)
+    model = Model.from_params(vocab = vocab, params = model_params)
+    model_state = torch.load(weights_file, map_location = device_mapping(cuda_device))
+    model.load_state_dict(model_state)
+    if cuda_device >= 0:
+        model.cuda(cuda_device)
     else:
-        weights_path = os.path.join(serialization_dir, _WEIGHTS_NAME)
+        model.cpu()
+    return model
 
-    # Instantiate model. Use a duplicate of the config, as it will get consumed.
-    model = Model.load(config.duplicate(),
-                       weights_file=weights_path,
-                       serialization_dir=serialization_dir,
-                       cuda_device=cuda_device)
+def export_frozen_archive(archive_file: str,
+                          output_dir: str,
+                          overrides: str = "",
+                          weights_file: str = None) -> None:
+    """
+    Writes a model serialization dir as a frozen archive (see above), which ``load_frozen_archive`` loads
+    without re-resolving the config, reading the vocabulary directory, or deserializing the weights:
+    the weights are memory-mapped, so processes on the same host loading the same archive share their pages.
+    """
+    if os.path.exists(output_dir):
+        raise ConfigurationError("Output directory %s already exists." % output_dir)
+    serialization_dir = cached_path(archive_file)
+    archive = load_archive_from_folder(serialization_dir, overrides = overrides, weights_file = weights_file)
+    os.makedirs(output_dir)
 
-    return Archive(model=model, config=config)
+    # supplemental files are resolved again on load, relative to the frozen archive
+    if os.path.exists(os.path.join(serialization_dir, _FTA_NAME)):
+        shutil.copy(os.path.join(serialization_dir, _FTA_NAME), output_dir)
+        if os.path.exists(os.path.join(serialization_dir, "fta")):
+            shutil.copytree(os.path.join(serialization_dir, "fta"), os.path.join(output_dir, "fta"))
+    config = Params.from_file(os.path.join(serialization_dir, CONFIG_NAME), overrides)
+    # the weights are all loaded from the archive, so there is nothing to initialize or read from pretrained files
+    config["model"].pop("initializer", None)
+    remove_pretrained_embedding_params(config["model"])
+    with open(os.path.join(output_dir, FROZEN_CONFIG_NAME), "w") as f:
+        json.dump(config.as_dict(quiet = True), f, indent = 2)
+
+    vocab = archive.model.vocab
+    vocab_json = {
+        "nonPaddedNamespaces": sorted(vocab._non_padded_namespaces),
+        "namespaces": {
+            namespace: [index_to_token[i] for i in range(len(index_to_token))]
+            for namespace, index_to_token in vocab._index_to_token.items()
+        }
+    }
+    with open(os.path.join(output_dir, FROZEN_VOCABULARY_NAME), "w") as f:
+        json.dump(vocab_json, f)
+
+    weights_index = []
+    offset = 0
+    with open(os.path.join(output_dir, FROZEN_WEIGHTS_NAME), "wb") as f:
+        for name, tensor in archive.model.state_dict().items():
+            array = tensor.detach().cpu().contiguous().numpy()
+            padding = (-offset) % FROZEN_WEIGHTS_ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            weights_index.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+            f.write(array.tobytes())
+            offset += array.nbytes
+    with open(os.path.join(output_dir, FROZEN_WEIGHTS_INDEX_NAME), "w") as f:
+        json.dump(weights_index, f)
+
+def _load_frozen_vocabulary(archive_dir: str) -> Vocabulary:
+    with open(os.path.join(archive_dir, FROZEN_VOCABULARY_NAME), "rb") as f:
+        vocab_bytes = f.read()
+    def load_vocabulary():
+        vocab_json = json.loads(vocab_bytes.decode("utf8"))
+        vocab = Vocabulary(non_padded_namespaces = vocab_json["nonPaddedNamespaces"])
+        for namespace, tokens in vocab_json["namespaces"].items():
+            vocab._index_to_token[namespace] = dict(enumerate(tokens))
+            vocab._token_to_index[namespace] = {token: i for i, token in enumerate(tokens)}
+        return vocab
+    return _get_shared_vocabulary(hashlib.md5(vocab_bytes).hexdigest(), load_vocabulary)
+
+def _load_frozen_weights(archive_dir: str) -> Dict[str, torch.Tensor]:
+    with open(os.path.join(archive_dir, FROZEN_WEIGHTS_INDEX_NAME), "r") as f:
+        weights_index = json.load(f)
+    # copy-on-write mapping: pages are shared between processes unless written to
+    weights_buffer = numpy.memmap(os.path.join(archive_dir, FROZEN_WEIGHTS_NAME), dtype = numpy.uint8, mode = "c")
+    state = {}
+    for entry in weights_index:
+        dtype = numpy.dtype(entry["dtype"])
+        num_bytes = int(numpy.prod(entry["shape"])) * dtype.itemsize
+        array = weights_buffer[entry["offset"]:entry["offset"] + num_bytes].view(dtype).reshape(entry["shape"])
+        state[entry["name"]] = torch.from_numpy(array)
+    return state
+
+def load_frozen_archive(archive_dir: str,
+                        cuda_device: int = -1,
+                        overrides: str = "",
+                        quantize: bool = False) -> Archive:
+    """
+    Loads an archive written by ``export_frozen_archive``. On CPU, the model's parameters and buffers
+    are the memory-mapped tensors themselves rather than copies of them.
+    """
+    logger.info(f"loading frozen model from directory {archive_dir}")
+    config = _load_config(archive_dir, FROZEN_CONFIG_NAME, overrides)
+    vocab = _load_frozen_vocabulary(archive_dir)
+    model = Model.from_params(vocab = vocab, params = config.duplicate().get("model"))
+    state = _load_frozen_weights(archive_dir)
+    if set(state.keys()) != set(model.state_dict().keys()):
+        raise ConfigurationError("Frozen weights in %s don't match the model: missing %s, unexpected %s." % (
+            archive_dir, sorted(set(model.state_dict().keys()) - set(state.keys())), sorted(set(state.keys()) - set(model.state_dict().keys()))))
+    if cuda_device >= 0:
+        model.load_state_dict(state)
+        model.cuda(cuda_device)
+    else:
+        for module_name, module in model.named_modules():
+            prefix = (module_name + ".") if module_name else ""
+            for name, param in module._parameters.items():
+                if param is not None:
+                    tensor = state[prefix + name]
+                    if tensor.shape != param.shape or tensor.dtype != param.dtype:
+                        raise ConfigurationError("Frozen weight %s has shape %s (%s), but the model expects %s (%s)." % (
+                            prefix + name, tuple(tensor.shape), tensor.dtype, tuple(param.shape), param.dtype))
+                    param.data = tensor
+            for name, buffer in module._buffers.items():
+                if buffer is not None:
+                    module._buffers[name] = state[prefix + name]
+    if quantize:
+        model = quantize_model(model, cuda_device)
+    return Archive(model = model, config = config)
+
+class ArchiveLoader():
+    """
+    Loads model serialization dirs (as ``load_archive_from_folder`` does) concurrently on a thread pool,
+    so that file I/O and weight deserialization of the archives of a pipeline overlap.
+    ``submit`` returns a ``Future`` of the ``Archive``; with ``max_workers = 1``, archives load one after another.
+    """
+    def __init__(self,
+                 cuda_device: int = -1,
+                 quantize: bool = False,
+                 max_workers: int = 6) -> None:
+        self._cuda_device = cuda_device
+        self._quantize = quantize
+        self._executor = ThreadPoolExecutor(max_workers = max_workers)
+
+    def submit(self, archive_file: str, overrides: str = "", weights_file: str = None) -> Future:
+        return self._executor.submit(
+            load_archive_from_folder, archive_file,
+            cuda_device = self._cuda_device, overrides = overrides, weights_file = weights_file, quantize = self._quantize)
+
+    def shutdown(self) -> None:
+        # let any archives still loading finish in the background
+        self._executor.shutdown(wait = False)
+
+def resolve_archive(archive) -> Archive:
+    # waits for the archive if it is still loading
+    return archive.result() if isinstance(archive, Future) else archive
+
+def quantize_model(model: Model, cuda_device: int = -1) -> Model:
+    """
+    Applies dynamic int8 quantization to the ``Linear``, ``LSTM`` and ``LSTMCell`` layers of a model
+    (weights are stored as int8; activations are quantized on the fly). Only supported for CPU inference.
+    """
+    if cuda_device >= 0:
+        raise ConfigurationError("Quantized models can only be run on CPU (got cuda_device = %d)." % cuda_device)
+    if not hasattr(torch, "quantization"):
+        raise ConfigurationError("Dynamic quantization requires a version of PyTorch with torch.quantization.")
+    logger.info("Applying dynamic int8 quantization to Linear and LSTM layers")
+    model.eval()
+    # quantize_dynamic swaps layers in their parents' _modules, but some modules (e.g., the slot sequence
+    # generator and encoder) run their layers from plain lists, which would still hold the float layers.
+    module_locations = {
+        id(child): (parent, name)
+        for parent in model.modules()
+        for name, child in parent._modules.items() if child is not None
+    }
+    model = torch.quantization.quantize_dynamic(model, {Linear, LSTM, LSTMCell}, dtype = torch.qint8, inplace = True)
+    def swap(value):
+        if isinstance(value, list):
+            return [swap(v) for v in value]
+        elif isinstance(value, Module) and id(value) in module_locations:
+            parent, name = module_locations[id(value)]
+            return parent._modules[name]
+        else:
+            return value
+    for module in model.modules():
+        for attribute, value in list(vars(module).items()):
+            if isinstance(value, list):
+                setattr(module, attribute, swap(value))
+        if hasattr(module, "_script_inference"):
+            # the TorchScript recurrence runs on the float weights, so use the (quantized) eager path
+            module._script_inference = False
+    check_quantized(model)
+    return model
+
+def check_quantized(model: Model) -> None:
+    """
+    Raises a ``ConfigurationError`` if any float ``Linear``, ``LSTM`` or ``LSTMCell`` layer
+    is still reachable from a module, either as a submodule or through a list attribute.
+    """
+    float_types = (Linear, LSTM, LSTMCell)
+    def find_float_layers(value, path):
+        if isinstance(value, list):
+            for i, v in enumerate(value):
+                yield from find_float_layers(v, "%s[%d]" % (path, i))
+        elif type(value) in float_types:
+            yield path
+    float_layers = []
+    for module_name, module in model.named_modules():
+        for name, child in module._modules.items():
+            float_layers.extend(find_float_layers(child, "%s.%s" % (module_name, name)))
+        for attribute, value in vars(module).items():
+            if isinstance(value, list):
+                float_layers.extend(find_float_layers(value, "%s.%s" % (module_name, attribute)))
+    if len(float_layers) > 0:
+        raise ConfigurationError("Layers left unquantized: %s" % ", ".join(float_layers[:10]))
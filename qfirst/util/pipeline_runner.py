@@ -0,0 +1,321 @@
+from typing import Callable, List, Optional, Tuple
+
+import gzip
+import json
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import torch
+from tqdm import tqdm
+
+from allennlp.common.checks import ConfigurationError
+from allennlp.common.file_utils import cached_path
+from allennlp.common.util import JsonDict
+
+from qfirst.data.util import read_lines
+from qfirst.util.prediction_cache import PredictionCache
+
+# marks the end of a stage's output
+_end_of_input = object()
+
+class _StageError():
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+class CheckpointedOutput():
+    """
+    Output JSON lines file (gzipped if it ends in ``.gz``) written in chunks of ``commit_every`` sentences.
+    Each chunk is written and flushed as a whole (as its own gzip member for ``.gz`` files,
+    which concatenate into a valid gzip stream). If ``checkpoint`` is set, then after each chunk
+    the number of input lines covered so far and the size of the output are recorded in ``<output_file>.checkpoint``.
+    With ``resume``, an existing checkpoint is loaded, the output is truncated to its last recorded size
+    (dropping anything partially written after it), and writing continues from there;
+    ``num_input_lines`` then gives the first input line which still needs to be processed.
+    """
+    def __init__(self,
+                 output_file: str,
+                 input_file: str,
+                 checkpoint: bool = False,
+                 resume: bool = False,
+                 commit_every: int = 100) -> None:
+        self._input_file = input_file
+        self._gzip = output_file.endswith(".gz")
+        self._checkpoint_file = (output_file + ".checkpoint") if checkpoint else None
+        self._commit_every = commit_every
+        self.num_input_lines = 0
+        self.num_sentences = 0
+        if resume and self._checkpoint_file is not None and os.path.exists(self._checkpoint_file):
+            with open(self._checkpoint_file, "r") as f:
+                checkpoint_json = json.load(f)
+            if checkpoint_json["inputFile"] != input_file:
+                raise ConfigurationError("Checkpoint %s was written for input %s, not %s." % (self._checkpoint_file, checkpoint_json["inputFile"], input_file))
+            if not os.path.exists(output_file) or os.path.getsize(output_file) < checkpoint_json["outputBytes"]:
+                raise ConfigurationError("Output file %s is missing or shorter than recorded in its checkpoint." % output_file)
+            self.num_input_lines = checkpoint_json["inputLines"]
+            self.num_sentences = checkpoint_json["numSentences"]
+            self._file = open(output_file, "r+b")
+            self._file.truncate(checkpoint_json["outputBytes"])
+            self._file.seek(checkpoint_json["outputBytes"])
+            print("Resuming %s after %d sentences (%d input lines)." % (output_file, self.num_sentences, self.num_input_lines), file = sys.stderr, flush = True)
+        else:
+            self._file = open(output_file, "wb")
+        self._buffer = []
+        self._num_buffered_sentences = 0
+        self._next_input_line = self.num_input_lines
+
+    def write(self, output_jsons: List[JsonDict], next_input_line: int) -> None:
+        # next_input_line: index of the first input line after the sentences of output_jsons
+        self._buffer.extend([json.dumps(output_json) + "\n" for output_json in output_jsons])
+        self._num_buffered_sentences += len(output_jsons)
+        self._next_input_line = next_input_line
+        if self._num_buffered_sentences >= self._commit_every:
+            self.commit()
+
+    def commit(self) -> None:
+        if len(self._buffer) > 0:
+            data = "".join(self._buffer).encode("utf8")
+            self._file.write(gzip.compress(data) if self._gzip else data)
+            self._file.flush()
+        self.num_sentences += self._num_buffered_sentences
+        self.num_input_lines = self._next_input_line
+        self._buffer = []
+        self._num_buffered_sentences = 0
+        if self._checkpoint_file is not None:
+            checkpoint_json = {
+                "inputFile": self._input_file,
+                "inputLines": self.num_input_lines,
+                "numSentences": self.num_sentences,
+                "outputBytes": self._file.tell()
+            }
+            # write-and-rename, so the checkpoint itself is never partially written
+            with open(self._checkpoint_file + ".tmp", "w") as f:
+                json.dump(checkpoint_json, f)
+            os.replace(self._checkpoint_file + ".tmp", self._checkpoint_file)
+
+    def close(self, commit: bool = True) -> None:
+        if commit:
+            self.commit()
+        self._file.close()
+
+def run_pipeline(pipeline,
+                 input_file: str,
+                 output_file: Optional[str] = None,
+                 batch_size: int = 1,
+                 max_queued_batches: int = 4,
+                 input_filter: Callable[[JsonDict], bool] = None,
+                 show_progress: bool = False,
+                 num_workers: int = 1,
+                 resume: bool = False,
+                 prediction_cache: Optional[str] = None) -> None:
+    """
+    Runs a pipeline over a JSON lines file of sentences in three overlapping stages:
+    a reader thread parses (and filters, if ``input_filter`` is given) the input into batches of ``batch_size`` sentences,
+    the calling thread runs the models on each batch, and a writer thread serializes the outputs
+    in input order to ``output_file`` (gzipped if it ends in ``.gz``, stdout if ``None``).
+    The stages are connected by queues holding at most ``max_queued_batches`` batches.
+    Uses ``pipeline.predict_batch`` if it exists, and ``pipeline.predict`` on each sentence otherwise.
+    If ``num_workers > 1``, the input is sharded over that many forked worker processes (see ``_run_sharded``).
+    Otherwise, progress through the input is checkpointed next to the output file (see ``CheckpointedOutput``),
+    and with ``resume`` an interrupted run picks up after the last checkpoint, appending to the existing output.
+    If ``prediction_cache`` is given, outputs are looked up in and added to the cache at that path (see ``PredictionCache``).
+    """
+    if prediction_cache is not None:
+        pipeline = PredictionCache(pipeline, prediction_cache)
+    if num_workers > 1:
+        if resume:
+            raise ConfigurationError("Resuming is not supported with multiple workers.")
+        _run_sharded(pipeline, input_file, output_file, batch_size, max_queued_batches, input_filter, num_workers)
+    else:
+        _run_stages(pipeline, input_file, output_file, batch_size, max_queued_batches, input_filter, show_progress,
+                    checkpoint = True, resume = resume)
+        if prediction_cache is not None:
+            pipeline.report()
+
+def _read_input_lines(input_file: str, line_range: Optional[Tuple[int, Optional[int]]] = None):
+    # yields (line index, line) pairs; line_range is (start, end), where end may be None
+    for line_index, line in enumerate(read_lines(cached_path(input_file))):
+        if line_range is not None:
+            if line_index < line_range[0]:
+                continue
+            elif line_range[1] is not None and line_index >= line_range[1]:
+                break
+        yield line_index, line
+
+def _run_stages(pipeline,
+                input_file: str,
+                output_file: Optional[str],
+                batch_size: int,
+                max_queued_batches: int,
+                input_filter: Optional[Callable[[JsonDict], bool]],
+                show_progress: bool,
+                line_range: Optional[Tuple[int, Optional[int]]] = None,
+                checkpoint: bool = False,
+                resume: bool = False) -> int:
+    # returns the number of sentences written
+    if hasattr(pipeline, "predict_batch"):
+        predict_batch = pipeline.predict_batch
+    else:
+        predict_batch = lambda inputs_list: [pipeline.predict(inputs) for inputs in inputs_list]
+
+    input_queue = queue.Queue(maxsize = max_queued_batches)
+    output_queue = queue.Queue(maxsize = max_queued_batches)
+    writer_errors = []
+    num_written = [0]
+
+    out = None
+    if output_file is not None:
+        out = CheckpointedOutput(output_file, input_file, checkpoint = checkpoint, resume = resume)
+        if out.num_input_lines > 0:
+            line_range = (out.num_input_lines, None)
+
+    # batches are passed along with the index of the input line following them, for checkpointing
+    def read():
+        try:
+            batch = []
+            for line_index, line in _read_input_lines(input_file, line_range):
+                if len(line.strip()) == 0:
+                    continue
+                input_json = json.loads(line)
+                if input_filter is not None and not input_filter(input_json):
+                    continue
+                batch.append(input_json)
+                if len(batch) == batch_size:
+                    input_queue.put((batch, line_index + 1))
+                    batch = []
+            if len(batch) > 0:
+                input_queue.put((batch, line_index + 1))
+            input_queue.put(_end_of_input)
+        except BaseException as e:
+            input_queue.put(_StageError(e))
+
+    def write():
+        progress = tqdm(unit = " sentences") if show_progress else None
+        while True:
+            item = output_queue.get()
+            if item is _end_of_input:
+                break
+            elif len(writer_errors) > 0:
+                continue # keep draining so the model stage doesn't block
+            outputs, next_input_line = item
+            try:
+                if out is None:
+                    sys.stdout.write("".join([json.dumps(output_json) + "\n" for output_json in outputs]))
+                    sys.stdout.flush()
+                else:
+                    out.write(outputs, next_input_line)
+                num_written[0] += len(outputs)
+                if progress is not None:
+                    progress.update(len(outputs))
+            except BaseException as e:
+                writer_errors.append(e)
+        # only commit the remaining output if everything before it went through
+        if out is not None:
+            try:
+                out.close(commit = len(writer_errors) == 0)
+            except BaseException as e:
+                writer_errors.append(e)
+        if progress is not None:
+            progress.close()
+
+    reader = threading.Thread(target = read, daemon = True)
+    writer = threading.Thread(target = write, daemon = True)
+    reader.start()
+    writer.start()
+    try:
+        while len(writer_errors) == 0:
+            batch = input_queue.get()
+            if batch is _end_of_input:
+                break
+            elif isinstance(batch, _StageError):
+                raise batch.error
+            inputs_list, next_input_line = batch
+            output_queue.put((predict_batch(inputs_list), next_input_line))
+    finally:
+        output_queue.put(_end_of_input)
+        writer.join()
+    if len(writer_errors) > 0:
+        raise writer_errors[0]
+    return num_written[0]
+
+def _run_sharded(pipeline,
+                 input_file: str,
+                 output_file: Optional[str],
+                 batch_size: int,
+                 max_queued_batches: int,
+                 input_filter: Optional[Callable[[JsonDict], bool]],
+                 num_workers: int) -> None:
+    """
+    Splits the input lines into ``num_workers`` contiguous ranges, and runs each range in a process forked
+    from this one after the models are loaded, so the workers share the weights copy-on-write.
+    Each worker writes its own shard (gzipped if the output is), and the shards are concatenated in order
+    (concatenated gzip members are a valid gzip file). Reports the throughput of each worker on stderr.
+    """
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        raise ConfigurationError("Multiple pipeline workers can only be used on CPU: CUDA does not survive a fork.")
+    # models still loading in the background must be loaded before forking, so the workers share them
+    if hasattr(pipeline, "load_models"):
+        pipeline.load_models()
+    num_lines = sum(1 for _ in read_lines(cached_path(input_file)))
+    shard_size = max(1, int(math.ceil(num_lines / num_workers)))
+    line_ranges = [(start, min(start + shard_size, num_lines)) for start in range(0, num_lines, shard_size)]
+    # split the cores between the workers so they don't oversubscribe the machine
+    num_threads = max(1, torch.get_num_threads() // max(1, len(line_ranges)))
+
+    shard_dir = tempfile.mkdtemp(dir = os.path.dirname(os.path.abspath(output_file)) if output_file is not None else None)
+    shard_suffix = ".jsonl.gz" if output_file is not None and output_file.endswith(".gz") else ".jsonl"
+    shard_files = [os.path.join(shard_dir, "shard-%d%s" % (i, shard_suffix)) for i in range(len(line_ranges))]
+    context = multiprocessing.get_context("fork")
+    stats_queue = context.Queue()
+
+    def work(worker_index):
+        torch.set_num_threads(num_threads)
+        start_time = time.time()
+        num_sentences = _run_stages(pipeline, input_file, shard_files[worker_index], batch_size, max_queued_batches, input_filter,
+                                    show_progress = False, line_range = line_ranges[worker_index])
+        if isinstance(pipeline, PredictionCache):
+            print("Worker %d:" % worker_index, end = " ", file = sys.stderr)
+            pipeline.report()
+        stats_queue.put((worker_index, num_sentences, time.time() - start_time))
+
+    try:
+        start_time = time.time()
+        workers = [context.Process(target = work, args = (i,)) for i in range(len(line_ranges))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for i, worker in enumerate(workers):
+            if worker.exitcode != 0:
+                raise RuntimeError("Pipeline worker %d (lines %d-%d) failed with exit code %s." % (i, line_ranges[i][0], line_ranges[i][1], worker.exitcode))
+        elapsed = time.time() - start_time
+        worker_stats = sorted([stats_queue.get() for _ in workers])
+        for worker_index, num_sentences, worker_elapsed in worker_stats:
+            print("Worker %d: %d sentences in %.1fs (%.2f sentences/sec)" % (
+                worker_index, num_sentences, worker_elapsed, num_sentences / max(worker_elapsed, 1e-6)), file = sys.stderr, flush = True)
+        total_sentences = sum([num_sentences for _, num_sentences, _ in worker_stats])
+        print("All workers: %d sentences in %.1fs (%.2f sentences/sec)" % (
+            total_sentences, elapsed, total_sentences / max(elapsed, 1e-6)), file = sys.stderr, flush = True)
+
+        if output_file is None:
+            sys.stdout.flush()
+            out = sys.stdout.buffer
+        else:
+            out = open(output_file, "wb")
+        try:
+            for shard_file in shard_files:
+                with open(shard_file, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        finally:
+            if output_file is None:
+                out.flush()
+            else:
+                out.close()
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors = True)
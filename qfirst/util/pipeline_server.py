@@ -0,0 +1,307 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+import asyncio
+import collections
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from allennlp.common.util import JsonDict
+
+from qfirst.util.prediction_cache import PredictionCache
+
+# Long-running HTTP server for a pipeline (anything with predict_batch or predict, e.g., QFirstPipeline),
+# using only asyncio streams so that it runs offline without extra dependencies.
+# Endpoints:
+#   POST /predict: a sentence JSON (as in the pipelines' input files) or a list of them;
+#     responds with the output JSON for each, in the same shape as the request.
+#   GET /health: { "status": "ok", ... } once the models are loaded.
+#   GET /metrics: request, batch, and latency statistics.
+# Sentences from concurrent requests are coalesced into micro-batches (see MicroBatcher).
+
+_max_request_bytes = 16 * 1024 * 1024
+
+_reasons = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"
+}
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super(_HttpError, self).__init__(message)
+        self.status = status
+
+class MicroBatcher():
+    """
+    Coalesces sentences submitted concurrently into batches for ``predict_batch``.
+    A batch is run once it has ``max_batch_size`` sentences, or once its oldest sentence
+    has waited ``max_wait_time`` seconds, whichever comes first. Batches run one at a time
+    on a single worker thread (the pipelines are not thread-safe), so the event loop keeps accepting
+    requests in the meantime, and whatever queued up during a batch forms the next one.
+    """
+    def __init__(self,
+                 predict_batch: Callable[[List[JsonDict]], List[JsonDict]],
+                 max_batch_size: int = 32,
+                 max_wait_time: float = 0.01,
+                 num_recent_latencies: int = 1000) -> None:
+        self._predict_batch = predict_batch
+        self._max_batch_size = max_batch_size
+        self._max_wait_time = max_wait_time
+        self._executor = ThreadPoolExecutor(max_workers = 1)
+        # (inputs, future, submit time)
+        self._pending = collections.deque()
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._start_time = time.time()
+        self._recent_latencies = collections.deque(maxlen = num_recent_latencies)
+        self._batch_size_counts: Dict[int, int] = collections.Counter()
+        self.num_sentences = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self._model_time = 0.0
+
+    async def submit(self, inputs: JsonDict) -> JsonDict:
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((inputs, future, time.time()))
+        self._has_pending.set()
+        if len(self._pending) >= self._max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            # wait for a full batch, at most until the oldest pending sentence has waited max_wait_time
+            oldest_submit_time = self._pending[0][2]
+            while len(self._pending) < self._max_batch_size:
+                remaining_time = oldest_submit_time + self._max_wait_time - time.time()
+                if remaining_time <= 0:
+                    break
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), remaining_time)
+                except asyncio.TimeoutError:
+                    break
+            batch = []
+            while len(self._pending) > 0 and len(batch) < self._max_batch_size:
+                inputs, future, submit_time = self._pending.popleft()
+                # skip sentences whose requests were dropped in the meantime
+                if not future.done():
+                    batch.append((inputs, future, submit_time))
+            if len(self._pending) == 0:
+                self._has_pending.clear()
+            self._batch_full.clear()
+            if len(batch) == 0:
+                continue
+            try:
+                await self._run_batch(batch)
+            except Exception as e:
+                self.num_errors += 1
+                print("Error in batch of %d sentences: %s" % (len(batch), repr(e)), file = sys.stderr, flush = True)
+                if len(batch) == 1:
+                    _, future, _ = batch[0]
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                # so that one bad sentence doesn't fail the unrelated requests batched with it,
+                # retry the sentences one at a time, failing only those which fail on their own
+                for item in batch:
+                    try:
+                        await self._run_batch([item])
+                    except Exception as e:
+                        _, future, _ = item
+                        if not future.done():
+                            future.set_exception(e)
+
+    async def _run_batch(self, batch) -> None:
+        loop = asyncio.get_event_loop()
+        start_time = time.time()
+        outputs = await loop.run_in_executor(self._executor, self._predict_batch, [inputs for inputs, _, _ in batch])
+        end_time = time.time()
+        self._model_time += end_time - start_time
+        self.num_sentences += len(batch)
+        self.num_batches += 1
+        self._batch_size_counts[len(batch)] += 1
+        for (_, future, submit_time), output in zip(batch, outputs):
+            self._recent_latencies.append(end_time - submit_time)
+            if not future.done():
+                future.set_result(output)
+
+    def get_metrics(self) -> JsonDict:
+        latencies = sorted(self._recent_latencies)
+        def percentile(p):
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)] if len(latencies) > 0 else None
+        return {
+            "uptimeSeconds": time.time() - self._start_time,
+            "numSentences": self.num_sentences,
+            "numBatches": self.num_batches,
+            "numBatchErrors": self.num_errors,
+            "pendingSentences": len(self._pending),
+            "meanBatchSize": self.num_sentences / max(self.num_batches, 1),
+            "batchSizeCounts": { str(size): count for size, count in sorted(self._batch_size_counts.items()) },
+            "modelSeconds": self._model_time,
+            "sentencesPerModelSecond": self.num_sentences / self._model_time if self._model_time > 0 else None,
+            # over the most recent sentences, from submission to output
+            "latencySeconds": { "p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99) }
+        }
+
+class PipelineServer():
+    """
+    Serves a pipeline over HTTP (see the endpoints above), with sentences micro-batched across requests.
+    """
+    def __init__(self,
+                 pipeline,
+                 max_batch_size: int = 32,
+                 max_wait_time: float = 0.01) -> None:
+        if hasattr(pipeline, "predict_batch"):
+            predict_batch = pipeline.predict_batch
+        else:
+            predict_batch = lambda inputs_list: [pipeline.predict(inputs) for inputs in inputs_list]
+        self._batcher = MicroBatcher(predict_batch, max_batch_size = max_batch_size, max_wait_time = max_wait_time)
+        self.num_requests = 0
+        self.num_failed_requests = 0
+
+    async def _predict(self, request_json) -> JsonDict:
+        def check_sentence(sentence_json):
+            # reject malformed sentences up front, rather than failing the batch they would share with other requests
+            if not isinstance(sentence_json, dict) or \
+               not isinstance(sentence_json.get("sentenceId"), str) or \
+               not isinstance(sentence_json.get("sentenceTokens"), list) or \
+               not isinstance(sentence_json.get("verbEntries"), dict):
+                raise _HttpError(400, "Expected a sentence JSON object with sentenceId, sentenceTokens, and verbEntries, or a list of them.")
+            for verb_entry in sentence_json["verbEntries"].values():
+                if not isinstance(verb_entry, dict) or not isinstance(verb_entry.get("verbIndex"), int) or \
+                   not 0 <= verb_entry["verbIndex"] < len(sentence_json["sentenceTokens"]):
+                    raise _HttpError(400, "Each verb entry needs a verbIndex within the sentence's tokens.")
+        if isinstance(request_json, list):
+            for sentence_json in request_json:
+                check_sentence(sentence_json)
+            return await asyncio.gather(*[self._batcher.submit(sentence_json) for sentence_json in request_json])
+        else:
+            check_sentence(request_json)
+            return await self._batcher.submit(request_json)
+
+    async def _respond(self, method: str, path: str, body: bytes) -> Tuple[int, JsonDict]:
+        path = path.split("?")[0]
+        if path == "/health":
+            if method != "GET":
+                raise _HttpError(405, "Use GET for %s." % path)
+            return 200, { "status": "ok", "pendingSentences": self._batcher.get_metrics()["pendingSentences"] }
+        elif path == "/metrics":
+            if method != "GET":
+                raise _HttpError(405, "Use GET for %s." % path)
+            return 200, {
+                "numRequests": self.num_requests,
+                "numFailedRequests": self.num_failed_requests,
+                **self._batcher.get_metrics()
+            }
+        elif path == "/predict":
+            if method != "POST":
+                raise _HttpError(405, "Use POST for %s." % path)
+            try:
+                request_json = json.loads(body.decode("utf8"))
+            except ValueError as e:
+                raise _HttpError(400, "Invalid JSON: %s" % e)
+            return 200, await self._predict(request_json)
+        else:
+            raise _HttpError(404, "Unknown path %s; use /predict, /health, or /metrics." % path)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if len(request_line) == 0:
+            return None
+        parts = request_line.decode("latin-1").strip().split()
+        if len(parts) != 3:
+            raise _HttpError(400, "Malformed request line.")
+        method, path, _ = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = b""
+        if "content-length" in headers:
+            try:
+                content_length = int(headers["content-length"])
+            except ValueError:
+                raise _HttpError(400, "Invalid Content-Length.")
+            if content_length < 0:
+                raise _HttpError(400, "Invalid Content-Length.")
+            if content_length > _max_request_bytes:
+                raise _HttpError(413, "Request body is over %d bytes." % _max_request_bytes)
+            body = await reader.readexactly(content_length)
+        elif method == "POST":
+            raise _HttpError(411, "POST requests need a Content-Length.")
+        return method, path, headers, body
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # HTTP/1.1 with keep-alive: requests on one connection are answered in order
+        try:
+            while True:
+                keep_alive = True
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    if path.startswith("/predict"):
+                        self.num_requests += 1
+                    status, response_json = await self._respond(method, path, body)
+                except _HttpError as e:
+                    status, response_json = e.status, { "error": str(e) }
+                    # the rest of the request may be unread
+                    keep_alive = False
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    status, response_json = 500, { "error": repr(e) }
+                if status != 200:
+                    self.num_failed_requests += 1
+                response_body = json.dumps(response_json).encode("utf8")
+                writer.write((
+                    "HTTP/1.1 %d %s\r\n" % (status, _reasons[status]) +
+                    "Content-Type: application/json\r\n" +
+                    "Content-Length: %d\r\n" % len(response_body) +
+                    "Connection: %s\r\n\r\n" % ("keep-alive" if keep_alive else "close")
+                ).encode("latin-1") + response_body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        loop = asyncio.get_event_loop()
+        batcher_task = loop.create_task(self._batcher.run())
+        server = loop.run_until_complete(asyncio.start_server(self.handle_connection, host, port))
+        print("Serving on http://%s:%d (POST /predict, GET /health, GET /metrics)" % (host, port), file = sys.stderr, flush = True)
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            batcher_task.cancel()
+
+def serve_pipeline(pipeline,
+                   host: str = "127.0.0.1",
+                   port: int = 8000,
+                   max_batch_size: int = 32,
+                   max_wait_time: float = 0.01,
+                   prediction_cache: Optional[str] = None) -> None:
+    """
+    Loads any lazily-loaded models of ``pipeline`` and serves it over HTTP until interrupted.
+    If ``prediction_cache`` is given, outputs are looked up in and added to the cache at that path (see ``PredictionCache``).
+    """
+    if hasattr(pipeline, "load_models"):
+        pipeline.load_models()
+    if prediction_cache is not None:
+        pipeline = PredictionCache(pipeline, prediction_cache)
+    PipelineServer(pipeline, max_batch_size = max_batch_size, max_wait_time = max_wait_time).serve(host, port)
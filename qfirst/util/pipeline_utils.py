@@ -0,0 +1,62 @@
+from typing import List, Optional, Tuple
+
+import heapq
+
+from allennlp.common.util import JsonDict
+from allennlp.data import Instance
+from allennlp.data.fields import ListField, SpanField
+from allennlp.models import Model
+
+from qfirst.common.span import Span
+
+def forward_on_verb_spans(model: Model,
+                          verb_instances: List[Instance],
+                          span_field_name: str,
+                          verb_spans: List[Optional[List[Span]]]) -> List[Optional[JsonDict]]:
+    """
+    Runs a span-level head (e.g., animacy or span-to-TAN) on the spans of many verbs at once.
+    Each verb instance gets its spans added under ``span_field_name`` and all of them go through
+    a single ``forward_on_instances`` call. Returns the output for each verb in order,
+    or ``None`` for verbs without any spans (``None`` or empty).
+    """
+    head_instances = []
+    for instance, spans in zip(verb_instances, verb_spans):
+        if spans is not None and len(spans) > 0:
+            span_fields = [SpanField(s.start(), s.end(), instance["text"]) for s in spans]
+            instance.add_field(span_field_name, ListField(span_fields), model.vocab)
+            head_instances.append(instance)
+    if len(head_instances) == 0:
+        return [None for _ in verb_spans]
+    head_outputs = iter(model.forward_on_instances(head_instances))
+    return [next(head_outputs) if spans is not None and len(spans) > 0 else None
+            for spans in verb_spans]
+
+def k_best_pairs(first_probs: List[float],
+                 second_probs: List[float],
+                 max_num_pairs: int = None,
+                 min_pair_prob: float = 0.0) -> List[Tuple[int, int]]:
+    """
+    Returns index pairs ``(i, j)`` in descending order of ``first_probs[i] * second_probs[j]``,
+    stopping after ``max_num_pairs`` pairs (if given) or once the product drops below ``min_pair_prob``.
+    Both lists are sorted once and the pair frontier is expanded lazily with a heap,
+    so only about ``max_num_pairs`` products are ever computed.
+    """
+    first_order = sorted(range(len(first_probs)), key = lambda i: -first_probs[i])
+    second_order = sorted(range(len(second_probs)), key = lambda j: -second_probs[j])
+    def get_score(i, j):
+        return first_probs[first_order[i]] * second_probs[second_order[j]]
+    pairs = []
+    if len(first_order) == 0 or len(second_order) == 0:
+        return pairs
+    frontier = [(-get_score(0, 0), 0, 0)]
+    visited = {(0, 0)}
+    while len(frontier) > 0 and (max_num_pairs is None or len(pairs) < max_num_pairs):
+        neg_score, i, j = heapq.heappop(frontier)
+        if -neg_score < min_pair_prob:
+            break
+        pairs.append((first_order[i], second_order[j]))
+        for next_i, next_j in [(i + 1, j), (i, j + 1)]:
+            if next_i < len(first_order) and next_j < len(second_order) and (next_i, next_j) not in visited:
+                visited.add((next_i, next_j))
+                heapq.heappush(frontier, (-get_score(next_i, next_j), next_i, next_j))
+    return pairs
@@ -0,0 +1,157 @@
+from typing import Dict, List, Optional
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import torch
+
+from allennlp.common.util import JsonDict
+
+# On-disk cache of pipeline outputs, keyed by a hash of the sentence content (everything but its id)
+# together with a fingerprint of the pipeline (model weights, thresholds, and other settings),
+# so re-running the same pipeline over overlapping inputs only runs the models on new sentences.
+
+_simple_types = (int, float, bool, str, type(None))
+
+def _simple_attributes(obj) -> List:
+    # settings-like attributes of an object, e.g., thresholds and flags
+    attributes = []
+    for name, value in sorted(vars(obj).items()):
+        if name == "training":
+            continue
+        if isinstance(value, _simple_types) or \
+           (isinstance(value, (list, tuple)) and all([isinstance(v, _simple_types) for v in value])):
+            attributes.append((name, value))
+    return attributes
+
+def _update_with_value(digest, value) -> None:
+    # quantized layers keep their weights in (possibly nested) tuples of quantized tensors, or in packed
+    # parameter objects, whose reprs only show a few elements, so hash the bytes of every tensor inside
+    if isinstance(value, torch.Tensor):
+        if value.is_quantized:
+            value = value.dequantize()
+        digest.update(str(value.dtype).encode("utf8"))
+        digest.update(value.detach().cpu().contiguous().numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        digest.update(("%s:%d" % (type(value).__name__, len(value))).encode("utf8"))
+        for v in value:
+            _update_with_value(digest, v)
+    elif isinstance(value, dict):
+        for k, v in sorted(value.items()):
+            digest.update(repr(k).encode("utf8"))
+            _update_with_value(digest, v)
+    elif hasattr(value, "__getstate__") and not isinstance(value, _simple_types):
+        _update_with_value(digest, value.__getstate__())
+    else:
+        digest.update(repr(value).encode("utf8"))
+
+def _update_with_model(digest, model: torch.nn.Module) -> None:
+    for name, value in sorted(model.state_dict().items()):
+        digest.update(name.encode("utf8"))
+        _update_with_value(digest, value)
+    for name, module in model.named_modules():
+        digest.update(json.dumps([name, _simple_attributes(module)]).encode("utf8"))
+
+def get_pipeline_fingerprint(pipeline) -> str:
+    """
+    Fingerprints everything a pipeline's outputs depend on: the weights and settings of its models,
+    the settings of its dataset readers (and their filters), and its own thresholds and flags.
+    """
+    if hasattr(pipeline, "load_models"):
+        pipeline.load_models()
+    digest = hashlib.sha1()
+    digest.update(type(pipeline).__name__.encode("utf8"))
+    digest.update(json.dumps(_simple_attributes(pipeline)).encode("utf8"))
+    for name, value in sorted(vars(pipeline).items()):
+        if isinstance(value, torch.nn.Module):
+            digest.update(name.encode("utf8"))
+            _update_with_model(digest, value)
+        elif hasattr(value, "__dict__") and not isinstance(value, _simple_types):
+            # e.g., dataset readers, along with their filters and instance readers
+            digest.update(json.dumps([name, type(value).__name__, _simple_attributes(value)]).encode("utf8"))
+            for sub_name, sub_value in sorted(vars(value).items()):
+                if hasattr(sub_value, "__dict__") and not isinstance(sub_value, torch.nn.Module):
+                    digest.update(json.dumps([sub_name, type(sub_value).__name__, _simple_attributes(sub_value)]).encode("utf8"))
+    return digest.hexdigest()
+
+def get_sentence_key(input_json: JsonDict) -> JsonDict:
+    # everything in an input sentence apart from its id: besides the tokens and verbs, some pipelines read
+    # other fields (e.g., the gold question labels' answer spans and the argument spans in the sequential
+    # answer-first pipeline), so keying on a fixed subset would return outputs computed from other inputs
+    return {k: v for k, v in input_json.items() if k != "sentenceId"}
+
+class PredictionCache():
+    """
+    Wraps a pipeline's ``predict_batch`` (or ``predict``) so that sentences whose outputs are already in the
+    SQLite database at ``cache_file`` are returned from there, and only the rest are run through the models.
+    Entries are keyed by a hash of the sentence key and the pipeline fingerprint, so a changed model,
+    threshold, or reader setting never returns stale outputs. Keeps hit statistics for ``report``.
+    """
+    def __init__(self, pipeline, cache_file: str) -> None:
+        if hasattr(pipeline, "predict_batch"):
+            self._predict_batch = pipeline.predict_batch
+        else:
+            self._predict_batch = lambda inputs_list: [pipeline.predict(inputs) for inputs in inputs_list]
+        self._cache_file = cache_file
+        self._fingerprint = get_pipeline_fingerprint(pipeline)
+        # connections are opened lazily in each process, since sharded runs fork after the cache is created
+        self._connection = None
+        self._connection_pid = None
+        self.num_sentences = 0
+        self.num_hits = 0
+        self._model_time = 0.0
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self._cache_file, timeout = 60.0)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, output TEXT)")
+            self._connection.commit()
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _get_key(self, input_json: JsonDict) -> str:
+        key_json = json.dumps([self._fingerprint, get_sentence_key(input_json)], sort_keys = True)
+        return hashlib.sha1(key_json.encode("utf8")).hexdigest()
+
+    def predict_batch(self, inputs_list: List[JsonDict]) -> List[JsonDict]:
+        connection = self._get_connection()
+        keys = [self._get_key(inputs) for inputs in inputs_list]
+        cached_outputs: Dict[str, JsonDict] = {}
+        for key in set(keys):
+            row = connection.execute("SELECT output FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                cached_outputs[key] = json.loads(row[0])
+        miss_indices = [i for i, key in enumerate(keys) if key not in cached_outputs]
+        if len(miss_indices) > 0:
+            start_time = time.time()
+            miss_outputs = self._predict_batch([inputs_list[i] for i in miss_indices])
+            self._model_time += time.time() - start_time
+            connection.executemany(
+                "INSERT OR REPLACE INTO predictions (key, output) VALUES (?, ?)",
+                [(keys[i], json.dumps(output)) for i, output in zip(miss_indices, miss_outputs)])
+            connection.commit()
+        else:
+            miss_outputs = []
+        miss_outputs_iter = iter(miss_outputs)
+        outputs = []
+        for inputs, key in zip(inputs_list, keys):
+            if key in cached_outputs:
+                # everything but the sentence id is determined by the key
+                outputs.append({**cached_outputs[key], "sentenceId": inputs["sentenceId"]})
+            else:
+                outputs.append(next(miss_outputs_iter))
+        self.num_sentences += len(inputs_list)
+        self.num_hits += len(inputs_list) - len(miss_indices)
+        return outputs
+
+    def report(self) -> None:
+        num_misses = self.num_sentences - self.num_hits
+        hit_rate = self.num_hits / max(self.num_sentences, 1)
+        # estimate the time saved from the model time per sentence on cache misses
+        time_saved = self.num_hits * (self._model_time / num_misses) if num_misses > 0 else 0.0
+        print("Prediction cache: %d / %d sentences from cache (%.1f%% hit rate), ~%.1fs of model time saved" % (
+            self.num_hits, self.num_sentences, 100 * hit_rate, time_saved), file = sys.stderr, flush = True)
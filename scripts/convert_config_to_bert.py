@@ -1,5 +1,5 @@
 """ Usage:
-    <file-name> --in=IN_FILE --out=OUT_FILE [--debug]
+    <file-name> --in=IN_FILE --out=OUT_FILE [--wordpiece-cache=CACHE_FILE] [--debug]
 """
 # External imports
 import logging
@@ -51,12 +51,17 @@ if __name__ == "__main__":
     inp_fn = args["--in"]
     out_fn = args["--out"]
     debug = args["--debug"]
+    wordpiece_cache_fn = args["--wordpiece-cache"]
     if debug:
         logging.basicConfig(level = logging.DEBUG)
     else:
         logging.basicConfig(level = logging.INFO)
 
     cur_config = json.loads(_jsonnet.evaluate_file(inp_fn))
+    if wordpiece_cache_fn is not None:
+        # reuse wordpiece ids and offsets across verbs, epochs and runs
+        bert_token_indexers["bert"]["type"] = "bert-pretrained-cached"
+        bert_token_indexers["bert"]["cache_file"] = wordpiece_cache_fn
     cur_config["dataset_reader"]["token_indexers"] = bert_token_indexers
     cur_config["model"]["sentence_encoder"]["text_field_embedder"] = bert_text_field_embedder
     cur_config["model"]["sentence_encoder"]["stacked_encoder"]["input_size"] = 868